@@ -1,106 +1,178 @@
-import requests
-import time
-from db import get_connection
-from portfolio_utils import get_all_portfolio_ids, get_unique_tickers_by_portfolio
-import mysql.connector
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils import http_client
+from db import db_connection, IntegrityError, upsert_sql
+from portfolio_utils import get_all_portfolio_ids, get_user_holdings
+from portfolio_stats import Holdings
 from config import FINNHUB_API_KEY, FMP_API_KEY, FINNHUB_BASE_URL, FMP_PROFILE_URL
+from utils.metric_store import metric_store
+from utils.screener_index import ScreenerIndex
+from utils.log import get_logger
+from utils.metrics import span
 
 API_KEY = FINNHUB_API_KEY
 BASE_URL = FINNHUB_BASE_URL
 
+logger = get_logger("qre")
+
+# Portfolios of a run are processed in parallel on this pool. Every worker
+# goes through http_client, so they all draw from the same per-provider
+# rate limits and a larger pool cannot exceed the upstream budget.
+QRE_WORKERS = int(os.getenv("QRE_WORKERS", "4"))
+# Recommendation runs one user may have in flight; the synchronous endpoint
+# answers 429 beyond it and jobs wait for a free slot
+QRE_MAX_RUNS_PER_USER = int(os.getenv("QRE_MAX_RUNS_PER_USER", "1"))
+_executor = ThreadPoolExecutor(max_workers=QRE_WORKERS, thread_name_prefix="qre")
+
+class _PortfolioLock:
+    """threading.Lock that can be weakly referenced (the C lock can't)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquire = self._lock.acquire
+        self.release = self._lock.release
+        # Holdings the last successful run under this lock worked from
+        self.completed_holdings = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        return False
+
+# One lock per portfolio: runs for different portfolios (or users) never wait
+# on each other, and a run that finds a portfolio in progress waits for that
+# result instead of computing it twice, as long as that run read the same
+# holdings. Entries live only while a run holds or waits on them, so deleted
+# portfolios leave nothing behind.
+_portfolio_locks = weakref.WeakValueDictionary()
+_portfolio_locks_lock = threading.Lock()
+
+def portfolio_lock(portfolio_id):
+    with _portfolio_locks_lock:
+        lock = _portfolio_locks.get(portfolio_id)
+        if lock is None:
+            lock = _portfolio_locks[portfolio_id] = _PortfolioLock()
+        return lock
+
+_user_slots = weakref.WeakValueDictionary()
+_user_slots_lock = threading.Lock()
+
+def user_run_slot(user_id):
+    """Semaphore bounding a user's concurrent runs at QRE_MAX_RUNS_PER_USER."""
+    with _user_slots_lock:
+        slot = _user_slots.get(user_id)
+        if slot is None:
+            slot = _user_slots[user_id] = threading.BoundedSemaphore(QRE_MAX_RUNS_PER_USER)
+        return slot
+
 # --- DB Helper Functions ---
 def update_stock_beta_marketcap(portfolio_id, ticker, beta, market_cap):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE stock SET beta=%s, market_cap=%s WHERE portfolio_id=%s AND stock_ticker=%s", (beta, market_cap, portfolio_id, ticker))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE stock SET beta=%s, market_cap=%s WHERE portfolio_id=%s AND stock_ticker=%s", (beta, market_cap, portfolio_id, ticker))
+        cur.close()
+
+def update_stock_beta_marketcaps(portfolio_id, rows):
+    """rows: (ticker, beta, market_cap) tuples, written in one transaction."""
+    if not rows:
+        return
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "UPDATE stock SET beta=%s, market_cap=%s WHERE portfolio_id=%s AND stock_ticker=%s",
+            [(beta, market_cap, portfolio_id, ticker) for ticker, beta, market_cap in rows]
+        )
+        cur.close()
 
 def update_portfolio_ranges(portfolio_id, min_beta, max_beta, min_market_cap, max_market_cap):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE portfolio SET min_beta=%s, max_beta=%s, min_market_cap=%s, max_market_cap=%s WHERE portfolio_id=%s", (min_beta, max_beta, min_market_cap, max_market_cap, portfolio_id))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE portfolio SET min_beta=%s, max_beta=%s, min_market_cap=%s, max_market_cap=%s WHERE portfolio_id=%s", (min_beta, max_beta, min_market_cap, max_market_cap, portfolio_id))
+        cur.close()
 
 def clear_recommendations(portfolio_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM recommendation WHERE portfolio_id=%s", (portfolio_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM recommendation WHERE portfolio_id=%s", (portfolio_id,))
+        cur.close()
 
 def insert_recommendation(portfolio_id, ticker, beta, market_cap, eps, pe_ratio, company_name):
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            "INSERT INTO recommendation (portfolio_id, stock_ticker, beta, market_cap, eps, pe_ratio, company_name) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (portfolio_id, ticker, beta, market_cap, eps, pe_ratio, company_name)
-        )
-        conn.commit()
-    except mysql.connector.IntegrityError:
-        print(f"Duplicate recommendation for ({portfolio_id}, {ticker}) skipped.")
-    finally:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    "INSERT INTO recommendation (portfolio_id, stock_ticker, beta, market_cap, eps, pe_ratio, company_name) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    (portfolio_id, ticker, beta, market_cap, eps, pe_ratio, company_name)
+                )
+            finally:
+                cur.close()
+    except IntegrityError:
+        logger.debug(f"Duplicate recommendation for ({portfolio_id}, {ticker}) skipped.")
+
+RECOMMENDATION_COLUMNS = ('portfolio_id', 'stock_ticker', 'beta', 'market_cap', 'eps', 'pe_ratio', 'company_name')
+
+def save_recommendations(portfolio_id, rows):
+    """Replace a portfolio's recommendations with rows in one transaction.
+
+    rows: (ticker, beta, market_cap, eps, pe_ratio, company_name). Tickers
+    recommended again keep their recommendation row and get the new values;
+    readers never see the portfolio without recommendations mid-run.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        tickers = [row[0] for row in rows]
+        if tickers:
+            cur.execute(
+                f"DELETE FROM recommendation WHERE portfolio_id=%s AND stock_ticker NOT IN ({', '.join(['%s'] * len(tickers))})",
+                [portfolio_id] + tickers
+            )
+            cur.executemany(
+                upsert_sql('recommendation', RECOMMENDATION_COLUMNS, ('portfolio_id', 'stock_ticker'), RECOMMENDATION_COLUMNS[2:]),
+                [(portfolio_id,) + tuple(row) for row in rows]
+            )
+        else:
+            cur.execute("DELETE FROM recommendation WHERE portfolio_id=%s", (portfolio_id,))
         cur.close()
-        conn.close()
 
 def get_stock_name_from_db(portfolio_id, ticker):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT stock_name FROM stock WHERE portfolio_id = %s AND stock_ticker = %s LIMIT 1", (portfolio_id, ticker))
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT stock_name FROM stock WHERE portfolio_id = %s AND stock_ticker = %s LIMIT 1", (portfolio_id, ticker))
+        result = cur.fetchone()
+        cur.close()
     return result[0] if result else None
 
 # --- Existing QRE Functions (unchanged) ---
 def get_beta(symbol):
-    url = f"{BASE_URL}/stock/metric"
-    params = {'symbol': symbol, 'metric': 'all', 'token': API_KEY}
-    try:
-        response = requests.get(url, params=params, timeout=10)
-    except Exception as e:
-        print(f"[QRE] get_beta: Exception for {symbol}: {e}")
-        return None
-    if response.status_code != 200:
-        print(f"[QRE] get_beta: Bad status {response.status_code} for {symbol}")
-        return None
-    return response.json().get('metric', {}).get('beta')
+    return metric_store.get_beta(symbol)
 
 def get_market_cap(symbol):
-    url = f"{BASE_URL}/stock/metric"
-    params = {'symbol': symbol, 'metric': 'all', 'token': API_KEY}
-    try:
-        response = requests.get(url, params=params, timeout=10)
-    except Exception as e:
-        print(f"[QRE] get_market_cap: Exception for {symbol}: {e}")
-        return None
-    if response.status_code != 200:
-        print(f"[QRE] get_market_cap: Bad status {response.status_code} for {symbol}")
-        return None
-    market_cap_million = response.json().get('metric', {}).get('marketCapitalization')
-    if market_cap_million is None:
-        print(f"[QRE] get_market_cap: No market cap for {symbol}")
-        return None
-    return market_cap_million * 1_000_000  # Convert to absolute USD
+    market_cap = metric_store.get_market_cap(symbol)
+    if market_cap is None:
+        logger.debug(f"[QRE] get_market_cap: No market cap for {symbol}")
+    return market_cap
 
 def get_all_us_tickers():
     url = f"{BASE_URL}/stock/symbol"
     params = {'exchange': 'US', 'token': API_KEY}
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_client.get(url, params=params, provider='finnhub')
     except Exception as e:
-        print(f"[QRE] get_all_us_tickers: Exception: {e}")
+        logger.warning(f"[QRE] get_all_us_tickers: Exception: {e}")
         raise
     if response.status_code != 200:
-        print(f"[QRE] get_all_us_tickers: Bad status {response.status_code}")
+        logger.warning(f"[QRE] get_all_us_tickers: Bad status {response.status_code}")
         raise Exception(f"Failed to get US tickers: {response.status_code}")
     return [item['symbol'] for item in response.json() if 'symbol' in item]
 
+screener_index = ScreenerIndex(symbol_source=get_all_us_tickers)
+
 def get_reference_ranges_old(base_tickers):
     betas = []
     market_caps = []
@@ -114,62 +186,25 @@ def get_reference_ranges_old(base_tickers):
     return min(betas), max(betas), min(market_caps), max(market_caps)
 
 def get_reference_ranges(beta_min, beta_max, marketcap_min, marketcap_max, num_shares, base_tickers):
-    url = f"{BASE_URL}/stock/metric"
-    print(f"[DEBUG] get_reference_ranges: beta_min={beta_min}, beta_max={beta_max}, marketcap_min={marketcap_min}, marketcap_max={marketcap_max}")
-    print(f"[DEBUG] get_reference_ranges: num_shares={num_shares}, base_tickers={base_tickers}")
-    weighted_betas = []
-    weighted_market_caps = []
-    index = 0
-    for symbol in base_tickers:
-        print(f"[DEBUG] Loop index={index}, symbol={symbol}, num_shares={num_shares}")
-        if(index >= len(num_shares)):
-            print(f"[ERROR] Index {index} out of range for num_shares (len={len(num_shares)})")
-            break
-        try:
-            shares = float(num_shares[index])
-        except Exception as e:
-            print(f"[ERROR] Could not convert num_shares[{index}] to float: {num_shares[index]} ({e})")
-            shares = 1
-        
-        params = {'symbol': symbol, 'metric': 'all', 'token': API_KEY}
-        fail_flag = False
-        try:
-            response = requests.get(url, params=params, timeout=10)
-        except Exception as e:
-            print(f"[QRE] get_beta: Exception for {symbol}: {e}")
-            fail_flag = True
-        if response.status_code != 200:
-            print(f"[QRE] get_beta: Bad status {response.status_code} for {symbol}")
-            fail_flag = True
-        if(not fail_flag):
-            data = response.json().get('metric', {})
-            beta_val = data.get('beta')
-            market_cap_million = data.get('marketCapitalization')
-            market_cap_val = market_cap_million * 1_000_000
-        else:
-            beta_val = None
-            market_cap_val = None
-
-        print(f"[DEBUG] shares={shares}, beta_val={beta_val}, market_cap_val={market_cap_val}")
-        weighted_beta = shares * beta_val if beta_val is not None else None
-        weighted_market_cap = shares * market_cap_val if market_cap_val is not None else None
-        index += 1
-        if weighted_beta is not None:
-            weighted_betas.append(weighted_beta)
-        if weighted_market_cap is not None:
-            weighted_market_caps.append(weighted_market_cap)
-    print(f"[DEBUG] weighted_betas={weighted_betas}, weighted_market_caps={weighted_market_caps}")
-    total_shares = sum(float(shares) for shares in num_shares)
-    print(f"[DEBUG] total_shares={total_shares}")
-    wavg_beta = sum(weighted_betas) / total_shares if total_shares else 0
-    wavg_market_cap = sum(weighted_market_caps) / total_shares if total_shares else 0
-    print(f"[DEBUG] wavg_beta={wavg_beta}, wavg_market_cap={wavg_market_cap}")
+    holdings = Holdings.from_rows((0, ticker, shares) for ticker, shares in zip(base_tickers, num_shares))
+    stats = holdings.metric_stats(
+        holdings.vector({ticker: metric_store.get_beta(ticker) for ticker in holdings.tickers}),
+        holdings.vector({ticker: metric_store.get_market_cap(ticker) for ticker in holdings.tickers})
+    )
+    wavg = stats.get(0, {'wavg_beta': 0, 'wavg_market_cap': 0})
+    return compute_reference_ranges(
+        beta_min, beta_max, marketcap_min, marketcap_max,
+        wavg['wavg_beta'], wavg['wavg_market_cap'], len(base_tickers)
+    )
+
+def compute_reference_ranges(beta_min, beta_max, marketcap_min, marketcap_max, wavg_beta, wavg_market_cap, num_tickers):
+    logger.debug(f"[DEBUG] compute_reference_ranges: wavg_beta={wavg_beta}, wavg_market_cap={wavg_market_cap}")
     beta_range_min = 0
     beta_range_max = 0
     marketcap_range_min = 0
     marketcap_range_max = 0
 
-    if(len(base_tickers) == 1):
+    if(num_tickers == 1):
         beta_range_min = wavg_beta * 0.8
         beta_range_max = wavg_beta * 1.2
         marketcap_range_min = wavg_market_cap * 0.7
@@ -210,13 +245,13 @@ def get_reference_ranges(beta_min, beta_max, marketcap_min, marketcap_max, num_s
             marketcap_range_min = marketcap_min
     return beta_range_min, beta_range_max, marketcap_range_min, marketcap_range_max
 
-def find_stocks_in_range(
+def find_stocks_in_range_fmp(
     beta_min, beta_max,
     marketcap_min, marketcap_max,
     #base_tickers,
     max_results=10,
     exchange='NASDAQ',
-    api_key='3EHPmW2y9saNG3kZxJInX30llXdjaaar'
+    api_key=None
 ):
     url = 'https://financialmodelingprep.com/api/v3/stock-screener'
     params = {
@@ -226,15 +261,15 @@ def find_stocks_in_range(
         'marketCapLowerThan': marketcap_max,
         'limit': max_results * 2,
         'exchange': exchange,
-        'apikey': api_key
+        'apikey': api_key or FMP_API_KEY
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_client.get(url, params=params, provider='fmp')
     except Exception as e:
-        print(f"[QRE] find_stocks_in_range: Exception: {e}")
+        logger.warning(f"[QRE] find_stocks_in_range: Exception: {e}")
         raise
     if response.status_code != 200:
-        print(f"[QRE] find_stocks_in_range: Bad status {response.status_code}")
+        logger.warning(f"[QRE] find_stocks_in_range: Bad status {response.status_code}")
         raise Exception(f"FMP API request failed: {response.status_code}")
     data = response.json()
     #base_set = set(base_tickers)
@@ -250,78 +285,45 @@ def find_stocks_in_range(
             break
     return filtered
 
-def get_eps_finnhub(symbol, api_key):
-    url = 'https://finnhub.io/api/v1/stock/metric'
-    params = {
-        'symbol': symbol,
-        'metric': 'all',
-        'token': api_key
-    }
-    try:
-        response = requests.get(url, params=params, timeout=10)
-    except Exception as e:
-        print(f"[QRE] get_eps_finnhub: Exception for {symbol}: {e}")
-        return None
-    if response.status_code != 200:
-        print(f"Finnhub EPS API error for {symbol}: {response.status_code} {response.text}")
-        return None
-    data = response.json().get('metric', {})
-    eps = data.get('epsInclExtraItemsTTM') or data.get('epsTTM')
+def find_stocks_in_range(
+    beta_min, beta_max,
+    marketcap_min, marketcap_max,
+    max_results=10,
+    exchange='NASDAQ',
+    api_key=None
+):
+    # Answer from the local screener snapshot once it is warm; FMP only covers the cold start
+    if screener_index.is_ready():
+        return [
+            {'symbol': stock['symbol'], 'beta': round(stock['beta'], 2), 'market_cap': round(stock['market_cap'], 2)}
+            for stock in screener_index.query(beta_min, beta_max, marketcap_min, marketcap_max, limit=max_results)
+        ]
+    logger.info("[QRE] find_stocks_in_range: screener index not ready, using FMP")
+    return find_stocks_in_range_fmp(
+        beta_min, beta_max, marketcap_min, marketcap_max,
+        max_results=max_results, exchange=exchange, api_key=api_key
+    )
+
+def get_eps_finnhub(symbol, api_key=None):
+    eps = metric_store.get_eps(symbol)
     if eps is None:
-        print(f"Finnhub EPS missing for {symbol}. Full response: {response.json()}")
+        logger.debug(f"Finnhub EPS missing for {symbol}.")
     return eps
 
-def get_pe_finnhub(symbol, api_key):
-    url = 'https://finnhub.io/api/v1/stock/metric'
-    params = {
-        'symbol': symbol,
-        'metric': 'all',
-        'token': api_key
-    }
-    try:
-        response = requests.get(url, params=params, timeout=10)
-    except Exception as e:
-        print(f"[QRE] get_pe_finnhub: Exception for {symbol}: {e}")
-        return None
-    if response.status_code != 200:
-        print(f"Finnhub PE API error for {symbol}: {response.status_code} {response.text}")
-        return None
-    data = response.json().get('metric', {})
-    pe = data.get('peTTM') or data.get('peNormalizedAnnual')
+def get_pe_finnhub(symbol, api_key=None):
+    pe = metric_store.get_pe(symbol)
     if pe is None:
-        print(f"Finnhub PE missing for {symbol}. Full response: {response.json()}")
+        logger.debug(f"Finnhub PE missing for {symbol}.")
     return pe
 
-def get_eps_and_pe_finnhub(stocks, api_key):
+def get_eps_and_pe_finnhub(stocks, api_key=None):
     enriched_stocks = []
-    url = 'https://finnhub.io/api/v1/stock/metric'
     for stock in stocks:
         symbol = stock['symbol']
-        params = {
-            'symbol': symbol,
-            'metric': 'all',
-            'token': api_key
-        }
-        fail_flag = False
-        try:
-            response = requests.get(url, params=params, timeout=10)
-        except Exception as e:
-            print(f"[QRE] get_eps_and_pe_finnhub: Exception for {symbol}: {e}")
-            fail_flag = True
-        if response.status_code != 200:
-            print(f"Finnhub EPS/PE API error for {symbol}: {response.status_code} {response.text}")
-            fail_flag = True
-        
-        if not fail_flag:
-            data = response.json().get('metric', {})
-            eps = data.get('epsInclExtraItemsTTM') or data.get('epsTTM')
-            pe = data.get('peTTM') or data.get('peNormalizedAnnual')
-        else:
-            eps = None
-            pe = None
-
+        eps = metric_store.get_eps(symbol)
+        pe = metric_store.get_pe(symbol)
         if eps is None or pe is None:
-            print(f"Skipping {symbol} (missing EPS or P/E)")
+            logger.debug(f"Skipping {symbol} (missing EPS or P/E)")
             continue
         enriched_stocks.append({
             'symbol': symbol,
@@ -330,7 +332,6 @@ def get_eps_and_pe_finnhub(stocks, api_key):
             'eps': round(eps, 2),
             'pe_ratio': round(pe, 2)
         })
-        time.sleep(0.05)
     return enriched_stocks
 
 def suggest_top_stocks(stocks):
@@ -340,122 +341,168 @@ def suggest_top_stocks(stocks):
     return ranked[:5]
 
 def get_company_name(symbol):
-    print(f"Calling Finnhub for {symbol}")
+    logger.debug(f"Calling Finnhub for {symbol}")
     url = f"{BASE_URL}/stock/profile2"
     params = {'symbol': symbol, 'token': API_KEY}
-    response = requests.get(url, params=params)
-    print(f"Response status: {response.status_code}")
+    with span('company_name'):
+        response = http_client.get(url, params=params, provider='finnhub')
+    logger.debug("Response status: %s", response.status_code)
     if response.status_code != 200:
-        print(f"Error fetching company name for {symbol}: {response.status_code} {response.text}")
+        logger.warning(f"Error fetching company name for {symbol}: {response.status_code} {response.text}")
         return None
-    print(f"API response for {symbol}: {response.json()}")
-    return response.json().get('name')
+    profile = response.json()
+    logger.debug("API response for %s: %s", symbol, profile)
+    return profile.get('name')
 
 # --- Main QRE Workflow ---
-def main(user_id=1):
-    print("=== QRE_new.py MAIN FUNCTION STARTED ===")
-    portfolio_ids = get_all_portfolio_ids(user_id)
-    print(f"[DEBUG] main: portfolio_ids={portfolio_ids}")
-    for portfolio_id in portfolio_ids:
-        print(f"\nProcessing Portfolio ID: {portfolio_id}")
-        tickers = get_unique_tickers_by_portfolio(portfolio_id)
-        print(f"Portfolio {portfolio_id} Stocks: {tickers}")
-        # 1. Update stock table with beta and market cap
-        betas = []
-        market_caps = []
-
-        #number of shares dummy stuff
-        num_shares = []
-        # Fetch num_shares for all tickers in this portfolio
-        conn = get_connection()
-        cur = conn.cursor()
-        format_strings = ','.join(['%s'] * len(tickers))
-        print(f"[DEBUG] main: format_strings={format_strings}, tickers={tickers}")
-        cur.execute(f"SELECT stock_ticker, num_shares FROM stock WHERE portfolio_id = %s AND stock_ticker IN ({format_strings})", [portfolio_id] + tickers)
-        shares_dict = {row[0]: row[1] for row in cur.fetchall()}
-        print(f"[DEBUG] main: shares_dict={shares_dict}")
-        cur.close()
-        conn.close()
-        url = f"{BASE_URL}/stock/metric"
-        for ticker in tickers:
-            shares = shares_dict.get(ticker, 1) # default to 1 if not found
-            num_shares.append(shares)
-
-            params = {'symbol': ticker, 'metric': 'all', 'token': API_KEY}
-            fail_flag = False
-            try:
-                response = requests.get(url, params=params, timeout=10)
-            except Exception as e:
-                print(f"[QRE] get_beta: Exception for {ticker}: {e}")
-                fail_flag = True
-            if response.status_code != 200:
-                print(f"[QRE] get_beta: Bad status {response.status_code} for {ticker}")
-                fail_flag = True
-            
-            if not fail_flag:
-                data = response.json().get('metric', {})
-                beta = data.get('beta')
-                market_cap_million = data.get('marketCapitalization')
-                market_cap = market_cap_million * 1_000_000
-            else:
-                beta = None
-                market_cap = None
-
-            update_stock_beta_marketcap(portfolio_id, ticker, beta, market_cap)
-            print(f"Updated {ticker}: beta={beta}, market_cap={market_cap}, num_shares={shares}")
-            if beta is not None:
-                betas.append(beta)
-            if market_cap is not None:
-                market_caps.append(market_cap)
-            time.sleep(0.05)
-        print(f"[DEBUG] main: num_shares={num_shares}, betas={betas}, market_caps={market_caps}")
-        # 2. Calculate min/max and update portfolio table
-        if betas and market_caps:
-            min_beta, max_beta = min(betas), max(betas)
-            min_market_cap, max_market_cap = min(market_caps), max(market_caps)
-            update_portfolio_ranges(portfolio_id, min_beta, max_beta, min_market_cap, max_market_cap)
-            print(f"Portfolio Beta Range: {min_beta:.2f} – {max_beta:.2f}")
-            print(f"Portfolio Market Cap Range: {min_market_cap:.2f} – {max_market_cap:.2f} USD")
-        else:
-            print("No valid beta or market cap data for this portfolio.")
-            continue
-
-        # 2.5 Calculate min max range based on wavg
+def recommend_for_portfolio(portfolio_id, stats, num_tickers):
+    # 2.5 Calculate min max range based on wavg
+    beta_range_min, beta_range_max, marketcap_range_min, marketcap_range_max = compute_reference_ranges(
+        stats['min_beta'], stats['max_beta'], stats['min_market_cap'], stats['max_market_cap'],
+        stats['wavg_beta'], stats['wavg_market_cap'], num_tickers
+    )
+    logger.debug(f"[DEBUG] main: beta_range_min={beta_range_min}, beta_range_max={beta_range_max}, marketcap_range_min={marketcap_range_min}, marketcap_range_max={marketcap_range_max}")
 
-        beta_range_min, beta_range_max, marketcap_range_min, marketcap_range_max = get_reference_ranges(min_beta, max_beta, min_market_cap, max_market_cap, num_shares, tickers)
-        print(f"[DEBUG] main: beta_range_min={beta_range_min}, beta_range_max={beta_range_max}, marketcap_range_min={marketcap_range_min}, marketcap_range_max={marketcap_range_max}")
-
-        # 3. Find and store recommendations
-        print("Finding and storing recommendations...")
-        clear_recommendations(portfolio_id)
+    # 3. Find and store recommendations
+    logger.info("Finding and storing recommendations...")
+    with span('screen', portfolio_id=portfolio_id):
         matches = find_stocks_in_range(
             beta_range_min, beta_range_max,
             marketcap_range_min, marketcap_range_max,
-            #tickers,
             max_results=10
         )
-        print(f"[DEBUG] main: matches={matches}")
+    logger.debug("[DEBUG] main: matches=%s", matches)
+    with span('finnhub_metrics', symbols=len(matches)):
         enriched = get_eps_and_pe_finnhub(matches, api_key=API_KEY)
-        print(f"[DEBUG] main: enriched={enriched}")
-        # Deduplicate by stock symbol
-        seen = set()
-        unique_enriched = []
-        for stock in enriched:
-            if stock['symbol'] not in seen:
-                unique_enriched.append(stock)
-                seen.add(stock['symbol'])
-        print(f"[DEBUG] main: unique_enriched={unique_enriched}")
-        for stock in unique_enriched:
-            print(f"About to fetch company name for {stock['symbol']}")
-            company_name = get_company_name(stock['symbol'])
-            print(f"Fetched company name for {stock['symbol']}: {company_name}")
-            # time.sleep(0.05) time.sleep not required here 
-            insert_recommendation(portfolio_id, stock['symbol'], stock['beta'], stock['market_cap'], stock['eps'], stock['pe_ratio'], company_name)
-            print(f"Recommended: {stock['symbol']} EPS={stock['eps']} P/E={stock['pe_ratio']} Name={company_name}")
-        print("Top 5 Stock Suggestions (based on EPS / P/E ratio):")
-        top_5 = suggest_top_stocks(unique_enriched)
-        for stock in top_5:
-            print(f"{stock['symbol']}: EPS={stock['eps']}, P/E={stock['pe_ratio']}, Score={round(stock['eps']/stock['pe_ratio'], 2)}")
+    logger.debug("[DEBUG] main: enriched=%s", enriched)
+    # Deduplicate by stock symbol
+    seen = set()
+    unique_enriched = []
+    for stock in enriched:
+        if stock['symbol'] not in seen:
+            unique_enriched.append(stock)
+            seen.add(stock['symbol'])
+    logger.debug("[DEBUG] main: unique_enriched=%s", unique_enriched)
+    rows = []
+    for stock in unique_enriched:
+        logger.debug(f"About to fetch company name for {stock['symbol']}")
+        company_name = get_company_name(stock['symbol'])
+        logger.debug(f"Fetched company name for {stock['symbol']}: {company_name}")
+        rows.append((stock['symbol'], stock['beta'], stock['market_cap'], stock['eps'], stock['pe_ratio'], company_name))
+        logger.debug(f"Recommended: {stock['symbol']} EPS={stock['eps']} P/E={stock['pe_ratio']} Name={company_name}")
+    save_recommendations(portfolio_id, rows)
+    logger.debug("Top 5 Stock Suggestions (based on EPS / P/E ratio):")
+    top_5 = suggest_top_stocks(unique_enriched)
+    for stock in top_5:
+        logger.debug(f"{stock['symbol']}: EPS={stock['eps']}, P/E={stock['pe_ratio']}, Score={round(stock['eps']/stock['pe_ratio'], 2)}")
+
+def main(user_id=1, progress=None, portfolio_ids=None):
+    """Refresh recommendations for a user's portfolios (or the given subset of them).
+
+    Portfolios run in parallel on the QRE pool. Returns {portfolio_id: status}
+    with status 'done', 'joined' (another run with the same holdings for the
+    portfolio was already on it, and that run's result is used as-is), or
+    'skipped' (no beta/market cap data). A run that waited on another one
+    which read different holdings computes the portfolio again and reports
+    'done'.
+    """
+    logger.info("=== QRE_new.py MAIN FUNCTION STARTED ===")
+    with span('qre', user_id=user_id):
+        return recommend_for_user(user_id, progress, portfolio_ids)
+
+def recommend_for_user(user_id, progress=None, portfolio_ids=None):
+    user_portfolio_ids = get_all_portfolio_ids(user_id)
+    if portfolio_ids is None:
+        portfolio_ids = user_portfolio_ids
+    else:
+        requested = set(portfolio_ids)
+        portfolio_ids = [portfolio_id for portfolio_id in user_portfolio_ids if portfolio_id in requested]
+    logger.debug(f"[DEBUG] main: portfolio_ids={portfolio_ids}")
+    wanted = set(portfolio_ids)
+    rows = [row for row in get_user_holdings(user_id) if row[0] in wanted]
+    holdings = Holdings.from_rows(rows, portfolio_ids)
+    holdings_of = {portfolio_id: [] for portfolio_id in portfolio_ids}
+    for portfolio_id, ticker, num_shares in rows:
+        holdings_of[portfolio_id].append((ticker, num_shares))
+
+    # 1. Beta and market cap for every distinct held ticker, fetched in parallel
+    # (metric_store makes one call per symbol however many portfolios hold it)
+    with span('finnhub_metrics', symbols=len(holdings.tickers)):
+        list(_executor.map(metric_store.get_metrics, holdings.tickers))
+        betas = {ticker: metric_store.get_beta(ticker) for ticker in holdings.tickers}
+        market_caps = {ticker: metric_store.get_market_cap(ticker) for ticker in holdings.tickers}
+    logger.debug("[DEBUG] main: betas=%s, market_caps=%s", betas, market_caps)
+
+    # 2. Min/max and weighted averages for all portfolios in one vectorized pass
+    stats = holdings.metric_stats(holdings.vector(betas), holdings.vector(market_caps))
+
+    def run_portfolio(portfolio_id):
+        lock = portfolio_lock(portfolio_id)
+        if not lock.acquire(blocking=False):
+            # Same inputs, same rows: wait for the run in progress rather than redo it
+            logger.info(f"Portfolio {portfolio_id} is already being processed, waiting for it")
+            lock.acquire()
+            if lock.completed_holdings == holdings_of[portfolio_id]:
+                lock.release()
+                return 'joined'
+            # That run failed or read other holdings (e.g. saved since); compute ours
+        lock.completed_holdings = None
+        try:
+            logger.info(f"Processing Portfolio ID: {portfolio_id}")
+            update_stock_beta_marketcaps(portfolio_id, [
+                (ticker, betas[ticker], market_caps[ticker]) for ticker in holdings.tickers_of(portfolio_id)
+            ])
+            portfolio_stats = stats[portfolio_id]
+            if portfolio_stats['min_beta'] is None or portfolio_stats['min_market_cap'] is None:
+                logger.warning(f"No valid beta or market cap data for portfolio {portfolio_id}.")
+                lock.completed_holdings = holdings_of[portfolio_id]
+                return 'skipped'
+            update_portfolio_ranges(
+                portfolio_id, portfolio_stats['min_beta'], portfolio_stats['max_beta'],
+                portfolio_stats['min_market_cap'], portfolio_stats['max_market_cap']
+            )
+            logger.debug(f"Portfolio Beta Range: {portfolio_stats['min_beta']:.2f} – {portfolio_stats['max_beta']:.2f}")
+            logger.debug(f"Portfolio Market Cap Range: {portfolio_stats['min_market_cap']:.2f} – {portfolio_stats['max_market_cap']:.2f} USD")
+            with span('recommend', portfolio_id=portfolio_id):
+                recommend_for_portfolio(portfolio_id, portfolio_stats, len(holdings.tickers_of(portfolio_id)))
+            lock.completed_holdings = holdings_of[portfolio_id]
+            return 'done'
+        finally:
+            lock.release()
+
+    # 3. Fan out across portfolios; every portfolio is attempted even if one fails
+    futures = {_executor.submit(run_portfolio, portfolio_id): portfolio_id for portfolio_id in portfolio_ids}
+    results = {}
+    errors = []
+    pending = set(futures)
+    while pending:
+        if progress:
+            progress('portfolio', len(futures) - len(pending), len(futures))
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logger.warning(f"QRE failed for portfolio {futures[future]}: {e}")
+                errors.append(e)
+    if progress:
+        progress('done', len(portfolio_ids), len(portfolio_ids))
+    if errors:
+        raise errors[0]
+    return {portfolio_id: results[portfolio_id] for portfolio_id in portfolio_ids}
+
+def get_recommendations_for_user(user_id):
+    with db_connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            SELECT DISTINCT r.*, p.portfolio_name
+            FROM recommendation r
+            JOIN portfolio p ON r.portfolio_id = p.portfolio_id
+            WHERE r.portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE user_id = %s)
+        """, (user_id,))
+        recommendations = cur.fetchall()
+        cur.close()
+    return recommendations
 
 if __name__ == "_main_":
     main()
\ No newline at end of file
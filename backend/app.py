@@ -1,6 +1,13 @@
+import os
 from flask import Flask
 from flask_cors import CORS
 from routes.api_routes import api_bp
+from migrations import migrate
+from precompute import scheduler, PRECOMPUTE_ENABLED
+from QRE_new import screener_index
+from utils.log import get_logger
+
+logger = get_logger("app")
 
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:3000'], supports_credentials=True)
@@ -9,6 +16,19 @@ CORS(app, origins=['http://localhost:3000'], supports_credentials=True)
 app.register_blueprint(api_bp)
 
 if __name__ == '__main__':
-    print("🚀 Starting Flask backend server...")
-    print("📍 Backend will be available at: http://localhost:5000")
+    if os.getenv("DB_AUTO_MIGRATE", "1") == "1":
+        try:
+            migrate()
+        except Exception as e:
+            logger.exception(f"❌ Schema migration failed: {e}")
+    try:
+        from utils.sentiment_history import sentiment_history
+        logger.info(f"🧠 Sentiment history loaded for {sentiment_history.rebuild()} tickers")
+    except Exception as e:
+        logger.exception(f"❌ Could not load sentiment history: {e}")
+    if PRECOMPUTE_ENABLED:
+        scheduler.start()
+    screener_index.start()
+    logger.info("🚀 Starting Flask backend server...")
+    logger.info("📍 Backend will be available at: http://localhost:5000")
     app.run(debug=True, use_reloader=False) 
\ No newline at end of file
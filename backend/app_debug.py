@@ -3,7 +3,7 @@ from flask_cors import CORS
 import requests
 from huggingface_hub import InferenceClient
 from datetime import datetime
-import mysql.connector
+from db import db_connection
 from portfolio_utils import get_all_portfolio_ids, get_unique_tickers_by_portfolio
 from save_utils import (
     delete_sentiment_scores_only,
@@ -30,14 +30,6 @@ except Exception as e:
 
 processed_stocks = {}  # To avoid duplicate sentiment fetches
 
-def get_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="tanay282004",
-        database="stock_trading_app"
-    )
-
 def fetch_news(query, page_size=5):
     try:
         params = {
@@ -161,33 +153,31 @@ def save_portfolios():
         
         print(f"💾 Saving {len(portfolios)} portfolios for user {user_id}")
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Clear existing portfolios for this user
-        cursor.execute("DELETE FROM stock WHERE portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE user_id = %s)", (user_id,))
-        cursor.execute("DELETE FROM portfolio WHERE user_id = %s", (user_id,))
+            # Clear existing portfolios for this user
+            cursor.execute("DELETE FROM stock WHERE portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE user_id = %s)", (user_id,))
+            cursor.execute("DELETE FROM portfolio WHERE user_id = %s", (user_id,))
         
-        for portfolio in portfolios:
-            # Insert portfolio
-            cursor.execute(
-                "INSERT INTO portfolio (user_id, portfolio_name) VALUES (%s, %s)",
-                (user_id, portfolio['name'])
-            )
-            portfolio_id = cursor.lastrowid
-            print(f"📁 Created portfolio: {portfolio['name']} (ID: {portfolio_id})")
-            
-            # Insert stocks
-            for stock in portfolio['stocks']:
+            for portfolio in portfolios:
+                # Insert portfolio
                 cursor.execute(
-                    "INSERT INTO stock (portfolio_id, stock_ticker, stock_name) VALUES (%s, %s, %s)",
-                    (portfolio_id, stock['ticker'], stock['name'])
+                    "INSERT INTO portfolio (user_id, portfolio_name) VALUES (%s, %s)",
+                    (user_id, portfolio['name'])
                 )
-                print(f"📈 Added stock: {stock['ticker']} ({stock['name']})")
+                portfolio_id = cursor.lastrowid
+                print(f"📁 Created portfolio: {portfolio['name']} (ID: {portfolio_id})")
+            
+                # Insert stocks
+                for stock in portfolio['stocks']:
+                    cursor.execute(
+                        "INSERT INTO stock (portfolio_id, stock_ticker, stock_name) VALUES (%s, %s, %s)",
+                        (portfolio_id, stock['ticker'], stock['name'])
+                    )
+                    print(f"📈 Added stock: {stock['ticker']} ({stock['name']})")
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         print(f"✅ Successfully saved {len(portfolios)} portfolios")
         
@@ -295,12 +285,11 @@ def analyze_portfolios(user_id):
             save_final_portfolio_sentiment(portfolio_id, final_avg)
             
             # Get portfolio name
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT portfolio_name FROM portfolio WHERE portfolio_id = %s", (portfolio_id,))
-            portfolio_name = cursor.fetchone()[0]
-            cursor.close()
-            conn.close()
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT portfolio_name FROM portfolio WHERE portfolio_id = %s", (portfolio_id,))
+                portfolio_name = cursor.fetchone()[0]
+                cursor.close()
             
             results.append({
                 'portfolio_id': portfolio_id,
@@ -330,42 +319,41 @@ def get_portfolios(user_id):
     try:
         print(f"📊 Fetching portfolios for user {user_id}")
         
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
         
-        # Get portfolios with sentiment scores
-        cursor.execute("""
-            SELECT portfolio_id, portfolio_name, avg_port_sent_score 
-            FROM portfolio 
-            WHERE user_id = %s
-        """, (user_id,))
-        portfolios = cursor.fetchall()
-        
-        results = []
-        for portfolio in portfolios:
-            # Get stocks for this portfolio
+            # Get portfolios with sentiment scores
             cursor.execute("""
-                SELECT stock_ticker, stock_name, avg_stock_sent_score 
-                FROM stock 
-                WHERE portfolio_id = %s
-            """, (portfolio['portfolio_id'],))
-            stocks = cursor.fetchall()
+                SELECT portfolio_id, portfolio_name, avg_port_sent_score 
+                FROM portfolio 
+                WHERE user_id = %s
+            """, (user_id,))
+            portfolios = cursor.fetchall()
+        
+            results = []
+            for portfolio in portfolios:
+                # Get stocks for this portfolio
+                cursor.execute("""
+                    SELECT stock_ticker, stock_name, avg_stock_sent_score 
+                    FROM stock 
+                    WHERE portfolio_id = %s
+                """, (portfolio['portfolio_id'],))
+                stocks = cursor.fetchall()
             
-            results.append({
-                'portfolio_id': portfolio['portfolio_id'],
-                'portfolio_name': portfolio['portfolio_name'],
-                'avg_score': portfolio['avg_port_sent_score'] or 0.0,
-                'stocks': [
-                    {
-                        'ticker': stock['stock_ticker'],
-                        'sentiment': stock['avg_stock_sent_score'] or 0.0
-                    }
-                    for stock in stocks
-                ]
-            })
+                results.append({
+                    'portfolio_id': portfolio['portfolio_id'],
+                    'portfolio_name': portfolio['portfolio_name'],
+                    'avg_score': portfolio['avg_port_sent_score'] or 0.0,
+                    'stocks': [
+                        {
+                            'ticker': stock['stock_ticker'],
+                            'sentiment': stock['avg_stock_sent_score'] or 0.0
+                        }
+                        for stock in stocks
+                    ]
+                })
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         print(f"✅ Retrieved {len(results)} portfolios")
         
@@ -0,0 +1,219 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+PROVIDERS = ('finnhub', 'fmp', 'newsapi', 'hf')
+# Screener results use tickers far from the ones synthetic holdings get
+SCREENER_TICKER_OFFSET = 400000
+
+def _unit(*parts):
+    """Deterministic value in [0, 1) for the given parts."""
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+class UpstreamSettings:
+    """Behaviour of one fake provider.
+
+    latency_ms (+ uniform jitter_ms) is slept before every answer,
+    error_rate is the share of requests answered with error_status, and
+    payload_size is how many items list endpoints return (articles per
+    NewsAPI query, rows per FMP screen, symbols in the Finnhub universe).
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=500, payload_size=10):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.payload_size = payload_size
+
+class FakeUpstream:
+    """A local HTTP server answering like one upstream provider and counting calls."""
+
+    def __init__(self, provider, settings=None, seed=0):
+        self.provider = provider
+        self.settings = settings or UpstreamSettings()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.by_path = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{self.provider}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls = 0
+            self.errors = 0
+            self.by_path = {}
+
+    def counts(self):
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors, 'by_path': dict(self.by_path)}
+
+    def _record(self, path):
+        # Returns True when this request should fail
+        with self._lock:
+            self.calls += 1
+            self.by_path[path] = self.by_path.get(path, 0) + 1
+            failed = self._random.random() < self.settings.error_rate
+            if failed:
+                self.errors += 1
+            delay = (self.settings.latency_ms + self._random.uniform(0, self.settings.jitter_ms)) / 1000.0
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+            # Headers and body go out as separate writes; without this Nagle adds ~40 ms per response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, body=None):
+                parts = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                if upstream._record(parts.path):
+                    status = upstream.settings.error_status
+                    self._send(status, {'error': 'injected failure'}, {'Retry-After': '0'} if status == 429 else None)
+                    return
+                status, payload = upstream.respond(parts.path, query, body)
+                self._send(status, payload)
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                self._handle(json.loads(raw) if raw else None)
+
+        return Handler
+
+    # --- Payloads ---
+    def respond(self, path, query, body):
+        handler = getattr(self, f"_respond_{self.provider}")
+        return handler(path, query, body)
+
+    def _respond_finnhub(self, path, query, body):
+        symbol = query.get('symbol', '')
+        if path.endswith('/stock/metric'):
+            return 200, {'symbol': symbol, 'metric': {
+                'beta': round(0.3 + 1.7 * _unit(symbol, 'beta'), 4),
+                'marketCapitalization': round(500 + 500000 * _unit(symbol, 'cap'), 2),  # millions
+                'epsTTM': round(0.5 + 10 * _unit(symbol, 'eps'), 4),
+                'peTTM': round(5 + 45 * _unit(symbol, 'pe'), 4),
+            }}
+        if path.endswith('/stock/profile2'):
+            return 200, {'ticker': symbol, 'name': f"{symbol} Holdings Inc"}
+        if path.endswith('/stock/symbol'):
+            return 200, [{'symbol': synthetic_ticker(i)} for i in range(self.settings.payload_size)]
+        return 404, {'error': f'unknown path {path}'}
+
+    def _respond_fmp(self, path, query, body):
+        if not path.endswith('/stock-screener'):
+            return 404, {'error': f'unknown path {path}'}
+        beta_min = float(query.get('betaMoreThan', 0))
+        beta_max = float(query.get('betaLowerThan', 3))
+        cap_min = float(query.get('marketCapMoreThan', 0))
+        cap_max = float(query.get('marketCapLowerThan', 1e13))
+        limit = min(int(query.get('limit', 10)), self.settings.payload_size)
+        rows = []
+        for i in range(limit):
+            symbol = synthetic_ticker(SCREENER_TICKER_OFFSET + i)
+            rows.append({
+                'symbol': symbol,
+                'companyName': f"{symbol} Corp",
+                'beta': round(beta_min + (beta_max - beta_min) * _unit(symbol, 'beta'), 4),
+                'marketCap': round(cap_min + (cap_max - cap_min) * _unit(symbol, 'cap')),
+            })
+        return 200, rows
+
+    def _respond_newsapi(self, path, query, body):
+        terms = [term.strip().strip('"') for term in query.get('q', '').split(' OR ') if term.strip()]
+        page_size = min(int(query.get('pageSize', 5)), self.settings.payload_size)
+        # Articles are stamped just before now, so every run has something newer than the last
+        now = datetime.utcnow().replace(microsecond=0)
+        articles = []
+        for i in range(page_size):
+            term = terms[i % len(terms)] if terms else 'market'
+            published = now - timedelta(minutes=i)
+            key = f"{term}-{published.isoformat()}-{i}"
+            articles.append({
+                'source': {'id': None, 'name': 'Fake Wire'},
+                'title': f"{term} shares move on session {key}",
+                'description': f"Analysts weigh {term} after update {hashlib.md5(key.encode()).hexdigest()}",
+                'url': f"https://news.example.com/{hashlib.md5(key.encode()).hexdigest()}",
+                'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            })
+        return 200, {'status': 'ok', 'totalResults': len(articles), 'articles': articles}
+
+    def _respond_hf(self, path, query, body):
+        inputs = (body or {}).get('inputs', '')
+        texts = inputs if isinstance(inputs, list) else [inputs]
+        results = []
+        for text in texts:
+            weights = [1 + _unit(text, label) for label in ('positive', 'neutral', 'negative')]
+            total = sum(weights)
+            labels = [
+                {'label': label, 'score': round(weight / total, 4)}
+                for label, weight in zip(('positive', 'neutral', 'negative'), weights)
+            ]
+            results.append(sorted(labels, key=lambda item: item['score'], reverse=True))
+        return 200, results
+
+def synthetic_ticker(i):
+    """Ticker for the i-th synthetic holding: four letters, stable across runs."""
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    name = ''
+    for _ in range(4):
+        i, digit = divmod(i, 26)
+        name = letters[digit] + name
+    return name
+
+def start_fake_upstreams(settings=None, seed=0):
+    """Start one FakeUpstream per provider; settings maps provider -> UpstreamSettings."""
+    settings = settings or {}
+    return {
+        provider: FakeUpstream(provider, settings.get(provider), seed=seed).start()
+        for provider in PROVIDERS
+    }
+
+def override_env(upstreams):
+    """Value for HTTP_UPSTREAM_OVERRIDES pointing every provider at its fake."""
+    return ','.join(f"{provider}={upstream.base_url}" for provider, upstream in upstreams.items())
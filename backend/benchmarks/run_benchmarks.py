@@ -0,0 +1,341 @@
+"""Offline end-to-end benchmarks against local stand-ins for Finnhub, FMP, NewsAPI and Hugging Face.
+
+Run from the backend directory against a throwaway database (DB_NAME, or
+SQLITE_PATH with DB_BACKEND=sqlite, must contain "bench"; the suite deletes
+and rewrites data in it):
+
+    DB_NAME=stock_bench python -m benchmarks.run_benchmarks --output bench.json
+    DB_BACKEND=sqlite SQLITE_PATH=/tmp/bench.db python -m benchmarks.run_benchmarks
+    DB_NAME=stock_bench python -m benchmarks.run_benchmarks --latency newsapi=150,hf=80 --error-rate 0.02
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+
+Every operation is timed for synthetic users with each holding count in
+--sizes. The JSON report has one record per (operation, holdings) with
+throughput, p50/p99 latency and upstream call counts per provider.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import subprocess
+from datetime import datetime
+
+from benchmarks.fake_upstreams import (
+    PROVIDERS, UpstreamSettings, start_fake_upstreams, override_env, synthetic_ticker
+)
+
+STOCKS_PER_PORTFOLIO = 10
+
+def provider_values(raw, cast):
+    """'20' applies to every provider; 'newsapi=150,hf=80' sets some of them."""
+    values = {}
+    for item in (raw or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            provider, value = item.split('=', 1)
+            values[provider.strip()] = cast(value)
+        else:
+            values.update({provider: cast(item) for provider in PROVIDERS})
+    return values
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,10,100,1000', help='holdings per synthetic user')
+    parser.add_argument('--iterations', type=int, default=5, help='timed runs per operation and size')
+    parser.add_argument('--latency', default='0', help='ms per upstream answer, e.g. 20 or newsapi=150,hf=80')
+    parser.add_argument('--jitter', default='0', help='extra uniform ms per upstream answer')
+    parser.add_argument('--error-rate', default='0', help='share of upstream requests that fail')
+    parser.add_argument('--error-status', default='500', help='status code of injected failures')
+    parser.add_argument('--payload-size', default='newsapi=20,fmp=20,finnhub=2000',
+                        help='items per list response (articles, screener rows, universe symbols)')
+    parser.add_argument('--operations', default='save_portfolios,get_portfolios,analyze_portfolios_for_api,qre_main')
+    parser.add_argument('--sentiment-backend', default='remote', help='remote uses the fake Hugging Face server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help="keep the pipeline's own console output")
+    parser.add_argument('--force', action='store_true', help='run even if DB_NAME does not look like a bench database')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='print p50 changes between two reports and exit')
+    return parser.parse_args(argv)
+
+def build_settings(args):
+    latency = provider_values(args.latency, float)
+    jitter = provider_values(args.jitter, float)
+    error_rate = provider_values(args.error_rate, float)
+    error_status = provider_values(args.error_status, int)
+    payload_size = provider_values(args.payload_size, int)
+    return {
+        provider: UpstreamSettings(
+            latency_ms=latency.get(provider, 0.0),
+            jitter_ms=jitter.get(provider, 0.0),
+            error_rate=error_rate.get(provider, 0.0),
+            error_status=error_status.get(provider, 500),
+            payload_size=payload_size.get(provider, 10),
+        )
+        for provider in PROVIDERS
+    }
+
+def configure_environment(args, upstreams):
+    # Must run before any backend module is imported: they read these at import time
+    os.environ['HTTP_UPSTREAM_OVERRIDES'] = override_env(upstreams)
+    os.environ.setdefault('SENTIMENT_BACKEND', args.sentiment_backend)
+    os.environ.setdefault('HTTP_BACKOFF_BASE', '0.01')
+    os.environ.setdefault('DB_AUTO_MIGRATE', '0')
+    # Keep the background screener refresh from adding upstream calls to the measurements
+    os.environ.setdefault('SCREENER_REFRESH_BATCH', '0')
+    for provider in PROVIDERS:
+        # The fakes are local; provider rate limits would only measure the token buckets
+        os.environ.setdefault(f"RATE_LIMIT_{provider.upper()}", '1000000')
+        os.environ.setdefault(f"RATE_BURST_{provider.upper()}", '1000000')
+    for key in ('HUGGINGFACE_TOKEN', 'NEWS_API_KEY', 'FINNHUB_API_KEY', 'FMP_API_KEY'):
+        os.environ.setdefault(key, 'bench')
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def synthetic_portfolios(holdings, variant=0):
+    """Payload for save-portfolios with `holdings` distinct tickers; variant changes one share count."""
+    portfolios = []
+    for start in range(0, holdings, STOCKS_PER_PORTFOLIO):
+        stocks = []
+        for i in range(start, min(holdings, start + STOCKS_PER_PORTFOLIO)):
+            ticker = synthetic_ticker(i)
+            shares = 1 + i % 50 + (variant if i == 0 else 0)
+            stocks.append({'ticker': ticker, 'name': f"{ticker} Holdings Inc", 'shares': str(shares)})
+        portfolios.append({'name': f"Bench {start // STOCKS_PER_PORTFOLIO + 1}", 'stocks': stocks})
+    return portfolios
+
+class Bench:
+    def __init__(self, args, upstreams):
+        # Backend imports happen here, after configure_environment
+        from app import app
+        from migrations import migrate
+        from db import db_connection
+        from main import analyze_portfolios_for_api, stock_sentiment_cache
+        from QRE_new import main as qre_main
+        from portfolio_cache import bump_version
+        from utils import sentiment_cache
+        from utils.metric_store import metric_store
+        from utils.sentiment_history import sentiment_history
+        self.args = args
+        self.upstreams = upstreams
+        self.client = app.test_client()
+        self.db_connection = db_connection
+        self.analyze_portfolios_for_api = analyze_portfolios_for_api
+        self.qre_main = qre_main
+        self.bump_version = bump_version
+        self.stock_sentiment_cache = stock_sentiment_cache
+        self.sentiment_cache = sentiment_cache
+        self.metric_store = metric_store
+        self.sentiment_history = sentiment_history
+        migrate()
+
+    @contextlib.contextmanager
+    def _quiet(self):
+        if self.args.verbose:
+            yield
+            return
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    def user_for(self, holdings):
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            username = f"bench_{holdings}"
+            cursor.execute("SELECT user_id FROM user WHERE username = %s", (username,))
+            row = cursor.fetchone()
+            if row:
+                user_id = row[0]
+            else:
+                cursor.execute("INSERT INTO user (username, email) VALUES (%s, %s)", (username, f"{username}@example.com"))
+                user_id = cursor.lastrowid
+            cursor.close()
+        return user_id
+
+    def save(self, user_id, portfolios):
+        response = self.client.post('/api/save-portfolios', json={'user_id': user_id, 'portfolios': portfolios})
+        if response.status_code != 200:
+            raise RuntimeError(f"save-portfolios failed: {response.get_json()}")
+
+    def reset_sentiment(self, holdings):
+        """Forget everything learned about the bench tickers so the next analyze run is cold."""
+        self.stock_sentiment_cache.clear()
+        self.sentiment_cache.clear_memory()
+        tickers = [synthetic_ticker(i) for i in range(holdings)]
+        self.sentiment_history.discard(tickers)
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("DELETE FROM news WHERE stock_ticker = %s", [(ticker,) for ticker in tickers])
+            cursor.executemany("DELETE FROM news_checkpoint WHERE stock_ticker = %s", [(ticker,) for ticker in tickers])
+            cursor.executemany("DELETE FROM sentiment_daily WHERE stock_ticker = %s", [(ticker,) for ticker in tickers])
+            cursor.execute("DELETE FROM sentiment_cache")
+            cursor.close()
+
+    def reset_metrics(self):
+        self.metric_store.clear()
+
+    def measure(self, operation, holdings, run, before=None):
+        """Time `iterations` calls of run(i); before(i) runs untimed ahead of each call."""
+        latencies = []
+        upstream_calls = {provider: 0 for provider in PROVIDERS}
+        upstream_errors = {provider: 0 for provider in PROVIDERS}
+        failures = 0
+        for i in range(self.args.iterations):
+            with self._quiet():
+                if before:
+                    before(i)
+                for upstream in self.upstreams.values():
+                    upstream.reset_counts()
+                started = time.perf_counter()
+                try:
+                    run(i)
+                except Exception as e:
+                    failures += 1
+                    print(f"❌ {operation} ({holdings} holdings) failed: {e}", file=sys.stderr)
+                latencies.append(time.perf_counter() - started)
+            for provider, upstream in self.upstreams.items():
+                counts = upstream.counts()
+                upstream_calls[provider] += counts['calls']
+                upstream_errors[provider] += counts['errors']
+        total = sum(latencies)
+        record = {
+            'operation': operation,
+            'holdings': holdings,
+            'iterations': len(latencies),
+            'failures': failures,
+            'total_s': round(total, 6),
+            'throughput_ops_per_s': round(len(latencies) / total, 4) if total else None,
+            'throughput_holdings_per_s': round(holdings * len(latencies) / total, 4) if total else None,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'min_ms': round(min(latencies) * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3),
+            'upstream_calls': upstream_calls,
+            'upstream_calls_per_op': {
+                provider: round(calls / len(latencies), 3) for provider, calls in upstream_calls.items()
+            },
+            'upstream_errors': upstream_errors,
+        }
+        print(
+            f"⏱️ {operation:<36} {holdings:>5} holdings  p50 {record['p50_ms']:>10.2f} ms  "
+            f"p99 {record['p99_ms']:>10.2f} ms  upstream {sum(upstream_calls.values())}",
+            file=sys.stderr
+        )
+        return record
+
+    def run_size(self, holdings, operations):
+        user_id = self.user_for(holdings)
+        portfolios = synthetic_portfolios(holdings)
+        records = []
+        with self._quiet():
+            self.save(user_id, [])  # Start from an empty user
+        if 'save_portfolios' in operations:
+            # First call inserts everything; later ones change one share count
+            records.append(self.measure(
+                'save_portfolios', holdings,
+                lambda i: self.save(user_id, synthetic_portfolios(holdings, variant=i))
+            ))
+        with self._quiet():
+            self.save(user_id, portfolios)
+        if 'get_portfolios' in operations:
+            def get(i, etag=None):
+                headers = {'If-None-Match': etag} if etag else {}
+                response = self.client.get(f'/api/get-portfolios/{user_id}', headers=headers)
+                if response.status_code not in (200, 304):
+                    raise RuntimeError(f"get-portfolios returned {response.status_code}")
+                return response
+            records.append(self.measure(
+                'get_portfolios', holdings, get, before=lambda i: self.bump_version(user_id)
+            ))
+            records.append(self.measure('get_portfolios[cached]', holdings, get))
+            etag = get(0).headers.get('ETag')
+            records.append(self.measure('get_portfolios[304]', holdings, lambda i: get(i, etag)))
+        if 'analyze_portfolios_for_api' in operations:
+            records.append(self.measure(
+                'analyze_portfolios_for_api[cold]', holdings,
+                lambda i: self.analyze_portfolios_for_api(user_id),
+                before=lambda i: self.reset_sentiment(holdings)
+            ))
+            records.append(self.measure(
+                'analyze_portfolios_for_api[warm]', holdings,
+                lambda i: self.analyze_portfolios_for_api(user_id)
+            ))
+        if 'qre_main' in operations:
+            records.append(self.measure(
+                'QRE_new.main[cold]', holdings,
+                lambda i: self.qre_main(user_id),
+                before=lambda i: self.reset_metrics()
+            ))
+            records.append(self.measure('QRE_new.main[warm]', holdings, lambda i: self.qre_main(user_id)))
+        return records
+
+def compare_reports(base_path, head_path):
+    with open(base_path) as f:
+        base = {(r['operation'], r['holdings']): r for r in json.load(f)['results']}
+    with open(head_path) as f:
+        head = {(r['operation'], r['holdings']): r for r in json.load(f)['results']}
+    print(f"{'operation':<36} {'holdings':>8} {'base p50':>12} {'head p50':>12} {'change':>8}")
+    for key in sorted(set(base) & set(head), key=lambda key: (key[0], key[1])):
+        before, after = base[key]['p50_ms'], head[key]['p50_ms']
+        change = f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+        print(f"{key[0]:<36} {key[1]:>8} {before:>10.2f}ms {after:>10.2f}ms {change:>8}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+    if os.getenv('DB_BACKEND', 'mysql').lower() == 'sqlite':
+        target = ('SQLITE_PATH', os.getenv('SQLITE_PATH', ''))
+    else:
+        target = ('DB_NAME', os.getenv('DB_NAME', ''))
+    if 'bench' not in target[1] and not args.force:
+        sys.exit(f"Refusing to run against {target[0]}={target[1]!r}: point it at a bench database or pass --force")
+    settings = build_settings(args)
+    upstreams = start_fake_upstreams(settings, seed=args.seed)
+    configure_environment(args, upstreams)
+    try:
+        bench = Bench(args, upstreams)
+        sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+        operations = {operation.strip() for operation in args.operations.split(',')}
+        results = []
+        for holdings in sizes:
+            results.extend(bench.run_size(holdings, operations))
+    finally:
+        for upstream in upstreams.values():
+            upstream.stop()
+    report = {
+        'schema': 1,
+        'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sentiment_backend': os.environ.get('SENTIMENT_BACKEND'),
+        'iterations': args.iterations,
+        'upstreams': {provider: vars(setting) for provider, setting in settings.items()},
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"📄 Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""EXPLAIN the backend's hot queries and fail if any of them needs a full table scan.
+
+Run after `python migrations.py` against a database at the latest schema:
+
+    python check_query_plans.py
+
+A table read with access type ALL is a regression and makes the script
+exit non-zero. MySQL may pick a scan over an index it could use when a
+table is near-empty, so a scan with possible_keys is only a warning when
+EXPLAIN estimates fewer than QUERY_PLAN_MAX_SCAN_ROWS rows or the table is
+listed in QUERY_PLAN_SMALL_TABLES (comma-separated). With
+DB_BACKEND=sqlite, EXPLAIN QUERY PLAN is used and a plain SCAN of a table
+(or of an alias of one) fails the check.
+
+Before trusting a clean result, the check runs a query known to need a
+full scan and fails if that one is not caught.
+"""
+import os
+import re
+import sys
+from db import db_connection, is_sqlite
+
+QUERY_PLAN_MAX_SCAN_ROWS = int(os.getenv("QUERY_PLAN_MAX_SCAN_ROWS", "1000"))
+QUERY_PLAN_SMALL_TABLES = {table.strip() for table in os.getenv("QUERY_PLAN_SMALL_TABLES", "").split(',') if table.strip()}
+
+# (name, query, sample params) - keep in sync with the queries they stand for
+HOT_QUERIES = [
+    ("get-portfolios view", """
+        SELECT p.portfolio_id, p.portfolio_name, p.avg_port_sent_score,
+               s.stock_ticker, s.avg_stock_sent_score
+        FROM portfolio p
+        LEFT JOIN stock s ON s.portfolio_id = p.portfolio_id
+        WHERE p.user_id = %s
+        ORDER BY p.portfolio_id, s.stock_id
+    """, (1,)),
+    ("user holdings", """
+        SELECT s.portfolio_id, s.stock_ticker, s.num_shares
+        FROM stock s
+        JOIN portfolio p ON s.portfolio_id = p.portfolio_id
+        WHERE p.user_id = %s
+        ORDER BY s.portfolio_id, s.stock_id
+    """, (1,)),
+    ("news for ticker", """
+        SELECT title, url, sent_score, date_time
+        FROM news
+        WHERE stock_ticker = %s
+        ORDER BY date_time DESC, news_id DESC
+        LIMIT 20
+    """, ('AAPL',)),
+    ("news high-water marks", """
+        SELECT stock_ticker, MAX(date_time) FROM news
+        WHERE stock_ticker IN (%s, %s)
+        GROUP BY stock_ticker
+    """, ('AAPL', 'MSFT')),
+    ("news checkpoints", """
+        SELECT stock_ticker, last_checked_at FROM news_checkpoint
+        WHERE stock_ticker IN (%s, %s)
+    """, ('AAPL', 'MSFT')),
+    ("recent news scores", """
+        SELECT stock_ticker, date_time, sent_score, url FROM (
+            SELECT stock_ticker, date_time, sent_score, url,
+                   ROW_NUMBER() OVER (PARTITION BY stock_ticker ORDER BY date_time DESC, news_id DESC) AS rn
+            FROM news
+            WHERE stock_ticker IN (%s, %s) AND sent_score IS NOT NULL
+        ) ranked
+        WHERE rn <= %s
+    """, ('AAPL', 'MSFT', 5)),
+    ("stock names", """
+        SELECT stock_ticker, MAX(stock_name) FROM stock
+        WHERE stock_ticker IN (%s, %s) AND stock_name IS NOT NULL AND stock_name != ''
+        GROUP BY stock_ticker
+    """, ('AAPL', 'MSFT')),
+    ("holding sentiment update", """
+        UPDATE stock SET avg_stock_sent_score = %s
+        WHERE portfolio_id = %s AND stock_ticker = %s
+    """, (0.1, 1, 'AAPL')),
+    ("holding beta update", """
+        UPDATE stock SET beta = %s, market_cap = %s WHERE portfolio_id = %s AND stock_ticker = %s
+    """, (1.0, 1, 1, 'AAPL')),
+    ("recommendations for user", """
+        SELECT DISTINCT r.*, p.portfolio_name
+        FROM recommendation r
+        JOIN portfolio p ON r.portfolio_id = p.portfolio_id
+        WHERE r.portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE user_id = %s)
+    """, (1,)),
+    ("ticker trends", """
+        SELECT stock_ticker, news_date, article_count, score_sum, score_min, score_max
+        FROM sentiment_daily
+        WHERE stock_ticker IN (%s, %s) AND news_date >= %s
+        ORDER BY stock_ticker, news_date
+    """, ('AAPL', 'MSFT', '2024-01-01')),
+    ("news day recount", """
+        SELECT COUNT(*), SUM(sent_score), MIN(sent_score), MAX(sent_score) FROM news
+        WHERE stock_ticker = %s AND date_time >= %s AND date_time < %s AND sent_score IS NOT NULL
+    """, ('AAPL', '2024-01-01 00:00:00', '2024-01-02 00:00:00')),
+    ("sentiment cache lookup", """
+        SELECT text_hash, sent_score FROM sentiment_cache WHERE text_hash IN (%s)
+    """, ('0' * 64,)),
+]
+
+# Must be reported as a full scan, or the check itself is broken
+UNINDEXED_QUERY = ("self-check", """
+    SELECT p.portfolio_id FROM portfolio p WHERE p.portfolio_name = %s
+""", ('none',))
+
+SQL_KEYWORDS = {'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'ON', 'USING',
+                'GROUP', 'ORDER', 'LIMIT', 'SET', 'AS'}
+
+def _table_aliases(query, tables):
+    """{name as EXPLAIN QUERY PLAN reports it: table} for the tables a query reads."""
+    aliases = {table: table for table in tables}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE):
+        if table in tables and alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN " + query, params)
+    return cursor.fetchall()
+
+def _sqlite_scans(cursor, name, query, params):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row['name'] for row in cursor.fetchall()}
+    aliases = _table_aliases(query, tables)
+    cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+    failures = []
+    for row in cursor.fetchall():
+        words = row['detail'].split()
+        # "SCAN p" is a full scan of the table aliased p; "SCAN news USING INDEX ..." walks an index.
+        # Subqueries (SCAN ranked, SCAN (subquery-3)) are scanned by design; their sources get rows of their own.
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in aliases and 'USING' not in words:
+            failures.append(f"{name}: full scan of {aliases[words[1]]} ({row['detail']})")
+    return failures
+
+def _mysql_scans(cursor, name, query, params):
+    """(failures, warnings) from MySQL's EXPLAIN."""
+    failures, warnings = [], []
+    for row in explain(cursor, query, params):
+        table = row.get('table')
+        # Derived tables (<derivedN>) are scanned by design; their source tables are checked on their own rows
+        if row.get('type') != 'ALL' or not table or table.startswith('<'):
+            continue
+        message = f"{name}: full scan of {table} (rows={row.get('rows')}, possible_keys={row.get('possible_keys')})"
+        small = table in QUERY_PLAN_SMALL_TABLES or (row.get('rows') or 0) < QUERY_PLAN_MAX_SCAN_ROWS
+        if row.get('possible_keys') and small:
+            warnings.append(message)
+        else:
+            failures.append(message)
+    return failures, warnings
+
+def _scans(cursor, name, query, params):
+    if is_sqlite():
+        return _sqlite_scans(cursor, name, query, params), []
+    return _mysql_scans(cursor, name, query, params)
+
+def check_query_plans():
+    """Returns (failures, warnings) as lists of messages."""
+    failures, warnings = [], []
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        if not _scans(cursor, *UNINDEXED_QUERY)[0]:
+            failures.append("self-check: a query without a usable index was not reported as a full scan")
+        for name, query, params in HOT_QUERIES:
+            query_failures, query_warnings = _scans(cursor, name, query, params)
+            failures.extend(query_failures)
+            warnings.extend(query_warnings)
+        cursor.close()
+    return failures, warnings
+
+if __name__ == "__main__":
+    failures, warnings = check_query_plans()
+    for message in warnings:
+        print(f"⚠️ {message}")
+    for message in failures:
+        print(f"❌ {message}")
+    if failures:
+        sys.exit(1)
+    print(f"✅ {len(HOT_QUERIES)} hot queries use indexes")
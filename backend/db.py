@@ -1,11 +1,237 @@
 # db.py
 
-import mysql.connector
+import os
+import time
+from datetime import datetime
+import threading
+from contextlib import contextmanager
+from utils.metrics import register_stats
 
-def get_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="tanay282004",
-        database="stock_trading_app"
+# Storage backend: "mysql" (default) or "sqlite" for single-node deployments,
+# benchmarks and in-process tests. Queries use %s placeholders and the
+# portable helpers below; the SQLite connection translates placeholders.
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stock_trading_app.db"))
+
+DB_CONFIG = {
+    'host': os.getenv("DB_HOST", "localhost"),
+    'user': os.getenv("DB_USER", "root"),
+    'password': os.getenv("DB_PASSWORD", "tanay282004"),
+    'database': os.getenv("DB_NAME", "stock_trading_app"),
+}
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+class PooledConnection:
+    """A checked-out connection. close() hands it back to the pool instead of disconnecting."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+    def __del__(self):
+        # A caller that dropped the connection without close() must not leak its pool slot
+        if not self.__dict__.get('_released', True):
+            try:
+                self.close()
+            except Exception:
+                pass
+
+class ConnectionPool:
+    """Thread-safe database connection pool.
+
+    Keeps up to pool_size idle connections and allows max_overflow extra ones
+    under load, which are closed when returned. Connections older than
+    recycle seconds are replaced, and idle connections are pinged before
+    reuse when pre_ping is on.
+    """
+
+    def __init__(self, connect, pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_MAX_OVERFLOW,
+                 timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE, pre_ping=DB_POOL_PRE_PING):
+        self.connect = connect
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._idle = []
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'recycled': 0, 'failed_pings': 0, 'waits': 0}
+
+    def _connect(self):
+        raw = self.connect()
+        self._count('created')
+        return raw, time.monotonic()
+
+    def _is_usable(self, raw, created_at):
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            self._count('recycled')
+            return False
+        if self.pre_ping:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                self._count('failed_pings')
+                return False
+        return True
+
+    def _count(self, key):
+        with self._cond:
+            self.stats[key] += 1
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while not self._idle and self._checked_out >= self.pool_size + self.max_overflow:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No database connection available within {self.timeout}s")
+                self.stats['waits'] += 1
+                self._cond.wait(remaining)
+            self._checked_out += 1
+            idle = self._idle.pop() if self._idle else None
+        try:
+            if idle is not None:
+                raw, created_at = idle
+                if self._is_usable(raw, created_at):
+                    self._count('reused')
+                    return PooledConnection(self, raw, created_at)
+                _close_quietly(raw)
+            raw, created_at = self._connect()
+            return PooledConnection(self, raw, created_at)
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, raw, created_at):
+        try:
+            # Never hand an open transaction to the next caller
+            if raw.in_transaction:
+                raw.rollback()
+            keep = True
+        except Exception:
+            keep = False
+        with self._cond:
+            self._checked_out -= 1
+            if keep and len(self._idle) < self.pool_size:
+                self._idle.append((raw, created_at))
+                raw = None
+            self._cond.notify()
+        if raw is not None:
+            _close_quietly(raw)
+
+    def dispose(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw, _ in idle:
+            _close_quietly(raw)
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats.update(idle=len(self._idle), checked_out=self._checked_out,
+                         pool_size=self.pool_size, max_overflow=self.max_overflow)
+        return stats
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+def _connect_mysql():
+    import mysql.connector
+    return mysql.connector.connect(**DB_CONFIG)
+
+def _connect_sqlite():
+    import db_sqlite
+    return db_sqlite.connect(SQLITE_PATH)
+
+if DB_BACKEND == 'mysql':
+    import mysql.connector
+    IntegrityError = mysql.connector.IntegrityError
+    pool = ConnectionPool(_connect_mysql)
+elif DB_BACKEND == 'sqlite':
+    import sqlite3
+    IntegrityError = sqlite3.IntegrityError
+    pool = ConnectionPool(_connect_sqlite)
+else:
+    raise ValueError(f"Unknown DB_BACKEND '{DB_BACKEND}', expected 'mysql' or 'sqlite'")
+
+register_stats('stockai_db_pool', pool.get_stats, counters=('created', 'reused', 'recycled', 'failed_pings', 'waits'),
+               gauges=('idle', 'checked_out'), help='Database connection pool')
+
+def is_sqlite():
+    return DB_BACKEND == 'sqlite'
+
+def insert_ignore_sql(table, columns):
+    """INSERT that skips rows clashing with a unique key."""
+    verb = "INSERT OR IGNORE" if is_sqlite() else "INSERT IGNORE"
+    return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+def upsert_sql(table, columns, key_columns, update_columns):
+    """INSERT that updates update_columns when a row with the same key_columns exists."""
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    if is_sqlite():
+        updates = ', '.join(f"{column} = excluded.{column}" for column in update_columns)
+        return f"{insert} ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    updates = ', '.join(f"{column} = VALUES({column})" for column in update_columns)
+    return f"{insert} ON DUPLICATE KEY UPDATE {updates}"
+
+def accumulate_sql(table, columns, key_columns, merges):
+    """INSERT that folds the new row into an existing one with the same key_columns.
+
+    merges maps a column to 'sum', 'min' or 'max', e.g. for running counters
+    and extremes in rollup tables.
+    """
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    new = (lambda column: f"excluded.{column}") if is_sqlite() else (lambda column: f"VALUES({column})")
+    functions = {'min': 'MIN', 'max': 'MAX'} if is_sqlite() else {'min': 'LEAST', 'max': 'GREATEST'}
+    updates = ', '.join(
+        f"{column} = {column} + {new(column)}" if merge == 'sum'
+        else f"{column} = {functions[merge]}({column}, {new(column)})"
+        for column, merge in merges.items()
     )
+    if is_sqlite():
+        return f"{insert} ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    return f"{insert} ON DUPLICATE KEY UPDATE {updates}"
+
+def to_datetime(value):
+    """Datetime from a DATETIME column or expression (SQLite returns expressions like MAX() as text)."""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+def get_connection():
+    return pool.acquire()
+
+@contextmanager
+def db_connection():
+    """Check out one connection for a unit of work; commits on success, rolls back on error."""
+    conn = get_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,100 @@
+import re
+import sqlite3
+from datetime import datetime, date
+
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# Queries are written with MySQL's %s placeholders; sqlite3 wants ?
+_PLACEHOLDER = re.compile(r'%s')
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode('utf-8'))
+
+# Store datetimes as 'YYYY-MM-DD HH:MM:SS' text, which sorts in time order,
+# and read DATETIME/TIMESTAMP columns back as datetime like mysql.connector does
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('DATETIME', _convert_datetime)
+sqlite3.register_converter('TIMESTAMP', _convert_datetime)
+
+class SQLiteCursor:
+    """sqlite3 cursor with the parts of the mysql.connector cursor API the backend uses."""
+
+    def __init__(self, raw, dictionary=False):
+        self._raw = raw
+        self._dictionary = dictionary
+
+    def execute(self, query, params=()):
+        self._raw.execute(_PLACEHOLDER.sub('?', query), tuple(params or ()))
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._raw.executemany(_PLACEHOLDER.sub('?', query), [tuple(params) for params in seq_of_params])
+        return self
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._raw.description, row)}
+
+    def fetchone(self):
+        return self._row(self._raw.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._raw.fetchall()]
+
+    @property
+    def lastrowid(self):
+        return self._raw.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def close(self):
+        self._raw.close()
+
+class SQLiteConnection:
+    """sqlite3 connection shaped like a mysql.connector connection (cursor(dictionary=...), ping)."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._raw.cursor(), dictionary=dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self, reconnect=False):
+        self._raw.execute("SELECT 1").fetchone()
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def close(self):
+        self._raw.close()
+
+def connect(path):
+    """Open a WAL-mode connection that the pool may hand to any thread (one at a time)."""
+    raw = sqlite3.connect(
+        path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+        uri=path.startswith('file:'),
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+    )
+    # Readers never block the writer and vice versa; NORMAL is durable across app crashes in WAL mode
+    raw.execute("PRAGMA journal_mode=WAL")
+    raw.execute("PRAGMA synchronous=NORMAL")
+    raw.execute("PRAGMA foreign_keys=ON")
+    raw.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return SQLiteConnection(raw)
@@ -0,0 +1,96 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.log import get_logger
+
+logger = get_logger("jobs")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))  # seconds finished jobs stay queryable
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _public(job):
+    return {
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'user_id': job['user_id'],
+        'status': job['status'],
+        'progress': dict(job['progress']),
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+
+def _prune(now):
+    # Caller holds _jobs_lock
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job['finished_at'] is not None and now - job['finished_at'] > JOB_RETENTION
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+def _run(job_id, fn):
+    with _jobs_lock:
+        job = _jobs[job_id]
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+
+    def report(stage, done=None, total=None):
+        with _jobs_lock:
+            job['progress'] = {'stage': stage, 'done': done, 'total': total}
+
+    try:
+        result = fn(report)
+        with _jobs_lock:
+            job['result'] = result
+            job['status'] = 'succeeded'
+    except Exception as e:
+        logger.exception(f"❌ Job {job_id} ({job['kind']}) failed: {e}")
+        with _jobs_lock:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+    finally:
+        with _jobs_lock:
+            job['finished_at'] = time.time()
+
+def submit_job(kind, user_id, fn):
+    """Queue fn(progress) on the worker pool and return the job dict.
+
+    A queued or running job of the same kind for the same user is returned
+    instead of starting a duplicate run.
+    """
+    now = time.time()
+    with _jobs_lock:
+        _prune(now)
+        for job in _jobs.values():
+            if job['kind'] == kind and job['user_id'] == user_id and job['status'] in ('queued', 'running'):
+                return _public(job)
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            'job_id': job_id,
+            'kind': kind,
+            'user_id': user_id,
+            'status': 'queued',
+            'progress': {'stage': 'queued', 'done': None, 'total': None},
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'started_at': None,
+            'finished_at': None,
+        }
+        public = _public(_jobs[job_id])
+    _executor.submit(_run, job_id, fn)
+    return public
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return _public(job) if job else None
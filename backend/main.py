@@ -1,210 +1,274 @@
-import requests
-from huggingface_hub import InferenceClient
-from datetime import datetime
-from config import HUGGINGFACE_TOKEN, NEWS_API_KEY, NEWS_API_URL, validate_config
-from utils.news_utils import fetch_news
-from utils.sentiment_utils import analyze_sentiment, compute_scalar_score, compute_average_sentiment
-from portfolio_utils import get_all_portfolio_ids, get_unique_tickers_by_portfolio
-from save_utils import (
-    delete_sentiment_scores_only,
-    save_article_to_db,
-    save_average_sentiment,
-    save_final_portfolio_sentiment
-)
+import os
+from datetime import datetime, timedelta
+from config import validate_config
+from utils.news_utils import fetch_news_batch, NEWS_BATCH_SIZE
+from utils.sentiment_utils import analyze_sentiment_batch, compute_scalar_scores
+from utils.sentiment_cache import text_hash, lookup_scores, store_scores
+from portfolio_utils import get_all_portfolio_ids, get_user_holdings, get_stock_names
+from news_store import get_news_state
+from portfolio_stats import Holdings, weighted_mean
+from save_utils import SentimentWriter
+from portfolio_cache import bump_version
+from utils.ttl_cache import TTLCache
+from utils.sentiment_history import sentiment_history
+from utils.log import get_logger
+from utils.metrics import span, inc, register_stats
 
 # Validate configuration
 validate_config()
 
-finbert_client = InferenceClient(model="ProsusAI/finbert", token=HUGGINGFACE_TOKEN)
+STOCK_SENTIMENT_TTL = float(os.getenv("STOCK_SENTIMENT_TTL", "900"))
+STOCK_SENTIMENT_CACHE_SIZE = int(os.getenv("STOCK_SENTIMENT_CACHE_SIZE", "5000"))
+NEWS_RECHECK_INTERVAL = float(os.getenv("NEWS_RECHECK_INTERVAL", "900"))
 
-processed_stocks = {}  # To avoid duplicate sentiment fetches
+# Per-ticker average sentiment shared by every request and user
+stock_sentiment_cache = TTLCache(maxsize=STOCK_SENTIMENT_CACHE_SIZE, ttl=STOCK_SENTIMENT_TTL)
+register_stats('stockai_stock_sentiment_cache', stock_sentiment_cache.get_stats,
+               counters=('hits', 'misses', 'expired', 'evicted'), gauges=('size',), help='Per-ticker sentiment cache')
+
+logger = get_logger("analyze")
+
+# Per-ticker NewsAPI recheck intervals learned by the precompute scheduler;
+# tickers it doesn't track use NEWS_RECHECK_INTERVAL
+_recheck_intervals = {}
+
+def set_recheck_interval(ticker, seconds):
+    _recheck_intervals[ticker] = seconds
+
+def recheck_interval(ticker):
+    return _recheck_intervals.get(ticker, NEWS_RECHECK_INTERVAL)
 
 def compute_portfolio_sentiment(scores, num_shares):
-    if not scores:
-        print(f"[DEBUG] No scores provided for weighted sentiment calculation.")
-        return 0.0
-    sum_val = 0
-    index = 0
-    print(f"[DEBUG] Calculating weighted sentiment:")
-    print(f"  Scores: {scores}")
-    print(f"  Num Shares: {num_shares}")
-    for score in scores:
-        if(index >= len(num_shares)):
-            break
-        print(f"    Stock {index+1}: score={score}, shares={num_shares[index]}, contrib={num_shares[index] * score}")
-        sum_val += num_shares[index] * score
-        index += 1
-    total_shares = sum(num_shares)
-    print(f"  Weighted sum: {sum_val}, Total shares: {total_shares}")
-    wavg = sum_val / total_shares if total_shares else 0.0
-    print(f"  Weighted average sentiment: {wavg}")
-    round(wavg, 4)
-    return wavg
-
-def process_portfolio(portfolio_id):
-    print(f"\n🔁 Processing Portfolio ID: {portfolio_id}")
-    delete_sentiment_scores_only(portfolio_id)
-    tickers = get_unique_tickers_by_portfolio(portfolio_id)
-    print(f"📥 Portfolio {portfolio_id} Stocks: {tickers}")
-    overall_scores = []
-    num_shares = []
-    # Fetch num_shares for all tickers in this portfolio
-    from utils.db_utils import get_connection
-    conn = get_connection()
-    cur = conn.cursor()
-    format_strings = ','.join(['%s'] * len(tickers))
-    cur.execute(f"SELECT stock_ticker, num_shares FROM stock WHERE portfolio_id = %s AND stock_ticker IN ({format_strings})", [portfolio_id] + tickers)
-    shares_dict = {row[0]: row[1] for row in cur.fetchall()}
-    cur.close()
-    conn.close()
+    return weighted_mean(scores, num_shares)
+
+def parse_published_at(raw_time):
+    try:
+        if raw_time:
+            return datetime.strptime(raw_time, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y-%m-%d %H:%M:%S')
+    except:
+        pass
+    return None
+
+def get_portfolio_name(portfolio_id):
+    from utils.db_utils import db_connection
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT portfolio_name FROM portfolio WHERE portfolio_id = %s", (portfolio_id,))
+        row = cursor.fetchone()
+        cursor.close()
+    return row[0] if row else None
+
+def fetch_articles_for_stocks(pending, since=None, budget=None):
+    if not pending:
+        return {}
+    logger.info(f"📊 Fetching news for {pending}...")
+    with span('news_fetch', tickers=len(pending)):
+        articles_by_stock = fetch_news_batch(pending, names=get_stock_names(pending), since=since, budget=budget)
+    for stock, articles in articles_by_stock.items():
+        logger.debug("📄 %d articles found for %s", len(articles), stock)
+    return articles_by_stock
+
+def score_articles(articles_by_stock, writer):
+    """Score every fetched article in batched FinBERT calls.
+
+    Returns {stock: [(published_at, score, url), ...]} for the new articles only.
+    """
+    flat_articles = [
+        (stock, article)
+        for stock, articles in articles_by_stock.items()
+        for article in articles
+    ]
+    descriptions = [article.get('description') or '' for _, article in flat_articles]
+    hashes = [text_hash(description) for description in descriptions]
+    with span('sentiment_cache_lookup'):
+        cached = lookup_scores([key for key, description in zip(hashes, descriptions) if description.strip()])
+    # Only run inference for non-empty texts the cache has never seen
+    to_score = {}
+    for key, description in zip(hashes, descriptions):
+        if description.strip() and key not in cached:
+            to_score.setdefault(key, description)
+    logger.info(f"🧠 Scoring {len(to_score)} new texts ({len(flat_articles)} articles across {len(articles_by_stock)} stocks)")
+    inc('stockai_sentiment_texts_total', len(flat_articles) - len(to_score), help='Article texts scored, by where the score came from', source='cache')
+    inc('stockai_sentiment_texts_total', len(to_score), help='Article texts scored, by where the score came from', source='inference')
+    results = analyze_sentiment_batch(list(to_score.values()))
+    new_scores = dict(zip(to_score, compute_scalar_scores(results)))
+    # Failed inferences come back empty; keep them out of the cache so they get retried
+    store_scores({key: new_scores[key] for key, result in zip(to_score, results) if result})
+    scalar_scores = [
+        cached.get(key, new_scores.get(key, 0.0)) if description.strip() else 0.0
+        for key, description in zip(hashes, descriptions)
+    ]
+    stock_scores = {stock: [] for stock in articles_by_stock}
+    for (stock, article), scalar_score in zip(flat_articles, scalar_scores):
+        title = article.get('title', 'No title')
+        published_at = parse_published_at(article.get('publishedAt', ''))
+        stock_scores[stock].append((published_at, scalar_score, article.get('url', '')))
+        logger.debug("📝 Saving article: %s... → Score: %s", title[:40], scalar_score)
+        writer.add_article(
+            stock, title, article.get('description', ''), article.get('url', ''),
+            scalar_score, published_at
+        )
+    return stock_scores
+
+def _published_sort_key(entry):
+    published_at = entry[0]
+    if isinstance(published_at, str):
+        published_at = datetime.strptime(published_at, '%Y-%m-%d %H:%M:%S')
+    return published_at or datetime.min
+
+def aggregate_stock_sentiment(stocks, new_scores):
+    """Record new scores in the in-memory history and average each stock over its latest SENTIMENT_WINDOW articles."""
+    avg_scores = {}
+    for stock in stocks:
+        sentiment_history.add_many(stock, sorted(new_scores.get(stock, []), key=_published_sort_key))
+        window_mean = sentiment_history.window_mean(stock)
+        avg_scores[stock] = window_mean if window_mean is not None else 0.0
+        stock_sentiment_cache.set(stock, avg_scores[stock])
+        logger.debug("✅ Avg Sentiment for %s: %s (%d new articles)", stock, avg_scores[stock], len(new_scores.get(stock, [])))
+    return avg_scores
+
+def analyze_stock_group(stocks, writer):
+    """Bring a group of tickers up to date and return their average sentiment."""
+    return refresh_stock_group(stocks, writer)[0]
+
+def refresh_stock_group(stocks, writer, force=False, budget=None):
+    """Bring a group of tickers up to date; returns (average sentiment, new article counts).
+
+    Tickers checked against NewsAPI within their recheck interval are
+    aggregated from the in-memory sentiment history with no upstream calls,
+    unless force is set. The rest only ask for articles newer than their
+    high-water mark (latest stored news.date_time), and only those new
+    articles are scored. With a budget (asked before every NewsAPI request),
+    tickers whose requests it refused stay unchecked and are missing from
+    the new article counts, as do tickers whose NewsAPI request failed.
+    """
+    sentiment_history.ensure_loaded()
+    with span('news_state_read'):
+        state = get_news_state(stocks)
+    now = datetime.utcnow()
+    to_fetch = [
+        stock for stock in stocks
+        if force or state[stock]['last_checked'] is None
+        or now - state[stock]['last_checked'] >= timedelta(seconds=recheck_interval(stock))
+    ]
+    skipped = [stock for stock in stocks if stock not in to_fetch]
+    if skipped:
+        logger.info(f"⏭️ News for {skipped} checked recently, aggregating stored articles")
+    since = {stock: state[stock]['high_water'] for stock in to_fetch}
+    articles_by_stock = fetch_articles_for_stocks(to_fetch, since=since, budget=budget)
+    new_scores = score_articles(articles_by_stock, writer)
+    checked = [stock for stock in to_fetch if stock in articles_by_stock]
+    for stock in checked:
+        writer.add_news_checkpoint(stock, now.strftime('%Y-%m-%d %H:%M:%S'))
+    new_counts = {stock: len(new_scores.get(stock, [])) for stock in checked}
+    return aggregate_stock_sentiment(stocks, new_scores), new_counts
+
+def save_portfolio_results(portfolio_id, tickers, stock_sentiments, final_avg, writer):
+    writer.reset_portfolio(portfolio_id)
+    stock_results = []
     for stock in tickers:
-        num_shares.append(shares_dict.get(stock, 1))
-        if stock in processed_stocks:
-            reused_score = processed_stocks[stock]
-            print(f"🔁 Reusing sentiment for {stock}")
-            save_average_sentiment(portfolio_id, stock, reused_score)
-            overall_scores.append(reused_score)
+        if stock not in stock_sentiments:
+            logger.warning(f"❌ No sentiment available for {stock}")
+            stock_results.append({
+                'ticker': stock,
+                'sentiment': 0.0
+            })
             continue
-        try:
-            print(f"📊 Fetching news for {stock}...")
-            articles = fetch_news(stock + " stock")
-            print(f"📄 {len(articles)} articles found for {stock}")
-            stock_scores = []
-            for article in articles:
-                title = article.get('title', 'No title')
-                description = article.get('description', '')
-                url = article.get('url', '')
-                raw_time = article.get('publishedAt', '')
-                try:
-                    published_at = None
-                    if raw_time:
-                        from datetime import datetime
-                        published_at = datetime.strptime(raw_time, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y-%m-%d %H:%M:%S')
-                except:
-                    published_at = None
-                result = analyze_sentiment(description)
-                scalar_score = compute_scalar_score(result)
-                stock_scores.append(scalar_score)
-                try:
-                    print(f"📝 Saving article: {title[:40]}... → Score: {scalar_score}")
-                    save_article_to_db(stock, title, description, url, scalar_score, published_at)
-                except Exception as e:
-                    print(f"❌ Error saving article: {e}")
-            avg_score = compute_average_sentiment(stock_scores)
-            processed_stocks[stock] = avg_score
-            save_average_sentiment(portfolio_id, stock, avg_score)
-            overall_scores.append(avg_score)
-            print(f"✅ Avg Sentiment for {stock}: {avg_score}")
-        except Exception as e:
-            print(f"❌ Error for stock {stock}: {e}")
-    print(f"[DEBUG] Using weighted average for final portfolio sentiment.")
-    final_avg = compute_portfolio_sentiment(overall_scores, num_shares)
-    save_final_portfolio_sentiment(portfolio_id, final_avg)
-    print(f"🎯 Final Sentiment for Portfolio {portfolio_id}: {final_avg}")
-
-def analyze_portfolios_for_api(user_id=1):
-    global processed_stocks
-    processed_stocks = {}  # Reset cache for each run
+        avg_score = stock_sentiments[stock]
+        writer.add_stock_score(portfolio_id, stock, avg_score)
+        stock_results.append({
+            'ticker': stock,
+            'sentiment': avg_score
+        })
+    writer.add_portfolio_score(portfolio_id, final_avg)
+    # One transaction per portfolio, together with any articles still buffered
+    writer.flush()
+    logger.info(f"🎯 Final Sentiment for Portfolio {portfolio_id}: {final_avg}")
+    return {
+        'portfolio_id': portfolio_id,
+        'portfolio_name': get_portfolio_name(portfolio_id),
+        'avg_score': final_avg,
+        'stocks': stock_results
+    }
+
+def iter_analyze_portfolios(user_id=1, progress=None):
+    """Analyze every portfolio of a user, yielding results as they become available.
+
+    Yields {'type': 'stock', 'ticker', 'sentiment'} once per distinct ticker
+    as soon as it is scored, and {'type': 'portfolio', ...} with the same
+    fields analyze_portfolios_for_api returns once all of a portfolio's
+    tickers are done. progress(stage, done, total) is called as work completes.
+    """
+    progress = progress or (lambda stage, done=None, total=None: None)
     portfolio_ids = get_all_portfolio_ids(user_id)
-    print(f"🧾 Found portfolios: {portfolio_ids}")
-    results = []
+    logger.info(f"🧾 Found portfolios: {portfolio_ids}")
+    holdings = Holdings.from_rows(get_user_holdings(user_id), portfolio_ids)
+    portfolio_tickers = {}
     for portfolio_id in portfolio_ids:
-        print(f"\n🔁 Processing Portfolio ID: {portfolio_id}")
-        delete_sentiment_scores_only(portfolio_id)
-        tickers = get_unique_tickers_by_portfolio(portfolio_id)
-        print(f"📥 Portfolio {portfolio_id} Stocks: {tickers}")
-        overall_scores = []
-        num_shares = []
-        stock_results = []
-        # Fetch num_shares for all tickers in this portfolio
-        from utils.db_utils import get_connection
-        conn = get_connection()
-        cur = conn.cursor()
-        format_strings = ','.join(['%s'] * len(tickers))
-        cur.execute(f"SELECT stock_ticker, num_shares FROM stock WHERE portfolio_id = %s AND stock_ticker IN ({format_strings})", [portfolio_id] + tickers)
-        shares_dict = {row[0]: row[1] for row in cur.fetchall()}
-        cur.close()
-        conn.close()
-        for stock in tickers:
-            num_shares.append(shares_dict.get(stock, 1))
-            if stock in processed_stocks:
-                reused_score = processed_stocks[stock]
-                print(f"🔁 Reusing sentiment for {stock}")
-                save_average_sentiment(portfolio_id, stock, reused_score)
-                overall_scores.append(reused_score)
-                stock_results.append({
-                    'ticker': stock,
-                    'sentiment': reused_score
-                })
+        portfolio_tickers[portfolio_id] = holdings.tickers_of(portfolio_id)
+        logger.debug("📥 Portfolio %s Stocks: %s", portfolio_id, portfolio_tickers[portfolio_id])
+    all_tickers = holdings.tickers
+    stock_sentiments = {}
+    for stock in all_tickers:
+        cached_score = stock_sentiment_cache.get(stock)
+        if cached_score is not None:
+            logger.debug("🔁 Reusing sentiment for %s", stock)
+            stock_sentiments[stock] = cached_score
+            yield {'type': 'stock', 'ticker': stock, 'sentiment': cached_score}
+    pending = [stock for stock in all_tickers if stock not in stock_sentiments]
+    # Tickers whose group failed; their portfolios still finish, scoring them 0.0
+    failed = set()
+    remaining_portfolios = list(portfolio_ids)
+    with SentimentWriter() as writer:
+        # Work through pending tickers one news query group at a time: each group's
+        # articles are still scored in one batch, but results stream out per group
+        for start in range(0, len(pending) + 1, NEWS_BATCH_SIZE):
+            group = pending[start:start + NEWS_BATCH_SIZE]
+            if group:
+                progress('scoring', start, len(pending))
+                try:
+                    group_scores = analyze_stock_group(group, writer)
+                except Exception as e:
+                    logger.exception(f"❌ Error for stocks {group}: {e}")
+                    failed.update(group)
+                    for stock in group:
+                        yield {'type': 'stock', 'ticker': stock, 'sentiment': 0.0, 'error': str(e)}
+                else:
+                    for stock in group:
+                        stock_sentiments[stock] = group_scores.get(stock, 0.0)
+                        yield {'type': 'stock', 'ticker': stock, 'sentiment': stock_sentiments[stock]}
+            finished = [
+                portfolio_id for portfolio_id in remaining_portfolios
+                if all(stock in stock_sentiments or stock in failed for stock in portfolio_tickers[portfolio_id])
+            ]
+            if not finished:
+                # Between groups no portfolio is half-written, so a full buffer may go out here
+                writer.flush_if_due()
                 continue
-            try:
-                print(f"📊 Fetching news for {stock}...")
-                articles = fetch_news(stock + " stock")
-                print(f"📄 {len(articles)} articles found for {stock}")
-                stock_scores = []
-                for article in articles:
-                    title = article.get('title', 'No title')
-                    description = article.get('description', '')
-                    url = article.get('url', '')
-                    raw_time = article.get('publishedAt', '')
-                    try:
-                        published_at = None
-                        if raw_time:
-                            from datetime import datetime
-                            published_at = datetime.strptime(raw_time, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y-%m-%d %H:%M:%S')
-                    except:
-                        published_at = None
-                    result = analyze_sentiment(description)
-                    scalar_score = compute_scalar_score(result)
-                    stock_scores.append(scalar_score)
-                    try:
-                        print(f"📝 Saving article: {title[:40]}... → Score: {scalar_score}")
-                        save_article_to_db(stock, title, description, url, scalar_score, published_at)
-                    except Exception as e:
-                        print(f"❌ Error saving article: {e}")
-                avg_score = compute_average_sentiment(stock_scores)
-                processed_stocks[stock] = avg_score
-                save_average_sentiment(portfolio_id, stock, avg_score)
-                overall_scores.append(avg_score)
-                stock_results.append({
-                    'ticker': stock,
-                    'sentiment': avg_score
-                })
-                print(f"✅ Avg Sentiment for {stock}: {avg_score}")
-            except Exception as e:
-                print(f"❌ Error for stock {stock}: {e}")
-                stock_results.append({
-                    'ticker': stock,
-                    'sentiment': 0.0
-                })
-        print(f"[DEBUG] Using weighted average for final portfolio sentiment.")
-        final_avg = compute_portfolio_sentiment(overall_scores, num_shares)
-        save_final_portfolio_sentiment(portfolio_id, final_avg)
-        # Get portfolio name
-        from utils.db_utils import get_connection
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT portfolio_name FROM portfolio WHERE portfolio_id = %s", (portfolio_id,))
-        portfolio_name = cursor.fetchone()[0]
-        cursor.close()
-        conn.close()
-        results.append({
-            'portfolio_id': portfolio_id,
-            'portfolio_name': portfolio_name,
-            'avg_score': final_avg,
-            'stocks': stock_results
-        })
-        print(f"🎯 Final Sentiment for Portfolio {portfolio_id}: {final_avg}")
-    print(f"✅ Analysis completed successfully for {len(results)} portfolios")
-    return results
+            # Weighted sentiment for every portfolio in one vectorized pass over the holdings matrix
+            portfolio_scores = holdings.weighted_average(holdings.vector(stock_sentiments))
+            for portfolio_id in finished:
+                remaining_portfolios.remove(portfolio_id)
+                final_avg = float(portfolio_scores[portfolio_ids.index(portfolio_id)])
+                logger.info(f"🔁 Processing Portfolio ID: {portfolio_id}")
+                result = save_portfolio_results(portfolio_id, portfolio_tickers[portfolio_id], stock_sentiments, final_avg, writer)
+                bump_version(user_id)
+                yield dict(result, type='portfolio')
+    progress('done', len(portfolio_ids), len(portfolio_ids))
+
+def analyze_portfolios_for_api(user_id=1, progress=None):
+    results = {}
+    with span('analyze', user_id=user_id):
+        for event in iter_analyze_portfolios(user_id, progress=progress):
+            if event['type'] == 'portfolio':
+                results[event['portfolio_id']] = {key: value for key, value in event.items() if key != 'type'}
+    # Portfolios finish in scoring order; return them in portfolio order like before
+    ordered = [results[portfolio_id] for portfolio_id in sorted(results)]
+    logger.info(f"✅ Analysis completed successfully for {len(ordered)} portfolios")
+    return ordered
 
 def main(user_id=1):
-    global processed_stocks
-    processed_stocks = {}  # Reset cache for each run
-    portfolio_ids = get_all_portfolio_ids(user_id)
-    print(f"🧾 Found portfolios: {portfolio_ids}")
-    for pid in portfolio_ids:
-        process_portfolio(pid)
+    analyze_portfolios_for_api(user_id)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,247 @@
+"""Versioned schema migrations.
+
+Every migration runs once, in order, and is recorded in schema_migrations.
+Steps that only add something check the catalog first, so databases
+created from older copies of schema.sql are brought up to date as well as
+empty ones. The same migrations run on MySQL and SQLite (DB_BACKEND); DDL
+is written for MySQL and adapted for SQLite by portable_ddl. Add new
+migrations at the end of MIGRATIONS; never edit one that has shipped.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied and pending versions
+"""
+import re
+import sys
+from db import db_connection, is_sqlite
+from utils.log import get_logger
+
+logger = get_logger("db")
+
+def portable_ddl(statement):
+    """MySQL DDL as the current backend wants it."""
+    if not is_sqlite():
+        return statement
+    statement = statement.replace("INT PRIMARY KEY AUTO_INCREMENT", "INTEGER PRIMARY KEY AUTOINCREMENT")
+    return re.sub(r"UNIQUE KEY (\w+) \(", r"CONSTRAINT \1 UNIQUE (", statement)
+
+def _column_exists(cursor, table, column):
+    if is_sqlite():
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+def _index_exists(cursor, table, index):
+    if is_sqlite():
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s", (table, index))
+        return cursor.fetchone()[0] > 0
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+def add_column(table, column, definition):
+    def step(cursor):
+        if not _column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+def add_index(table, index, columns):
+    def step(cursor):
+        if not _index_exists(cursor, table, index):
+            cursor.execute(f"CREATE INDEX {index} ON {table}({columns})")
+    return step
+
+def drop_index(table, index):
+    def step(cursor):
+        if _index_exists(cursor, table, index):
+            cursor.execute(f"DROP INDEX {index}" if is_sqlite() else f"DROP INDEX {index} ON {table}")
+    return step
+
+# (version, description, steps); a step is a SQL string or a callable taking the cursor
+MIGRATIONS = [
+    (1, "baseline tables", [
+        """
+        CREATE TABLE IF NOT EXISTS user (
+            user_id INT PRIMARY KEY AUTO_INCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS portfolio (
+            portfolio_id INT PRIMARY KEY AUTO_INCREMENT,
+            user_id INT,
+            portfolio_name VARCHAR(100) NOT NULL,
+            avg_port_sent_score DECIMAL(5,4),
+            min_beta DECIMAL(5,2),
+            max_beta DECIMAL(5,2),
+            min_market_cap BIGINT,
+            max_market_cap BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stock (
+            stock_id INT PRIMARY KEY AUTO_INCREMENT,
+            portfolio_id INT,
+            stock_ticker VARCHAR(10) NOT NULL,
+            stock_name VARCHAR(100) NOT NULL,
+            avg_stock_sent_score DECIMAL(5,4),
+            market_cap BIGINT,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolio(portfolio_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS news (
+            news_id INT PRIMARY KEY AUTO_INCREMENT,
+            stock_ticker VARCHAR(10) NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            url VARCHAR(500),
+            sent_score DECIMAL(5,4),
+            date_time DATETIME,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_stock_url (stock_ticker, url)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recommendation (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            portfolio_id INT,
+            stock_ticker VARCHAR(10) NOT NULL,
+            beta DECIMAL(5,2),
+            market_cap BIGINT,
+            eps DECIMAL(10,2),
+            pe_ratio DECIMAL(10,2),
+            company_name VARCHAR(100),
+            FOREIGN KEY (portfolio_id) REFERENCES portfolio(portfolio_id) ON DELETE CASCADE,
+            UNIQUE KEY unique_portfolio_stock (portfolio_id, stock_ticker)
+        )
+        """,
+        add_index('portfolio', 'idx_portfolio_user_id', 'user_id'),
+        add_index('stock', 'idx_stock_portfolio_id', 'portfolio_id'),
+        add_index('news', 'idx_news_stock_ticker', 'stock_ticker'),
+        add_index('news', 'idx_news_created_at', 'created_at'),
+    ]),
+    (2, "stock.num_shares and stock.beta", [
+        add_column('stock', 'num_shares', 'INT NOT NULL DEFAULT 0'),
+        add_column('stock', 'beta', 'DECIMAL(5,2)'),
+    ]),
+    (3, "sentiment cache, screener snapshot and news checkpoints", [
+        """
+        CREATE TABLE IF NOT EXISTS sentiment_cache (
+            text_hash CHAR(64) PRIMARY KEY,
+            sent_score DECIMAL(5,4) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS screener_universe (
+            symbol VARCHAR(10) PRIMARY KEY,
+            beta DECIMAL(10,4),
+            market_cap BIGINT,
+            eps DECIMAL(12,4),
+            pe_ratio DECIMAL(12,4),
+            updated_at DATETIME
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS news_checkpoint (
+            stock_ticker VARCHAR(10) PRIMARY KEY,
+            last_checked_at DATETIME NOT NULL
+        )
+        """,
+    ]),
+    (4, "indexes for hot queries", [
+        # /api/news/<ticker>, news high-water marks and recent-score windows
+        add_index('news', 'idx_news_ticker_time', 'stock_ticker, date_time, news_id'),
+        # Prefix of idx_news_ticker_time and unique_stock_url, so it only costs writes
+        drop_index('news', 'idx_news_stock_ticker'),
+        # Per-holding updates (shares, sentiment, beta/market cap)
+        add_index('stock', 'idx_stock_portfolio_ticker', 'portfolio_id, stock_ticker'),
+        # Company names and still-held checks by ticker across portfolios
+        add_index('stock', 'idx_stock_ticker', 'stock_ticker'),
+    ]),
+    (5, "daily sentiment rollup", [
+        """
+        CREATE TABLE IF NOT EXISTS sentiment_daily (
+            stock_ticker VARCHAR(10) NOT NULL,
+            news_date DATE NOT NULL,
+            article_count INT NOT NULL,
+            score_sum DECIMAL(14,4) NOT NULL,
+            score_min DECIMAL(5,4) NOT NULL,
+            score_max DECIMAL(5,4) NOT NULL,
+            PRIMARY KEY (stock_ticker, news_date)
+        )
+        """,
+        # Backfill from the articles stored so far; later ones are added as they are saved
+        """
+        INSERT INTO sentiment_daily (stock_ticker, news_date, article_count, score_sum, score_min, score_max)
+        SELECT stock_ticker, DATE(date_time), COUNT(*), SUM(sent_score), MIN(sent_score), MAX(sent_score)
+        FROM news
+        WHERE sent_score IS NOT NULL AND date_time IS NOT NULL
+        GROUP BY stock_ticker, DATE(date_time)
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def applied_versions():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    return versions
+
+def migrate():
+    """Apply every pending migration in order; returns the versions applied."""
+    done = applied_versions()
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"🛠️ Applying migration {version}: {description}")
+        # MySQL commits DDL implicitly, which is why steps are written to be re-runnable
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(portable_ddl(step))
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            cursor.close()
+        applied.append(version)
+    if applied:
+        logger.info(f"✅ Schema at version {LATEST_VERSION}")
+    return applied
+
+if __name__ == "__main__":
+    if '--status' in sys.argv[1:]:
+        done = applied_versions()
+        for version, description, _ in MIGRATIONS:
+            logger.info(f"{'applied' if version in done else 'pending'}  {version:>3}  {description}")
+    else:
+        migrate()
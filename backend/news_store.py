@@ -0,0 +1,50 @@
+from db import db_connection, to_datetime
+
+def _in_clause(values):
+    return ','.join(['%s'] * len(values))
+
+def get_news_state(tickers):
+    """{ticker: {'high_water': latest news.date_time, 'last_checked': last NewsAPI check}} (None when unknown)."""
+    if not tickers:
+        return {}
+    tickers = list(tickers)
+    state = {ticker: {'high_water': None, 'last_checked': None} for ticker in tickers}
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT stock_ticker, MAX(date_time) FROM news
+            WHERE stock_ticker IN ({_in_clause(tickers)})
+            GROUP BY stock_ticker
+        """, tickers)
+        for ticker, high_water in cursor.fetchall():
+            state[ticker]['high_water'] = to_datetime(high_water)
+        cursor.execute(f"""
+            SELECT stock_ticker, last_checked_at FROM news_checkpoint
+            WHERE stock_ticker IN ({_in_clause(tickers)})
+        """, tickers)
+        for ticker, last_checked in cursor.fetchall():
+            state[ticker]['last_checked'] = to_datetime(last_checked)
+        cursor.close()
+    return state
+
+def get_recent_news_scores(tickers, limit):
+    """{ticker: [(date_time, sent_score, url), ...]} for the latest `limit` scored articles of each ticker."""
+    if not tickers:
+        return {}
+    tickers = list(tickers)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT stock_ticker, date_time, sent_score, url FROM (
+                SELECT stock_ticker, date_time, sent_score, url,
+                       ROW_NUMBER() OVER (PARTITION BY stock_ticker ORDER BY date_time DESC, news_id DESC) AS rn
+                FROM news
+                WHERE stock_ticker IN ({_in_clause(tickers)}) AND sent_score IS NOT NULL
+            ) ranked
+            WHERE rn <= %s
+        """, tickers + [limit])
+        scores = {ticker: [] for ticker in tickers}
+        for ticker, date_time, sent_score, url in cursor.fetchall():
+            scores[ticker].append((to_datetime(date_time), float(sent_score), url))
+        cursor.close()
+    return scores
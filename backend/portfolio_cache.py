@@ -0,0 +1,38 @@
+import os
+import hashlib
+import threading
+from utils.ttl_cache import TTLCache
+
+PORTFOLIO_VIEW_CACHE_SIZE = int(os.getenv("PORTFOLIO_VIEW_CACHE_SIZE", "1000"))
+PORTFOLIO_VIEW_TTL = float(os.getenv("PORTFOLIO_VIEW_TTL", "3600"))
+
+# Per-user version counter, bumped by every write that changes what
+# /api/get-portfolios returns. Cached responses are only served while the
+# version they were built from is still current.
+_versions = {}
+_versions_lock = threading.Lock()
+
+# user_id -> (version, body, etag)
+portfolio_view_cache = TTLCache(maxsize=PORTFOLIO_VIEW_CACHE_SIZE, ttl=PORTFOLIO_VIEW_TTL)
+
+def get_version(user_id):
+    with _versions_lock:
+        return _versions.get(user_id, 0)
+
+def bump_version(user_id):
+    with _versions_lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+    portfolio_view_cache.invalidate(user_id)
+
+def get_cached_view(user_id, version):
+    """(body, etag) cached for this exact version, or None."""
+    entry = portfolio_view_cache.get(user_id)
+    if entry is None or entry[0] != version:
+        return None
+    return entry[1], entry[2]
+
+def store_view(user_id, version, body):
+    """Cache a rendered body; the ETag is a content hash so it stays valid across restarts."""
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    portfolio_view_cache.set(user_id, (version, body, etag))
+    return etag
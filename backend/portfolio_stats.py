@@ -0,0 +1,104 @@
+import numpy as np
+
+class Holdings:
+    """One user's holdings as a portfolios x tickers share matrix.
+
+    `held` marks which cells are real holdings (a holding can have 0 shares);
+    per-ticker inputs are 1-D arrays aligned with `tickers`, NaN where unknown.
+    """
+
+    def __init__(self, portfolio_ids, tickers, shares, held):
+        self.portfolio_ids = list(portfolio_ids)
+        self.tickers = list(tickers)
+        self.shares = shares
+        self.held = held
+        self._row = {portfolio_id: i for i, portfolio_id in enumerate(self.portfolio_ids)}
+        self._col = {ticker: j for j, ticker in enumerate(self.tickers)}
+
+    @classmethod
+    def from_rows(cls, rows, portfolio_ids=None):
+        """rows: (portfolio_id, stock_ticker, num_shares). Missing share counts count as 1."""
+        rows = list(rows)
+        if portfolio_ids is None:
+            portfolio_ids = list(dict.fromkeys(row[0] for row in rows))
+        tickers = list(dict.fromkeys(row[1] for row in rows))
+        row_index = {portfolio_id: i for i, portfolio_id in enumerate(portfolio_ids)}
+        col_index = {ticker: j for j, ticker in enumerate(tickers)}
+        shares = np.zeros((len(portfolio_ids), len(tickers)))
+        held = np.zeros((len(portfolio_ids), len(tickers)), dtype=bool)
+        for portfolio_id, ticker, num_shares in rows:
+            if portfolio_id not in row_index:
+                continue
+            i, j = row_index[portfolio_id], col_index[ticker]
+            shares[i, j] += 1 if num_shares is None else float(num_shares)
+            held[i, j] = True
+        return cls(portfolio_ids, tickers, shares, held)
+
+    def tickers_of(self, portfolio_id):
+        row = self.held[self._row[portfolio_id]]
+        return [ticker for ticker, is_held in zip(self.tickers, row) if is_held]
+
+    def shares_of(self, portfolio_id):
+        i = self._row[portfolio_id]
+        return {ticker: self.shares[i, self._col[ticker]] for ticker in self.tickers_of(portfolio_id)}
+
+    def vector(self, values_by_ticker):
+        """Align a {ticker: value} dict with the ticker columns, NaN where missing."""
+        return np.array(
+            [np.nan if values_by_ticker.get(ticker) is None else float(values_by_ticker[ticker]) for ticker in self.tickers],
+            dtype=float
+        )
+
+    def weighted_average(self, values):
+        """Share-weighted average per portfolio.
+
+        Tickers without a value add nothing to the sum but their shares still
+        count in the denominator, matching the original per-portfolio loops.
+        """
+        weights = np.where(self.held, self.shares, 0.0)
+        total = weights.sum(axis=1)
+        weighted = weights @ np.nan_to_num(values, nan=0.0)
+        return np.divide(weighted, total, out=np.zeros_like(total), where=total != 0)
+
+    def value_ranges(self, values):
+        """(min, max) per portfolio over held tickers with a value; NaN for portfolios with none."""
+        present = self.held & ~np.isnan(values)[np.newaxis, :]
+        lows = np.where(present, values[np.newaxis, :], np.inf).min(axis=1, initial=np.inf)
+        highs = np.where(present, values[np.newaxis, :], -np.inf).max(axis=1, initial=-np.inf)
+        has_any = present.any(axis=1)
+        return np.where(has_any, lows, np.nan), np.where(has_any, highs, np.nan)
+
+    def metric_stats(self, beta, market_cap):
+        """Min/max and weighted average of beta and market cap for every portfolio in one pass.
+
+        Returns {portfolio_id: {...}} with None where a portfolio has no data.
+        """
+        min_beta, max_beta = self.value_ranges(beta)
+        min_cap, max_cap = self.value_ranges(market_cap)
+        wavg_beta = self.weighted_average(beta)
+        wavg_cap = self.weighted_average(market_cap)
+        stats = {}
+        for i, portfolio_id in enumerate(self.portfolio_ids):
+            stats[portfolio_id] = {
+                'min_beta': _scalar(min_beta[i]),
+                'max_beta': _scalar(max_beta[i]),
+                'min_market_cap': _scalar(min_cap[i]),
+                'max_market_cap': _scalar(max_cap[i]),
+                'wavg_beta': float(wavg_beta[i]),
+                'wavg_market_cap': float(wavg_cap[i]),
+            }
+        return stats
+
+def _scalar(value):
+    return None if np.isnan(value) else float(value)
+
+def weighted_mean(scores, num_shares):
+    """Share-weighted mean of one portfolio's per-stock scores."""
+    count = min(len(scores), len(num_shares))
+    if count == 0:
+        return 0.0
+    shares = np.asarray(num_shares, dtype=float)
+    total = shares.sum()
+    if not total:
+        return 0.0
+    return float(np.dot(np.asarray(scores[:count], dtype=float), shares[:count]) / total)
@@ -0,0 +1,168 @@
+from collections import defaultdict, deque
+from db import db_connection
+from utils.log import get_logger
+from utils.metrics import span
+from utils.sentiment_history import sentiment_history
+from sentiment_rollup import delete_rollup
+from main import stock_sentiment_cache
+
+logger = get_logger("db")
+
+def _in_clause(values):
+    return ','.join(['%s'] * len(values))
+
+def parse_shares(value):
+    # Ensure shares is an integer and handle empty/invalid values
+    try:
+        return int(value or 0)
+    except (ValueError, TypeError):
+        return 0
+
+def diff_portfolios(existing_portfolios, existing_stocks, portfolios):
+    """Work out the changes that turn the stored portfolios into `portfolios`.
+
+    existing_portfolios: [(portfolio_id, portfolio_name)] and existing_stocks:
+    [(stock_id, portfolio_id, stock_ticker, stock_name, num_shares)], both in
+    id order. `portfolios` is the save-portfolios payload. Portfolios are
+    matched by name and stocks by ticker within their portfolio, in order
+    when a name or ticker repeats, so unchanged holdings keep their rows.
+    """
+    by_name = defaultdict(deque)
+    for portfolio_id, portfolio_name in existing_portfolios:
+        by_name[portfolio_name].append(portfolio_id)
+    stocks_by_portfolio = defaultdict(lambda: defaultdict(deque))
+    for stock_id, portfolio_id, ticker, name, num_shares in existing_stocks:
+        stocks_by_portfolio[portfolio_id][ticker].append((stock_id, name, num_shares))
+
+    diff = {
+        'delete_portfolios': [],
+        'new_portfolios': [],        # (name, [(ticker, stock_name, num_shares)])
+        'insert_stocks': [],         # (portfolio_id, ticker, stock_name, num_shares)
+        'update_stocks': [],         # (stock_name, num_shares, stock_id)
+        'delete_stocks': [],         # stock_id
+        'changed_portfolios': [],    # kept portfolio_ids whose holdings changed
+    }
+    for portfolio in portfolios:
+        stocks = [
+            (stock['ticker'], stock['name'], parse_shares(stock.get('shares')))
+            for stock in portfolio.get('stocks', [])
+        ]
+        if not by_name[portfolio['name']]:
+            diff['new_portfolios'].append((portfolio['name'], stocks))
+            continue
+        portfolio_id = by_name[portfolio['name']].popleft()
+        current = stocks_by_portfolio.pop(portfolio_id, {})
+        changed = False
+        for ticker, name, num_shares in stocks:
+            if current.get(ticker):
+                stock_id, old_name, old_shares = current[ticker].popleft()
+                if old_name != name or old_shares != num_shares:
+                    diff['update_stocks'].append((name, num_shares, stock_id))
+                    changed = changed or old_shares != num_shares
+            else:
+                diff['insert_stocks'].append((portfolio_id, ticker, name, num_shares))
+                changed = True
+        for rows in current.values():
+            for stock_id, _, _ in rows:
+                diff['delete_stocks'].append(stock_id)
+                changed = True
+        if changed:
+            diff['changed_portfolios'].append(portfolio_id)
+    for portfolio_ids in by_name.values():
+        diff['delete_portfolios'].extend(portfolio_ids)
+    return diff
+
+def save_user_portfolios(user_id, portfolios):
+    """Bring a user's stored portfolios in line with `portfolios`, writing only what changed.
+
+    Everything is applied with executemany in one transaction. Kept holdings
+    keep their sentiment columns and news; portfolios whose holdings changed
+    have their portfolio score cleared until the next analyze run. News and
+    cached sentiment are only dropped for tickers that no portfolio holds any
+    more. Returns counts of each kind of change.
+    """
+    with span('db_write'), db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT portfolio_id, portfolio_name FROM portfolio WHERE user_id = %s ORDER BY portfolio_id",
+            (user_id,)
+        )
+        existing_portfolios = cursor.fetchall()
+        cursor.execute("""
+            SELECT s.stock_id, s.portfolio_id, s.stock_ticker, s.stock_name, s.num_shares
+            FROM stock s
+            JOIN portfolio p ON s.portfolio_id = p.portfolio_id
+            WHERE p.user_id = %s
+            ORDER BY s.stock_id
+        """, (user_id,))
+        existing_stocks = cursor.fetchall()
+        diff = diff_portfolios(existing_portfolios, existing_stocks, portfolios)
+
+        removed_ids = set(diff['delete_stocks'])
+        deleted_portfolios = set(diff['delete_portfolios'])
+        removed_tickers = {
+            ticker for stock_id, portfolio_id, ticker, _, _ in existing_stocks
+            if stock_id in removed_ids or portfolio_id in deleted_portfolios
+        }
+
+        if diff['delete_portfolios']:
+            params = [(portfolio_id,) for portfolio_id in diff['delete_portfolios']]
+            cursor.executemany("DELETE FROM stock WHERE portfolio_id = %s", params)
+            cursor.executemany("DELETE FROM portfolio WHERE portfolio_id = %s", params)
+        if diff['delete_stocks']:
+            cursor.executemany("DELETE FROM stock WHERE stock_id = %s", [(stock_id,) for stock_id in diff['delete_stocks']])
+        if diff['update_stocks']:
+            cursor.executemany("UPDATE stock SET stock_name = %s, num_shares = %s WHERE stock_id = %s", diff['update_stocks'])
+
+        insert_stocks = list(diff['insert_stocks'])
+        if diff['new_portfolios']:
+            cursor.executemany(
+                "INSERT INTO portfolio (user_id, portfolio_name) VALUES (%s, %s)",
+                [(user_id, name) for name, _ in diff['new_portfolios']]
+            )
+            # New ids are the user's portfolios we did not have before, in insertion order
+            kept = {portfolio_id for portfolio_id, _ in existing_portfolios}
+            cursor.execute("SELECT portfolio_id FROM portfolio WHERE user_id = %s ORDER BY portfolio_id", (user_id,))
+            new_ids = [row[0] for row in cursor.fetchall() if row[0] not in kept]
+            for portfolio_id, (_, stocks) in zip(new_ids, diff['new_portfolios']):
+                insert_stocks.extend((portfolio_id, ticker, name, num_shares) for ticker, name, num_shares in stocks)
+        if insert_stocks:
+            cursor.executemany(
+                "INSERT INTO stock (portfolio_id, stock_ticker, stock_name, num_shares) VALUES (%s, %s, %s, %s)",
+                insert_stocks
+            )
+        if diff['changed_portfolios']:
+            cursor.executemany(
+                "UPDATE portfolio SET avg_port_sent_score = NULL WHERE portfolio_id = %s",
+                [(portfolio_id,) for portfolio_id in diff['changed_portfolios']]
+            )
+
+        removed_tickers -= {ticker for _, ticker, _, _ in insert_stocks}
+        orphaned = []
+        if removed_tickers:
+            removed_tickers = list(removed_tickers)
+            cursor.execute(
+                f"SELECT DISTINCT stock_ticker FROM stock WHERE stock_ticker IN ({_in_clause(removed_tickers)})",
+                removed_tickers
+            )
+            still_held = {row[0] for row in cursor.fetchall()}
+            orphaned = [ticker for ticker in removed_tickers if ticker not in still_held]
+        if orphaned:
+            cursor.execute(f"DELETE FROM news WHERE stock_ticker IN ({_in_clause(orphaned)})", orphaned)
+            cursor.execute(f"DELETE FROM news_checkpoint WHERE stock_ticker IN ({_in_clause(orphaned)})", orphaned)
+            delete_rollup(cursor, orphaned)
+        cursor.close()
+    sentiment_history.discard(orphaned)
+    # Like clear_all_data: a ticker bought again later must not get its old score back
+    stock_sentiment_cache.invalidate_many(orphaned)
+
+    summary = {
+        'portfolios_added': len(diff['new_portfolios']),
+        'portfolios_removed': len(diff['delete_portfolios']),
+        'stocks_added': len(insert_stocks),
+        'stocks_updated': len(diff['update_stocks']),
+        'stocks_removed': len(diff['delete_stocks']),
+        'news_tickers_removed': len(orphaned),
+    }
+    logger.info(f"💾 Saved portfolios for user {user_id}: {summary}")
+    return summary
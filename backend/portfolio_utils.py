@@ -1,22 +1,90 @@
-from db import get_connection
+from db import db_connection
 
 def get_all_portfolio_ids(user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT portfolio_id FROM portfolio WHERE user_id = %s", (user_id,))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT portfolio_id FROM portfolio WHERE user_id = %s", (user_id,))
+        results = cursor.fetchall()
+        cursor.close()
     return [row[0] for row in results]
 
 def get_unique_tickers_by_portfolio(portfolio_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT DISTINCT stock_ticker FROM stock 
-        WHERE portfolio_id = %s
-    """, (portfolio_id,))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT stock_ticker FROM stock 
+            WHERE portfolio_id = %s
+        """, (portfolio_id,))
+        results = cursor.fetchall()
+        cursor.close()
     return [row[0] for row in results]
+
+def get_held_tickers():
+    """Distinct tickers held in any portfolio of any user."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT stock_ticker FROM stock")
+        results = cursor.fetchall()
+        cursor.close()
+    return [row[0] for row in results]
+
+def get_user_holdings(user_id):
+    """(portfolio_id, stock_ticker, num_shares) for every holding of the user, in one query."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.portfolio_id, s.stock_ticker, s.num_shares
+            FROM stock s
+            JOIN portfolio p ON s.portfolio_id = p.portfolio_id
+            WHERE p.user_id = %s
+            ORDER BY s.portfolio_id, s.stock_id
+        """, (user_id,))
+        results = cursor.fetchall()
+        cursor.close()
+    return results
+
+def get_stock_names(tickers):
+    if not tickers:
+        return {}
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT stock_ticker, MAX(stock_name) FROM stock
+            WHERE stock_ticker IN ({}) AND stock_name IS NOT NULL AND stock_name != ''
+            GROUP BY stock_ticker
+        """.format(','.join(['%s'] * len(tickers))), list(tickers))
+        results = cursor.fetchall()
+        cursor.close()
+    return {row[0]: row[1] for row in results}
+
+def get_portfolio_view(user_id):
+    """The dashboard payload for a user: portfolios with their stocks, from one JOIN in one pass."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.portfolio_id, p.portfolio_name, p.avg_port_sent_score,
+                   s.stock_ticker, s.avg_stock_sent_score
+            FROM portfolio p
+            LEFT JOIN stock s ON s.portfolio_id = p.portfolio_id
+            WHERE p.user_id = %s
+            ORDER BY p.portfolio_id, s.stock_id
+        """, (user_id,))
+        rows = cursor.fetchall()
+        cursor.close()
+    results = []
+    current = None
+    for portfolio_id, portfolio_name, avg_port_sent_score, stock_ticker, avg_stock_sent_score in rows:
+        if current is None or current['portfolio_id'] != portfolio_id:
+            current = {
+                'portfolio_id': portfolio_id,
+                'portfolio_name': portfolio_name,
+                'avg_score': avg_port_sent_score or 0.0,
+                'stocks': []
+            }
+            results.append(current)
+        if stock_ticker is not None:  # LEFT JOIN row of a portfolio with no stocks
+            current['stocks'].append({
+                'ticker': stock_ticker,
+                'sentiment': avg_stock_sent_score or 0.0
+            })
+    return results
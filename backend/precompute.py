@@ -0,0 +1,212 @@
+import os
+import time
+import threading
+from datetime import datetime
+from portfolio_utils import get_held_tickers
+from news_store import get_news_state
+from main import refresh_stock_group, set_recheck_interval, NEWS_RECHECK_INTERVAL
+from save_utils import SentimentWriter
+from utils.news_utils import NEWS_BATCH_SIZE
+from utils.metric_store import metric_store, METRIC_TTL
+from utils.http_client import TokenBucket
+from utils.log import get_logger
+from utils.metrics import span, register_stats
+
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "1") == "1"
+PRECOMPUTE_TICK = float(os.getenv("PRECOMPUTE_TICK", "60"))
+# Bounds for each ticker's adaptive news interval, and how many new articles a check should find
+PRECOMPUTE_MIN_INTERVAL = float(os.getenv("PRECOMPUTE_MIN_INTERVAL", str(NEWS_RECHECK_INTERVAL)))
+PRECOMPUTE_MAX_INTERVAL = float(os.getenv("PRECOMPUTE_MAX_INTERVAL", "21600"))
+PRECOMPUTE_TARGET_ARTICLES = float(os.getenv("PRECOMPUTE_TARGET_ARTICLES", "2"))
+# The scheduler's share of each provider. Its calls still go through the
+# process-wide rate limits, so interactive requests and the scheduler together
+# never exceed them; these budgets keep the scheduler from using them all.
+PRECOMPUTE_NEWSAPI_PER_HOUR = float(os.getenv("PRECOMPUTE_NEWSAPI_PER_HOUR", "20"))
+PRECOMPUTE_FINNHUB_PER_HOUR = float(os.getenv("PRECOMPUTE_FINNHUB_PER_HOUR", "300"))
+# Metrics are refreshed at this share of METRIC_TTL, before interactive reads would miss
+METRIC_REFRESH_AFTER = METRIC_TTL * 0.8
+
+logger = get_logger("precompute")
+
+def _budget(per_hour):
+    # Bursts of up to five minutes' worth, so a backlog drains without a spike
+    return TokenBucket(per_hour / 60.0, max(1, round(per_hour / 12)))
+
+def next_interval(interval, elapsed, new_articles):
+    """Recheck interval after a check that found new_articles over the last elapsed seconds.
+
+    Aims for PRECOMPUTE_TARGET_ARTICLES new articles per check: busy tickers
+    are checked more often, quiet ones back off exponentially.
+    """
+    if new_articles:
+        ideal = elapsed * PRECOMPUTE_TARGET_ARTICLES / new_articles
+        # Move halfway to the ideal so one burst of news doesn't swing the interval
+        interval = (interval + ideal) / 2
+    else:
+        interval *= 2
+    return min(PRECOMPUTE_MAX_INTERVAL, max(PRECOMPUTE_MIN_INTERVAL, interval))
+
+class PrecomputeScheduler:
+    """Keeps news sentiment and Finnhub metrics of every held ticker warm in the background.
+
+    Every PRECOMPUTE_TICK seconds the distinct tickers across all stock rows
+    are re-read. Tickers whose news is due are refreshed a NewsAPI query
+    group at a time (new articles scored and stored, per-ticker sentiment
+    cached), and tickers whose metrics are due are re-fetched into
+    metric_store. Work beyond the per-provider budgets stays due, most
+    overdue first, for the next tick. Each ticker's news interval adapts to
+    how many new articles its checks find and is shared with the interactive
+    analyze path, so Analyze doesn't query NewsAPI for tickers kept fresh here.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ticker -> {'interval', 'last_checked', 'news_due', 'metrics_due'} (epoch seconds)
+        self._tickers = {}
+        self._news_budget = _budget(PRECOMPUTE_NEWSAPI_PER_HOUR)
+        self._metric_budget = _budget(PRECOMPUTE_FINNHUB_PER_HOUR)
+        self.stats = {'news_refreshes': 0, 'metric_refreshes': 0, 'new_articles': 0, 'budget_deferrals': 0, 'failures': 0}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _sync_tickers(self, now):
+        held = set(get_held_tickers())
+        with self._lock:
+            for ticker in list(self._tickers):
+                if ticker not in held:
+                    del self._tickers[ticker]
+            added = [ticker for ticker in held if ticker not in self._tickers]
+        if not added:
+            return
+        # Pick up where the last process (or an interactive run) left off instead of re-checking everything
+        state = get_news_state(added)
+        utcnow = datetime.utcnow()
+        with self._lock:
+            for ticker in added:
+                last_checked = state[ticker]['last_checked']
+                last_checked = now - (utcnow - last_checked).total_seconds() if last_checked else None
+                self._tickers[ticker] = {
+                    'interval': PRECOMPUTE_MIN_INTERVAL,
+                    'last_checked': last_checked,
+                    'news_due': last_checked + PRECOMPUTE_MIN_INTERVAL if last_checked else now,
+                    'metrics_due': now,
+                }
+                set_recheck_interval(ticker, PRECOMPUTE_MIN_INTERVAL)
+
+    def _due(self, key, now):
+        with self._lock:
+            due = [(entry[key], ticker) for ticker, entry in self._tickers.items() if entry[key] <= now]
+        return [ticker for _, ticker in sorted(due)]
+
+    def _refresh_news(self, now):
+        due = self._due('news_due', now)
+        for start in range(0, len(due), NEWS_BATCH_SIZE):
+            group = due[start:start + NEWS_BATCH_SIZE]
+            refused = []
+
+            def budget():
+                if self._news_budget.try_acquire():
+                    return True
+                refused.append(True)
+                return False
+
+            try:
+                with span('precompute_news', tickers=len(group)), SentimentWriter() as writer:
+                    # The scheduler owns the timing of these tickers, so skip the recheck test.
+                    # Every NewsAPI request, single-ticker fallbacks included, takes a budget token.
+                    _, new_counts = refresh_stock_group(group, writer, force=True, budget=budget)
+            except Exception as e:
+                # A failure says nothing about how busy the tickers are: leave their
+                # intervals alone and keep them due for the next tick
+                logger.warning(f"⚠️ Precompute news refresh failed for {group}: {e}")
+                self._count('failures')
+                continue
+            self._count('news_refreshes', len(new_counts))
+            self._count('new_articles', sum(new_counts.values()))
+            with self._lock:
+                for ticker in new_counts:
+                    entry = self._tickers.get(ticker)
+                    if entry is None:
+                        continue
+                    elapsed = now - entry['last_checked'] if entry['last_checked'] else entry['interval']
+                    entry['interval'] = next_interval(entry['interval'], elapsed, new_counts[ticker])
+                    entry['last_checked'] = now
+                    entry['news_due'] = now + entry['interval']
+                    set_recheck_interval(ticker, entry['interval'])
+                    logger.debug("🗓️ %s: %d new articles, next check in %.0fs", ticker, new_counts[ticker], entry['interval'])
+            if len(new_counts) == len(group):
+                continue
+            if refused:
+                # Out of budget: the unchecked tickers stay due, most overdue first, for the next tick
+                self._count('budget_deferrals', len(due) - start - len(new_counts))
+                return
+            # NewsAPI failed for the tickers missing from new_counts; like an exception, they stay due unchanged
+            self._count('failures')
+            logger.warning(f"⚠️ Precompute news refresh failed for {[ticker for ticker in group if ticker not in new_counts]}")
+
+    def _refresh_metrics(self, now):
+        due = self._due('metrics_due', now)
+        for index, ticker in enumerate(due):
+            if not self._metric_budget.try_acquire():
+                self._count('budget_deferrals', len(due) - index)
+                return
+            with span('precompute_metrics'):
+                metrics = metric_store.refresh(ticker)
+            if metrics is None:
+                self._count('failures')
+            else:
+                self._count('metric_refreshes')
+            with self._lock:
+                if ticker in self._tickers:
+                    self._tickers[ticker]['metrics_due'] = now + (METRIC_REFRESH_AFTER if metrics is not None else PRECOMPUTE_MIN_INTERVAL)
+
+    def run_once(self, now=None):
+        """One scheduling pass; the background thread calls this every PRECOMPUTE_TICK seconds."""
+        now = time.time() if now is None else now
+        self._sync_tickers(now)
+        self._refresh_news(now)
+        self._refresh_metrics(now)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning(f"⚠️ Precompute pass failed: {e}")
+                self._count('failures')
+            self._stop.wait(PRECOMPUTE_TICK)
+
+    def start(self):
+        """Start the background scheduler once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="precompute", daemon=True)
+            self._thread.start()
+        logger.info(f"🗓️ Precompute scheduler started (every {PRECOMPUTE_TICK:.0f}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            stats = dict(self.stats)
+            intervals = [entry['interval'] for entry in self._tickers.values()]
+            stats.update(
+                tracked=len(self._tickers),
+                news_due=sum(1 for entry in self._tickers.values() if entry['news_due'] <= now),
+                metrics_due=sum(1 for entry in self._tickers.values() if entry['metrics_due'] <= now),
+                mean_interval=round(sum(intervals) / len(intervals), 1) if intervals else None,
+                running=self._thread is not None and self._thread.is_alive(),
+            )
+        return stats
+
+scheduler = PrecomputeScheduler()
+register_stats('stockai_precompute', scheduler.get_stats,
+               counters=('news_refreshes', 'metric_refreshes', 'new_articles', 'budget_deferrals', 'failures'),
+               gauges=('tracked', 'news_due', 'metrics_due'), help='Background precompute')
@@ -1,28 +1,18 @@
-from flask import Blueprint, request, jsonify, make_response
+from flask import Blueprint, request, jsonify, make_response, Response, stream_with_context
+import json
 from datetime import datetime
-import threading
-import os
-import sys
-from portfolio_utils import get_all_portfolio_ids, get_unique_tickers_by_portfolio
-from save_utils import (
-    delete_sentiment_scores_only,
-    save_article_to_db,
-    save_average_sentiment,
-    save_final_portfolio_sentiment
-)
-from main import analyze_portfolios_for_api
-from QRE_new import main as run_qre_new
-from utils.db_utils import get_connection
-from utils.news_utils import fetch_news
-from utils.sentiment_utils import analyze_sentiment, compute_scalar_score, compute_average_sentiment
+from portfolio_utils import get_all_portfolio_ids, get_portfolio_view
+from portfolio_sync import save_user_portfolios
+from portfolio_cache import get_version, bump_version, get_cached_view, store_view
+from main import analyze_portfolios_for_api, iter_analyze_portfolios, stock_sentiment_cache
+from QRE_new import main as run_qre_new, get_recommendations_for_user, user_run_slot
+from jobs import submit_job, get_job
+from utils.db_utils import db_connection
+from utils.sentiment_history import sentiment_history
+from sentiment_rollup import get_ticker_trends, get_portfolio_trends, delete_rollup
 
 api_bp = Blueprint('api', __name__)
 
-# Global locks for QRE
-qre_locks = {}
-qre_locks_lock = threading.Lock()
-processed_stocks = {}
-
 @api_bp.route('/api/test', methods=['GET'])
 def test_connection():
     return jsonify({
@@ -37,50 +27,13 @@ def save_portfolios():
         data = request.json
         portfolios = data.get('portfolios', [])
         user_id = data.get('user_id', 1)
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT portfolio_id FROM portfolio WHERE user_id = %s", (user_id,))
-        old_portfolio_ids = [row[0] for row in cursor.fetchall()]
-        if old_portfolio_ids:
-            cursor.execute("""
-                SELECT stock_ticker FROM stock 
-                WHERE portfolio_id IN ({})
-            """.format(','.join(['%s'] * len(old_portfolio_ids))), old_portfolio_ids)
-            old_stock_tickers = [row[0] for row in cursor.fetchall()]
-            if old_stock_tickers:
-                cursor.execute("""
-                    DELETE FROM news 
-                    WHERE stock_ticker IN ({})
-                """.format(','.join(['%s'] * len(old_stock_tickers))), old_stock_tickers)
-            cursor.execute("""
-                DELETE FROM stock 
-                WHERE portfolio_id IN ({})
-            """.format(','.join(['%s'] * len(old_portfolio_ids))), old_portfolio_ids)
-            cursor.execute("DELETE FROM portfolio WHERE user_id = %s", (user_id,))
-        for portfolio in portfolios:
-            cursor.execute(
-                "INSERT INTO portfolio (user_id, portfolio_name) VALUES (%s, %s)",
-                (user_id, portfolio['name'])
-            )
-            portfolio_id = cursor.lastrowid
-            for stock in portfolio['stocks']:
-                # Ensure shares is an integer and handle empty/invalid values
-                try:
-                    num_shares = int(stock.get('shares', 0))
-                except (ValueError, TypeError):
-                    num_shares = 0
-                print(f"Inserting stock: {stock['ticker']}, shares: {stock.get('shares')}, num_shares: {num_shares}")
-                cursor.execute(
-                    "INSERT INTO stock (portfolio_id, stock_ticker, stock_name, num_shares) VALUES (%s, %s, %s, %s)",
-                    (portfolio_id, stock['ticker'], stock['name'], num_shares)
-                )
-        conn.commit()
-        cursor.close()
-        conn.close()
+        changes = save_user_portfolios(user_id, portfolios)
+        bump_version(user_id)
         return jsonify({
             'success': True,
             'message': f'Successfully saved {len(portfolios)} portfolios',
-            'user_id': user_id
+            'user_id': user_id,
+            'changes': changes
         })
     except Exception as e:
         return jsonify({
@@ -98,119 +51,217 @@ def analyze_portfolios(user_id):
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@api_bp.route('/api/analyze-portfolios/<int:user_id>/stream', methods=['GET'])
+def stream_analyze_portfolios(user_id):
+    """Server-Sent Events: one `stock` event per scored ticker, one `portfolio` event per finished portfolio, then `done`."""
+    def generate():
+        try:
+            for event in iter_analyze_portfolios(user_id):
+                yield _sse(event['type'], {key: value for key, value in event.items() if key != 'type'})
+            yield _sse('done', {'success': True})
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield _sse('error', {'success': False, 'error': str(e)})
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @api_bp.route('/api/get-portfolios/<int:user_id>', methods=['GET'])
 def get_portfolios(user_id):
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT portfolio_id, portfolio_name, avg_port_sent_score 
-            FROM portfolio 
-            WHERE user_id = %s
-        """, (user_id,))
-        portfolios = cursor.fetchall()
-        results = []
-        for portfolio in portfolios:
-            cursor.execute("""
-                SELECT stock_ticker, stock_name, avg_stock_sent_score 
-                FROM stock 
-                WHERE portfolio_id = %s
-            """, (portfolio['portfolio_id'],))
-            stocks = cursor.fetchall()
-            results.append({
-                'portfolio_id': portfolio['portfolio_id'],
-                'portfolio_name': portfolio['portfolio_name'],
-                'avg_score': portfolio['avg_port_sent_score'] or 0.0,
-                'stocks': [
-                    {
-                        'ticker': stock['stock_ticker'],
-                        'sentiment': stock['avg_stock_sent_score'] or 0.0
-                    }
-                    for stock in stocks
-                ]
-            })
-        cursor.close()
-        conn.close()
-        return jsonify({
-            'success': True,
-            'data': results
-        })
+        version = get_version(user_id)
+        cached = get_cached_view(user_id, version)
+        if cached is None:
+            body = jsonify({
+                'success': True,
+                'data': get_portfolio_view(user_id)
+            }).get_data()
+            etag = store_view(user_id, version, body)
+        else:
+            body, etag = cached
+        response = make_response(body)
+        response.mimetype = 'application/json'
+        response.set_etag(etag)
+        # Clients must revalidate, which is a 304 while nothing has changed
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def _requested_portfolio_ids():
+    """Optional {"portfolio_ids": [...]} body limiting a QRE run to some portfolios."""
+    data = request.get_json(silent=True) or {}
+    portfolio_ids = data.get('portfolio_ids')
+    return [int(portfolio_id) for portfolio_id in portfolio_ids] if portfolio_ids else None
+
 @api_bp.route('/api/recommendations/<int:user_id>', methods=['POST'])
 def get_recommendations(user_id):
-    from portfolio_utils import get_all_portfolio_ids
-    portfolio_ids = get_all_portfolio_ids(user_id)
-    with qre_locks_lock:
-        if user_id not in qre_locks:
-            qre_locks[user_id] = threading.Lock()
-        user_lock = qre_locks[user_id]
-    acquired = user_lock.acquire(blocking=False)
-    if not acquired:
+    # Within the per-user limit, locking is per portfolio inside QRE: a request
+    # overlapping another run waits for the shared portfolios
+    slot = user_run_slot(user_id)
+    if not slot.acquire(blocking=False):
         return jsonify({'success': False, 'error': 'QRE is already running for this user. Please wait.'}), 429
     try:
-        run_qre_new(user_id)
-        conn = get_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT DISTINCT r.*, p.portfolio_name
-            FROM recommendation r
-            JOIN portfolio p ON r.portfolio_id = p.portfolio_id
-            WHERE r.portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE user_id = %s)
-        """, (user_id,))
-        recommendations = cur.fetchall()
-        cur.close()
-        conn.close()
-        return jsonify({'success': True, 'recommendations': recommendations})
+        statuses = run_qre_new(user_id, portfolio_ids=_requested_portfolio_ids())
+        recommendations = get_recommendations_for_user(user_id)
+        return jsonify({'success': True, 'recommendations': recommendations, 'portfolios': statuses})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
     finally:
-        user_lock.release()
+        slot.release()
+
+def _run_recommendations_job(user_id, progress, portfolio_ids=None):
+    progress('waiting_for_slot')
+    # Jobs queue behind the user's other runs instead of failing with 429
+    with user_run_slot(user_id):
+        run_qre_new(user_id, progress=progress, portfolio_ids=portfolio_ids)
+    return get_recommendations_for_user(user_id)
+
+@api_bp.route('/api/jobs/analyze/<int:user_id>', methods=['POST'])
+def submit_analyze_job(user_id):
+    job = submit_job('analyze', user_id, lambda progress: analyze_portfolios_for_api(user_id, progress=progress))
+    return jsonify({'success': True, 'job': job}), 202
+
+@api_bp.route('/api/jobs/recommendations/<int:user_id>', methods=['POST'])
+def submit_recommendations_job(user_id):
+    portfolio_ids = _requested_portfolio_ids()
+    # Runs for different portfolio subsets are separate jobs; identical ones are deduplicated
+    kind = 'recommendations' if portfolio_ids is None else f"recommendations:{','.join(map(str, sorted(portfolio_ids)))}"
+    job = submit_job(kind, user_id, lambda progress: _run_recommendations_job(user_id, progress, portfolio_ids))
+    return jsonify({'success': True, 'job': job}), 202
+
+@api_bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
 
 @api_bp.route('/api/health', methods=['GET'])
 def health_check():
-    from utils.sentiment_utils import finbert_client
+    from utils.sentiment_utils import sentiment_backend
     from utils.news_utils import NEWS_API_KEY
-    from utils.sentiment_utils import FINBERT_TOKEN
+    from utils.sentiment_backends import SENTIMENT_BACKEND
+    from db import pool, DB_BACKEND
     return jsonify({
         'status': 'healthy',
         'message': 'Backend API is running',
-        'finbert_available': finbert_client is not None,
+        'finbert_available': sentiment_backend is not None,
+        'sentiment_backend': sentiment_backend.name if sentiment_backend else None,
         'news_api_key': 'configured' if NEWS_API_KEY else 'missing',
-        'finbert_token': 'configured' if FINBERT_TOKEN else 'missing'
+        'sentiment_backend_configured': SENTIMENT_BACKEND,
+        'db_backend': DB_BACKEND,
+        'db_pool': pool.get_stats()
     })
 
+@api_bp.route('/api/sentiment-cache/stats', methods=['GET'])
+def sentiment_cache_stats():
+    from utils.sentiment_cache import get_cache_stats
+    return jsonify({
+        'success': True,
+        'stats': get_cache_stats(),
+        'stock_sentiment': stock_sentiment_cache.get_stats(),
+        'history': sentiment_history.get_stats()
+    })
+
+@api_bp.route('/api/sentiment/<stock_ticker>', methods=['GET'])
+def get_stock_sentiment(stock_ticker):
+    """Latest-window mean and EWMA of a ticker's article scores, from memory."""
+    sentiment_history.ensure_loaded()
+    summary = sentiment_history.summary(stock_ticker.upper())
+    if summary is None:
+        return jsonify({'success': False, 'error': 'No scored news for this ticker'}), 404
+    return jsonify({'success': True, 'ticker': stock_ticker.upper(), 'sentiment': summary})
+
+@api_bp.route('/api/portfolio-sentiment/<int:user_id>', methods=['GET'])
+def get_portfolio_sentiment(user_id):
+    """Share-weighted window mean and EWMA for every portfolio of a user, from memory."""
+    from portfolio_utils import get_user_holdings
+    from portfolio_stats import Holdings
+    try:
+        sentiment_history.ensure_loaded()
+        portfolio_ids = get_all_portfolio_ids(user_id)
+        holdings = Holdings.from_rows(get_user_holdings(user_id), portfolio_ids)
+        summaries = {ticker: sentiment_history.summary(ticker) or {} for ticker in holdings.tickers}
+        window_means = holdings.weighted_average(holdings.vector({t: s.get('window_mean') for t, s in summaries.items()}))
+        ewmas = holdings.weighted_average(holdings.vector({t: s.get('ewma') for t, s in summaries.items()}))
+        return jsonify({'success': True, 'data': [
+            {
+                'portfolio_id': portfolio_id,
+                'window_mean': round(float(window_means[i]), 4),
+                'ewma': round(float(ewmas[i]), 4),
+                'stocks': [
+                    {'ticker': ticker, 'window_mean': summaries[ticker].get('window_mean'), 'ewma': summaries[ticker].get('ewma')}
+                    for ticker in holdings.tickers_of(portfolio_id)
+                ]
+            }
+            for i, portfolio_id in enumerate(portfolio_ids)
+        ]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@api_bp.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    from utils.http_client import get_rate_limit_stats, get_connection_stats
+    from utils.metric_store import metric_store
+    from QRE_new import screener_index
+    from precompute import scheduler
+    return jsonify({
+        'success': True,
+        'rate_limits': get_rate_limit_stats(),
+        'connections': get_connection_stats(),
+        'finnhub_metrics': metric_store.get_stats(),
+        'screener': screener_index.get_stats(),
+        'precompute': scheduler.get_stats()
+    })
+
+@api_bp.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: span timings, upstream, cache and pool counters."""
+    from utils.metrics import render_prometheus
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @api_bp.route('/api/clear-all-data/<int:user_id>', methods=['DELETE'])
 def clear_all_data(user_id):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT portfolio_id FROM portfolio WHERE user_id = %s", (user_id,))
-        portfolio_ids = [row[0] for row in cursor.fetchall()]
-        if portfolio_ids:
-            cursor.execute("""
-                SELECT stock_ticker FROM stock 
-                WHERE portfolio_id IN ({})
-            """.format(','.join(['%s'] * len(portfolio_ids))), portfolio_ids)
-            stock_tickers = [row[0] for row in cursor.fetchall()]
-            if stock_tickers:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT portfolio_id FROM portfolio WHERE user_id = %s", (user_id,))
+            portfolio_ids = [row[0] for row in cursor.fetchall()]
+            if portfolio_ids:
                 cursor.execute("""
-                    DELETE FROM news 
-                    WHERE stock_ticker IN ({})
-                """.format(','.join(['%s'] * len(stock_tickers))), stock_tickers)
-            cursor.execute("""
-                DELETE FROM stock 
-                WHERE portfolio_id IN ({})
-            """.format(','.join(['%s'] * len(portfolio_ids))), portfolio_ids)
-            cursor.execute("DELETE FROM portfolio WHERE user_id = %s", (user_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        processed_stocks.clear()
+                    SELECT stock_ticker FROM stock 
+                    WHERE portfolio_id IN ({})
+                """.format(','.join(['%s'] * len(portfolio_ids))), portfolio_ids)
+                stock_tickers = [row[0] for row in cursor.fetchall()]
+                if stock_tickers:
+                    cursor.execute("""
+                        DELETE FROM news 
+                        WHERE stock_ticker IN ({})
+                    """.format(','.join(['%s'] * len(stock_tickers))), stock_tickers)
+                    cursor.execute("""
+                        DELETE FROM news_checkpoint 
+                        WHERE stock_ticker IN ({})
+                    """.format(','.join(['%s'] * len(stock_tickers))), stock_tickers)
+                    delete_rollup(cursor, stock_tickers)
+                cursor.execute("""
+                    DELETE FROM stock 
+                    WHERE portfolio_id IN ({})
+                """.format(','.join(['%s'] * len(portfolio_ids))), portfolio_ids)
+                cursor.execute("DELETE FROM portfolio WHERE user_id = %s", (user_id,))
+            cursor.close()
+        bump_version(user_id)
+        if portfolio_ids:
+            stock_sentiment_cache.invalidate_many(stock_tickers)
+            sentiment_history.discard(stock_tickers)
         return jsonify({
             'success': True,
             'message': f'Successfully cleared all data for user {user_id}'
@@ -221,6 +272,37 @@ def clear_all_data(user_id):
             'error': str(e)
         }), 500 
 
+def _trend_days():
+    return request.args.get('days', 90, type=int)
+
+@api_bp.route('/api/trends/<stock_ticker>', methods=['GET'])
+def get_stock_trend(stock_ticker):
+    """Daily sentiment (count, avg, min, max) of one ticker from the rollup table."""
+    try:
+        ticker = stock_ticker.upper()
+        return jsonify({'success': True, 'ticker': ticker, 'trend': get_ticker_trends([ticker], _trend_days())[ticker]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@api_bp.route('/api/trends', methods=['GET'])
+def get_stock_trends():
+    """Daily sentiment for many tickers in one read: /api/trends?tickers=AAPL,MSFT&days=90."""
+    tickers = [ticker.strip().upper() for ticker in request.args.get('tickers', '').split(',') if ticker.strip()]
+    if not tickers:
+        return jsonify({'success': False, 'error': 'tickers is required'}), 400
+    try:
+        return jsonify({'success': True, 'trends': get_ticker_trends(tickers, _trend_days())})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@api_bp.route('/api/portfolio-trends/<int:user_id>', methods=['GET'])
+def get_portfolio_trend(user_id):
+    """Share-weighted daily sentiment for every portfolio of a user, from the rollup table."""
+    try:
+        return jsonify({'success': True, 'data': get_portfolio_trends(user_id, _trend_days())})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @api_bp.route('/api/news/<stock_ticker>', methods=['GET', 'OPTIONS'])
 def get_news_for_stock(stock_ticker):
     """Fetch news articles for a given stock ticker from the news table."""
@@ -232,18 +314,17 @@ def get_news_for_stock(stock_ticker):
         resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         return resp
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT title, url, sent_score, date_time
-            FROM news
-            WHERE stock_ticker = %s
-            ORDER BY date_time DESC, news_id DESC
-            LIMIT 20
-        """, (stock_ticker,))
-        articles = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT title, url, sent_score, date_time
+                FROM news
+                WHERE stock_ticker = %s
+                ORDER BY date_time DESC, news_id DESC
+                LIMIT 20
+            """, (stock_ticker,))
+            articles = cursor.fetchall()
+            cursor.close()
         resp = make_response(jsonify({
             'success': True,
             'articles': articles
@@ -1,51 +1,217 @@
-from db import get_connection
+import os
+import time
+import atexit
+import weakref
+import threading
+from db import db_connection, insert_ignore_sql, upsert_sql
+from utils.log import get_logger
+from utils.metrics import span
+from sentiment_rollup import add_to_rollup, recount_days, news_day
+
+logger = get_logger("db")
+
+NEWS_COLUMNS = ('stock_ticker', 'title', 'description', 'url', 'sent_score', 'date_time')
 
 def delete_sentiment_scores_only(portfolio_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("UPDATE stock SET avg_stock_sent_score = NULL WHERE portfolio_id = %s", (portfolio_id,))
-    cursor.execute("UPDATE portfolio SET avg_port_sent_score = NULL WHERE portfolio_id = %s", (portfolio_id,))
+        cursor.execute("UPDATE stock SET avg_stock_sent_score = NULL WHERE portfolio_id = %s", (portfolio_id,))
+        cursor.execute("UPDATE portfolio SET avg_port_sent_score = NULL WHERE portfolio_id = %s", (portfolio_id,))
     
-    conn.commit()
-    cursor.close()
-    conn.close()
+        cursor.close()
+
+def _unsaved_articles(cursor, articles):
+    """The articles whose (stock_ticker, url) is not stored yet, first of each key only, like INSERT IGNORE keeps."""
+    seen = set()
+    unique = []
+    for article in articles:
+        key = (article[0], article[3])
+        # NULL urls never clash with the unique key
+        if key[1] is None or key not in seen:
+            seen.add(key)
+            unique.append(article)
+    keyed = [article for article in unique if article[3] is not None]
+    stored = set()
+    for start in range(0, len(keyed), 400):
+        chunk = keyed[start:start + 400]
+        tickers = list({article[0] for article in chunk})
+        urls = list({article[3] for article in chunk})
+        cursor.execute(f"""
+            SELECT stock_ticker, url FROM news
+            WHERE stock_ticker IN ({','.join(['%s'] * len(tickers))}) AND url IN ({','.join(['%s'] * len(urls))})
+        """, tickers + urls)
+        stored.update(cursor.fetchall())
+    return [article for article in unique if (article[0], article[3]) not in stored]
+
+def save_articles(cursor, articles):
+    """Insert news rows and fold the ones actually inserted into the daily rollup, in the caller's transaction."""
+    candidates = _unsaved_articles(cursor, articles)
+    if not candidates:
+        return 0
+    cursor.executemany(insert_ignore_sql('news', NEWS_COLUMNS), candidates)
+    inserted = cursor.rowcount
+    if inserted == len(candidates):
+        add_to_rollup(cursor, candidates)
+    else:
+        # A concurrent writer stored some of these first; count the touched days from news instead
+        recount_days(cursor, {
+            (article[0], news_day(article[5])) for article in candidates if news_day(article[5])
+        })
+    return inserted
 
 def save_article_to_db(stock_ticker, title, description, url, score, published_at):
-    conn = get_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    query = """
-        INSERT IGNORE INTO news (stock_ticker, title, description, url, sent_score, date_time)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """
-    cursor.execute(query, (stock_ticker, title, description, url, score, published_at))
-    conn.commit()
-    cursor.close()
-    conn.close()
+        save_articles(cursor, [(stock_ticker, title, description, url, score, published_at)])
+        cursor.close()
 
 def save_average_sentiment(portfolio_id, stock_ticker, avg_score):
-    conn = get_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        UPDATE stock SET avg_stock_sent_score = %s 
-        WHERE portfolio_id = %s AND stock_ticker = %s
-    """, (avg_score, portfolio_id, stock_ticker))
+        cursor.execute("""
+            UPDATE stock SET avg_stock_sent_score = %s 
+            WHERE portfolio_id = %s AND stock_ticker = %s
+        """, (avg_score, portfolio_id, stock_ticker))
     
-    conn.commit()
-    cursor.close()
-    conn.close()
+        cursor.close()
 
 def save_final_portfolio_sentiment(portfolio_id, final_score):
-    conn = get_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE portfolio SET avg_port_sent_score = %s 
+            WHERE portfolio_id = %s
+        """, (final_score, portfolio_id))
+
+        cursor.close()
+
+WRITE_BUFFER_MAX_ROWS = int(os.getenv("WRITE_BUFFER_MAX_ROWS", "500"))
+WRITE_BUFFER_MAX_AGE = float(os.getenv("WRITE_BUFFER_MAX_AGE", "5"))
+
+_open_writers = weakref.WeakSet()
+
+class SentimentWriter:
+    """Write-behind buffer for one analyze run.
+
+    Collects sentiment resets, articles, per-stock and per-portfolio scores
+    and news checkpoints and writes them with executemany in a single transaction, either when
+    flush() is called or when flush_if_due() finds max_rows/max_age exceeded.
+    Adding never flushes by itself, so callers decide where a transaction may
+    end (between portfolios, never halfway through one). Used as a
+    context manager it always flushes on exit, including when the run fails,
+    and any writer still open at interpreter shutdown is flushed by atexit.
+    """
+
+    def __init__(self, max_rows=WRITE_BUFFER_MAX_ROWS, max_age=WRITE_BUFFER_MAX_AGE):
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._clear()
+        _open_writers.add(self)
+
+    def _clear(self):
+        self._resets = []
+        self._articles = []
+        self._stock_scores = []
+        self._portfolio_scores = []
+        self._checkpoints = []
+        self._oldest = None
+
+    def _pending(self):
+        return len(self._resets) + len(self._articles) + len(self._stock_scores) + len(self._portfolio_scores) + len(self._checkpoints)
+
+    def _add(self, buffer, row):
+        with self._lock:
+            buffer.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._oldest is not None and (
+                self._pending() >= self.max_rows or time.monotonic() - self._oldest >= self.max_age
+            )
+        if due:
+            self.flush()
+
+    def reset_portfolio(self, portfolio_id):
+        self._add(self._resets, (portfolio_id,))
+
+    def add_article(self, stock_ticker, title, description, url, score, published_at):
+        self._add(self._articles, (stock_ticker, title, description, url, score, published_at))
+
+    def add_stock_score(self, portfolio_id, stock_ticker, avg_score):
+        self._add(self._stock_scores, (avg_score, portfolio_id, stock_ticker))
+
+    def add_portfolio_score(self, portfolio_id, final_score):
+        self._add(self._portfolio_scores, (final_score, portfolio_id))
+
+    def add_news_checkpoint(self, stock_ticker, checked_at):
+        self._add(self._checkpoints, (stock_ticker, checked_at))
+
+    def flush(self):
+        # _flush_lock keeps batches in order when flush_if_due() races an explicit flush()
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending():
+                    return
+                resets, articles = self._resets, self._articles
+                stock_scores, portfolio_scores = self._stock_scores, self._portfolio_scores
+                checkpoints = self._checkpoints
+                self._clear()
+            with span('db_write', articles=len(articles)), db_connection() as conn:
+                cursor = conn.cursor()
+                if resets:
+                    cursor.executemany("UPDATE stock SET avg_stock_sent_score = NULL WHERE portfolio_id = %s", resets)
+                    cursor.executemany("UPDATE portfolio SET avg_port_sent_score = NULL WHERE portfolio_id = %s", resets)
+                if articles:
+                    save_articles(cursor, articles)
+                if stock_scores:
+                    cursor.executemany("""
+                        UPDATE stock SET avg_stock_sent_score = %s
+                        WHERE portfolio_id = %s AND stock_ticker = %s
+                    """, stock_scores)
+                if portfolio_scores:
+                    cursor.executemany("""
+                        UPDATE portfolio SET avg_port_sent_score = %s
+                        WHERE portfolio_id = %s
+                    """, portfolio_scores)
+                if checkpoints:
+                    # Written with the articles so a checkpoint never gets ahead of the news it covers
+                    cursor.executemany(upsert_sql(
+                        'news_checkpoint', ('stock_ticker', 'last_checked_at'), ('stock_ticker',), ('last_checked_at',)
+                    ), checkpoints)
+                cursor.close()
+            logger.debug(f"💾 Flushed {len(articles)} articles, {len(stock_scores)} stock scores, {len(portfolio_scores)} portfolio scores")
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            _open_writers.discard(self)
+
+    def __enter__(self):
+        return self
 
-    cursor.execute("""
-        UPDATE portfolio SET avg_port_sent_score = %s 
-        WHERE portfolio_id = %s
-    """, (final_score, portfolio_id))
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            # Don't hide the error that ended the run
+            logger.exception(f"❌ Error flushing sentiment writes: {e}")
+        return False
 
-    conn.commit()
-    cursor.close()
-    conn.close()
\ No newline at end of file
+@atexit.register
+def _flush_open_writers():
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception as e:
+            logger.exception(f"❌ Error flushing sentiment writes at shutdown: {e}")
@@ -1,5 +1,7 @@
 -- Stock Portfolio Analyzer Database Schema
 -- Run this file in MySQL to set up the database
+-- Snapshot of the latest schema; existing databases are upgraded with
+-- `python migrations.py`, which also records the version in schema_migrations
 
 -- Create database if it doesn't exist
 CREATE DATABASE IF NOT EXISTS stock_trading_app;
@@ -34,6 +36,8 @@ CREATE TABLE IF NOT EXISTS stock (
     stock_ticker VARCHAR(10) NOT NULL,
     stock_name VARCHAR(100) NOT NULL,
     avg_stock_sent_score DECIMAL(5,4),
+    num_shares INT NOT NULL DEFAULT 0,
+    beta DECIMAL(5,2),
     market_cap BIGINT,
     FOREIGN KEY (portfolio_id) REFERENCES portfolio(portfolio_id) ON DELETE CASCADE
 );
@@ -65,13 +69,61 @@ CREATE TABLE IF NOT EXISTS recommendation (
     UNIQUE KEY unique_portfolio_stock (portfolio_id, stock_ticker)
 );
 
+-- Sentiment scores keyed by sha256 of the normalized article text
+CREATE TABLE IF NOT EXISTS sentiment_cache (
+    text_hash CHAR(64) PRIMARY KEY,
+    sent_score DECIMAL(5,4) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Local screener snapshot of the US universe used by the recommendation engine
+CREATE TABLE IF NOT EXISTS screener_universe (
+    symbol VARCHAR(10) PRIMARY KEY,
+    beta DECIMAL(10,4),
+    market_cap BIGINT,
+    eps DECIMAL(12,4),
+    pe_ratio DECIMAL(12,4),
+    updated_at DATETIME
+);
+
+-- Last time each ticker was checked against NewsAPI; the high-water mark is MAX(news.date_time)
+CREATE TABLE IF NOT EXISTS news_checkpoint (
+    stock_ticker VARCHAR(10) PRIMARY KEY,
+    last_checked_at DATETIME NOT NULL
+);
+
+-- Per-ticker, per-day sentiment of stored articles (kept in step with news by save_utils)
+CREATE TABLE IF NOT EXISTS sentiment_daily (
+    stock_ticker VARCHAR(10) NOT NULL,
+    news_date DATE NOT NULL,
+    article_count INT NOT NULL,
+    score_sum DECIMAL(14,4) NOT NULL,
+    score_min DECIMAL(5,4) NOT NULL,
+    score_max DECIMAL(5,4) NOT NULL,
+    PRIMARY KEY (stock_ticker, news_date)
+);
 
 -- Create indexes for better performance
 CREATE INDEX idx_portfolio_user_id ON portfolio(user_id);
 CREATE INDEX idx_stock_portfolio_id ON stock(portfolio_id);
-CREATE INDEX idx_news_stock_ticker ON news(stock_ticker);
+CREATE INDEX idx_stock_portfolio_ticker ON stock(portfolio_id, stock_ticker);
+CREATE INDEX idx_stock_ticker ON stock(stock_ticker);
+CREATE INDEX idx_news_ticker_time ON news(stock_ticker, date_time, news_id);
 CREATE INDEX idx_news_created_at ON news(created_at);
 
+-- Applied migrations (see migrations.py); this file matches version 5
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    description VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT IGNORE INTO schema_migrations (version, description) VALUES
+    (1, 'baseline tables'),
+    (2, 'stock.num_shares and stock.beta'),
+    (3, 'sentiment cache, screener snapshot and news checkpoints'),
+    (4, 'indexes for hot queries'),
+    (5, 'daily sentiment rollup');
+
 -- Show tables
 SHOW TABLES;
 
@@ -0,0 +1,140 @@
+"""Daily per-ticker sentiment rollup (sentiment_daily) and the trend reads served from it.
+
+Every scored article that lands in `news` adds to its ticker's row for the
+article's (UTC) publication day: count, sum, min and max of sent_score.
+Trends are then one indexed range read of at most `days` rows per ticker,
+however many articles there are.
+"""
+from datetime import datetime, timedelta
+from db import db_connection, accumulate_sql, upsert_sql
+from portfolio_utils import get_all_portfolio_ids, get_user_holdings
+from portfolio_stats import Holdings
+
+ROLLUP_COLUMNS = ('stock_ticker', 'news_date', 'article_count', 'score_sum', 'score_min', 'score_max')
+ROLLUP_MERGES = {'article_count': 'sum', 'score_sum': 'sum', 'score_min': 'min', 'score_max': 'max'}
+TREND_MAX_DAYS = 3650
+
+def _in_clause(values):
+    return ','.join(['%s'] * len(values))
+
+def news_day(published_at):
+    """'YYYY-MM-DD' of a news.date_time value, or None when unknown."""
+    if published_at is None:
+        return None
+    if isinstance(published_at, datetime):
+        return published_at.date().isoformat()
+    return str(published_at)[:10] or None
+
+def daily_rollup(articles):
+    """Rollup rows for news rows (stock_ticker, title, description, url, sent_score, date_time).
+
+    Articles without a score or publication time have no day to count towards.
+    """
+    days = {}
+    for stock_ticker, _, _, _, score, published_at in articles:
+        day = news_day(published_at)
+        if score is None or day is None:
+            continue
+        score = float(score)
+        entry = days.get((stock_ticker, day))
+        if entry is None:
+            days[(stock_ticker, day)] = [1, score, score, score]
+        else:
+            entry[0] += 1
+            entry[1] += score
+            entry[2] = min(entry[2], score)
+            entry[3] = max(entry[3], score)
+    return [(stock_ticker, day, count, total, low, high) for (stock_ticker, day), (count, total, low, high) in days.items()]
+
+def add_to_rollup(cursor, articles):
+    """Fold newly inserted articles into sentiment_daily (caller's transaction)."""
+    rows = daily_rollup(articles)
+    if rows:
+        cursor.executemany(accumulate_sql('sentiment_daily', ROLLUP_COLUMNS, ('stock_ticker', 'news_date'), ROLLUP_MERGES), rows)
+
+def recount_days(cursor, keys):
+    """Recompute the rollup rows for (stock_ticker, day) keys from news itself.
+
+    Used when it is unclear which articles a write actually inserted. Each
+    key is a range read of one ticker-day on idx_news_ticker_time.
+    """
+    rows = []
+    for stock_ticker, day in keys:
+        start = datetime.strptime(day, '%Y-%m-%d')
+        cursor.execute("""
+            SELECT COUNT(*), SUM(sent_score), MIN(sent_score), MAX(sent_score) FROM news
+            WHERE stock_ticker = %s AND date_time >= %s AND date_time < %s AND sent_score IS NOT NULL
+        """, (stock_ticker, start, start + timedelta(days=1)))
+        count, total, low, high = cursor.fetchone()
+        if count:
+            rows.append((stock_ticker, day, count, float(total), float(low), float(high)))
+    if rows:
+        cursor.executemany(upsert_sql('sentiment_daily', ROLLUP_COLUMNS, ('stock_ticker', 'news_date'), ROLLUP_COLUMNS[2:]), rows)
+
+def delete_rollup(cursor, tickers):
+    if tickers:
+        cursor.execute(f"DELETE FROM sentiment_daily WHERE stock_ticker IN ({_in_clause(tickers)})", list(tickers))
+
+def _start_day(days):
+    days = max(1, min(int(days), TREND_MAX_DAYS))
+    return (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+
+def get_ticker_trends(tickers, days=90):
+    """{ticker: [{'day', 'count', 'avg', 'min', 'max'}, ...]} for the last `days` UTC days, oldest first.
+
+    Days without articles are left out.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT stock_ticker, news_date, article_count, score_sum, score_min, score_max
+            FROM sentiment_daily
+            WHERE stock_ticker IN ({_in_clause(tickers)}) AND news_date >= %s
+            ORDER BY stock_ticker, news_date
+        """, tickers + [_start_day(days)])
+        trends = {ticker: [] for ticker in tickers}
+        for stock_ticker, day, count, total, low, high in cursor.fetchall():
+            trends[stock_ticker].append({
+                'day': str(day)[:10],
+                'count': count,
+                'avg': round(float(total) / count, 4),
+                'min': float(low),
+                'max': float(high),
+            })
+        cursor.close()
+    return trends
+
+def get_portfolio_trends(user_id, days=90):
+    """Per-portfolio daily trend: share-weighted mean of the holdings' daily averages.
+
+    Only holdings with articles on a day weigh in that day; count, min and
+    max cover all of the portfolio's articles that day.
+    """
+    portfolio_ids = get_all_portfolio_ids(user_id)
+    holdings = Holdings.from_rows(get_user_holdings(user_id), portfolio_ids)
+    ticker_trends = get_ticker_trends(holdings.tickers, days)
+    by_day = {ticker: {point['day']: point for point in points} for ticker, points in ticker_trends.items()}
+    result = []
+    for portfolio_id in portfolio_ids:
+        shares = holdings.shares_of(portfolio_id)
+        days_seen = sorted({day for ticker in shares for day in by_day.get(ticker, {})})
+        points = []
+        for day in days_seen:
+            held = [(by_day[ticker][day], weight) for ticker, weight in shares.items() if day in by_day.get(ticker, {})]
+            total_weight = sum(weight for _, weight in held)
+            if total_weight:
+                avg = sum(point['avg'] * weight for point, weight in held) / total_weight
+            else:
+                avg = sum(point['avg'] for point, _ in held) / len(held)
+            points.append({
+                'day': day,
+                'count': sum(point['count'] for point, _ in held),
+                'avg': round(avg, 4),
+                'min': min(point['min'] for point, _ in held),
+                'max': max(point['max'] for point, _ in held),
+            })
+        result.append({'portfolio_id': portfolio_id, 'trend': points})
+    return result
@@ -1,5 +1,5 @@
-import requests
-from db import get_connection
+from utils import http_client
+from db import db_connection
 from config import FINNHUB_API_KEY, FINNHUB_BASE_URL
 
 API_KEY = FINNHUB_API_KEY
@@ -9,7 +9,7 @@ def get_company_name(symbol):
     url = f"{BASE_URL}/stock/profile2"
     params = {'symbol': symbol, 'token': API_KEY}
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_client.get(url, params=params, provider='finnhub')
         if response.status_code == 200:
             return response.json().get('name')
     except Exception as e:
@@ -17,22 +17,20 @@ def get_company_name(symbol):
     return None
 
 def update_missing_stock_names():
-    conn = get_connection()
-    cur = conn.cursor()
-    # Find all stocks with missing or empty stock_name
-    cur.execute("SELECT portfolio_id, stock_ticker FROM stock WHERE stock_name IS NULL OR stock_name = ''")
-    rows = cur.fetchall()
-    print(f"Found {len(rows)} stocks with missing names.")
-    for portfolio_id, ticker in rows:
-        name = get_company_name(ticker)
-        if name:
-            cur.execute("UPDATE stock SET stock_name=%s WHERE portfolio_id=%s AND stock_ticker=%s", (name, portfolio_id, ticker))
-            print(f"Updated {ticker} in portfolio {portfolio_id} to '{name}'")
-        else:
-            print(f"Could not find name for {ticker} (portfolio {portfolio_id})")
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # Find all stocks with missing or empty stock_name
+        cur.execute("SELECT portfolio_id, stock_ticker FROM stock WHERE stock_name IS NULL OR stock_name = ''")
+        rows = cur.fetchall()
+        print(f"Found {len(rows)} stocks with missing names.")
+        for portfolio_id, ticker in rows:
+            name = get_company_name(ticker)
+            if name:
+                cur.execute("UPDATE stock SET stock_name=%s WHERE portfolio_id=%s AND stock_ticker=%s", (name, portfolio_id, ticker))
+                print(f"Updated {ticker} in portfolio {portfolio_id} to '{name}'")
+            else:
+                print(f"Could not find name for {ticker} (portfolio {portfolio_id})")
+        cur.close()
     print("Done updating stock names.")
 
 if __name__ == "__main__":
@@ -1,8 +1 @@
-def get_connection():
-    import mysql.connector
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="tanay282004",
-        database="stock_trading_app"
-    ) 
\ No newline at end of file
+from db import get_connection, db_connection
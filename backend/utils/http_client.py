@@ -0,0 +1,286 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from utils.log import get_logger
+from utils.metrics import observe, register_collector
+
+logger = get_logger("http")
+
+# Requests per minute and burst size per upstream provider. Defaults follow
+# the free tiers; raise them through the environment on paid plans.
+RATE_LIMITS = {
+    'finnhub': (float(os.getenv("RATE_LIMIT_FINNHUB", "60")), int(os.getenv("RATE_BURST_FINNHUB", "10"))),
+    'fmp': (float(os.getenv("RATE_LIMIT_FMP", "300")), int(os.getenv("RATE_BURST_FMP", "10"))),
+    'newsapi': (float(os.getenv("RATE_LIMIT_NEWSAPI", "60")), int(os.getenv("RATE_BURST_NEWSAPI", "5"))),
+    'hf': (float(os.getenv("RATE_LIMIT_HF", "300")), int(os.getenv("RATE_BURST_HF", "10"))),
+}
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+
+PROVIDER_HOSTS = {
+    'finnhub.io': 'finnhub',
+    'financialmodelingprep.com': 'fmp',
+    'newsapi.org': 'newsapi',
+    'huggingface.co': 'hf',
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def _parse_overrides(raw):
+    overrides = {}
+    for item in raw.split(','):
+        if '=' in item:
+            provider, base_url = item.split('=', 1)
+            overrides[provider.strip()] = base_url.strip().rstrip('/')
+    return overrides
+
+# Send a provider's requests to another host, keeping path and query, e.g. the
+# local stand-ins used by the benchmarks:
+# HTTP_UPSTREAM_OVERRIDES="finnhub=http://127.0.0.1:9101,newsapi=http://127.0.0.1:9102"
+UPSTREAM_OVERRIDES = _parse_overrides(os.getenv("HTTP_UPSTREAM_OVERRIDES", ""))
+
+# Keep-alive connections kept per upstream host. Size each pool to the
+# number of threads that may call that host at once.
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+POOL_HOSTS = {
+    'finnhub': 'https://finnhub.io',
+    'fmp': 'https://financialmodelingprep.com',
+    'newsapi': 'https://newsapi.org',
+}
+
+def _build_session():
+    session = requests.Session()
+    default_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount('https://', default_adapter)
+    session.mount('http://', default_adapter)
+    for provider, prefix in POOL_HOSTS.items():
+        maxsize = int(os.getenv(f"HTTP_POOL_MAXSIZE_{provider.upper()}", str(HTTP_POOL_MAXSIZE)))
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=maxsize))
+    return session
+
+# One session for the whole process so TCP/TLS connections are reused across calls
+session = _build_session()
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is free."""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate if self.rate else 1.0)
+                self.waited += wait
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Take a token if one is free right now; never waits."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def available(self):
+        """Tokens free right now (0 while paused)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._tokens if now >= self._paused_until else 0.0
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after the provider answered 429 with Retry-After."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+_buckets = {provider: TokenBucket(*limits) for provider, limits in RATE_LIMITS.items()}
+_stats_lock = threading.Lock()
+_stats = {provider: {'requests': 0, 'retries': 0, 'errors': 0} for provider in RATE_LIMITS}
+
+def provider_for_url(url):
+    host = urlparse(url).hostname or ''
+    for suffix, provider in PROVIDER_HOSTS.items():
+        if host == suffix or host.endswith('.' + suffix):
+            return provider
+    return None
+
+def _count(provider, key):
+    if provider is None:
+        return
+    with _stats_lock:
+        _stats[provider][key] += 1
+
+def _backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(HTTP_BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+def upstream_url(url, provider=None):
+    """url, rewritten to the provider's override host when one is configured."""
+    base_url = UPSTREAM_OVERRIDES.get(provider or provider_for_url(url))
+    if not base_url:
+        return url
+    parts = urlsplit(url)
+    return base_url + parts.path + (f"?{parts.query}" if parts.query else '')
+
+def acquire(provider):
+    if provider in _buckets:
+        _buckets[provider].acquire()
+
+def headroom(provider):
+    """Tokens the provider's rate limit has free right now; background work checks this to stay out of the way."""
+    bucket = _buckets.get(provider)
+    return bucket.available() if bucket is not None else float('inf')
+
+def _retry_response(error):
+    """The HTTP response behind an error worth retrying, None for a transport error, False for anything else.
+
+    Only transport failures and HTTP errors with status 429 or 5xx are
+    retried (requests.HTTPError, which huggingface_hub's HfHubHTTPError
+    extends); bad input, auth failures and bugs are raised at once.
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return None
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is not None and (status == 429 or status >= 500):
+        return response
+    return False
+
+def call_with_retries(provider, fn, max_retries=HTTP_MAX_RETRIES):
+    """Run fn() under the provider's rate limit, retrying transport errors and 429/5xx with jittered backoff.
+
+    A 429's Retry-After is honoured and pauses the provider's bucket, as in get().
+    """
+    for attempt in range(max_retries + 1):
+        acquire(provider)
+        _count(provider, 'requests')
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            _observe_attempt(provider, started)
+            response = _retry_response(e)
+            if response is False or attempt == max_retries:
+                _count(provider, 'errors')
+                raise
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            delay = _backoff_delay(attempt, retry_after)
+            if response is not None and response.status_code == 429 and provider in _buckets:
+                _buckets[provider].pause(delay)
+            _count(provider, 'retries')
+            logger.warning(f"⚠️ {provider} call failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        _observe_attempt(provider, started)
+        return result
+
+def _observe_attempt(provider, started):
+    observe('stockai_upstream_request_seconds', time.perf_counter() - started,
+            help='Upstream request latency per attempt, after rate limiting', provider=provider or 'other')
+
+def get(url, params=None, provider=None, timeout=10, max_retries=HTTP_MAX_RETRIES, **kwargs):
+    """GET through the shared keep-alive session, rate-limited per provider and retried on 429/5xx.
+
+    The provider is inferred from the URL host when not given. After the last
+    retry the final response is returned as-is so callers keep their own
+    status-code handling.
+    """
+    provider = provider or provider_for_url(url)
+    url = upstream_url(url, provider)
+    for attempt in range(max_retries + 1):
+        acquire(provider)
+        _count(provider, 'requests')
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            _observe_attempt(provider, started)
+            if attempt == max_retries:
+                _count(provider, 'errors')
+                raise
+            delay = _backoff_delay(attempt)
+            _count(provider, 'retries')
+            logger.warning(f"⚠️ {provider or url} request failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        _observe_attempt(provider, started)
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+            if response.status_code >= 400:
+                _count(provider, 'errors')
+            return response
+        delay = _backoff_delay(attempt, response.headers.get('Retry-After'))
+        if response.status_code == 429 and provider in _buckets:
+            _buckets[provider].pause(delay)
+        _count(provider, 'retries')
+        logger.warning(f"⚠️ {provider or url} returned {response.status_code}, retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+def get_rate_limit_stats():
+    with _stats_lock:
+        stats = {provider: dict(values) for provider, values in _stats.items()}
+    for provider, bucket in _buckets.items():
+        stats[provider]['throttled_seconds'] = round(bucket.waited, 3)
+    return stats
+
+def _collect_rate_limit_stats():
+    for provider, values in get_rate_limit_stats().items():
+        labels = {'provider': provider}
+        yield 'stockai_upstream_requests_total', 'counter', 'Upstream request attempts', labels, values['requests']
+        yield 'stockai_upstream_retries_total', 'counter', 'Upstream attempts that were retried', labels, values['retries']
+        yield 'stockai_upstream_errors_total', 'counter', 'Upstream calls that ended in an error', labels, values['errors']
+        yield ('stockai_upstream_throttled_seconds_total', 'counter', 'Time spent waiting for a rate-limit token',
+               labels, values['throttled_seconds'])
+
+register_collector(_collect_rate_limit_stats)
+
+def get_connection_stats():
+    """Per-host request and connection counts; reuse_ratio is the share of requests that skipped a handshake."""
+    stats = {}
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_scheme}://{key.key_host}"
+            requests_made = pool.num_requests
+            opened = pool.num_connections
+            stats[host] = {
+                'requests': requests_made,
+                'connections_opened': opened,
+                'reuse_ratio': round(1 - opened / requests_made, 4) if requests_made else 0.0,
+                'pool_maxsize': adapter._pool_maxsize,
+            }
+    return stats
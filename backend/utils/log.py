@@ -0,0 +1,17 @@
+import os
+import logging
+
+# DEBUG brings back the per-article and per-symbol detail, INFO (default)
+# keeps one line per step, WARNING only shows problems.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+_root = logging.getLogger("stockai")
+if not _root.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _root.addHandler(_handler)
+    _root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    _root.propagate = False
+
+def get_logger(name):
+    return _root.getChild(name)
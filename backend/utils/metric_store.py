@@ -0,0 +1,122 @@
+import os
+import threading
+from utils import http_client
+from config import FINNHUB_API_KEY, FINNHUB_BASE_URL
+from utils.ttl_cache import TTLCache
+from utils.metrics import register_stats
+from utils.log import get_logger
+
+logger = get_logger("qre")
+
+METRIC_TTL = float(os.getenv("METRIC_TTL", "3600"))
+METRIC_CACHE_SIZE = int(os.getenv("METRIC_CACHE_SIZE", "10000"))
+
+# Fields read from a metric blob; each takes None when Finnhub could not be reached
+def beta_of(metrics):
+    return metrics.get('beta') if metrics is not None else None
+
+def market_cap_of(metrics):
+    """Market cap in absolute USD (Finnhub reports millions)."""
+    market_cap_million = metrics.get('marketCapitalization') if metrics is not None else None
+    if market_cap_million is None:
+        return None
+    return market_cap_million * 1_000_000
+
+def eps_of(metrics):
+    if metrics is None:
+        return None
+    return metrics.get('epsInclExtraItemsTTM') or metrics.get('epsTTM')
+
+def pe_of(metrics):
+    if metrics is None:
+        return None
+    return metrics.get('peTTM') or metrics.get('peNormalizedAnnual')
+
+class MetricStore:
+    """Finnhub /stock/metric?metric=all blobs, fetched once per symbol and memoized with a TTL.
+
+    Beta, market cap, EPS and P/E are all read from the same cached blob, so
+    a QRE run makes at most one metric call per symbol.
+    """
+
+    def __init__(self, ttl=METRIC_TTL, maxsize=METRIC_CACHE_SIZE):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._fetches_lock = threading.Lock()
+        self.fetches = 0
+
+    def _symbol_lock(self, symbol):
+        with self._locks_lock:
+            if symbol not in self._locks:
+                self._locks[symbol] = threading.Lock()
+            return self._locks[symbol]
+
+    def _fetch(self, symbol):
+        url = f"{FINNHUB_BASE_URL}/stock/metric"
+        params = {'symbol': symbol, 'metric': 'all', 'token': FINNHUB_API_KEY}
+        with self._fetches_lock:
+            self.fetches += 1
+        try:
+            response = http_client.get(url, params=params, provider='finnhub')
+        except Exception as e:
+            logger.warning(f"[QRE] metrics: Exception for {symbol}: {e}")
+            return None
+        if response.status_code != 200:
+            logger.warning(f"[QRE] metrics: Bad status {response.status_code} for {symbol}")
+            return None
+        return response.json().get('metric', {})
+
+    def get_metrics(self, symbol):
+        """Return the metric dict for symbol, or None if Finnhub could not be reached."""
+        metrics = self._cache.get(symbol)
+        if metrics is not None:
+            return metrics
+        # Concurrent callers for the same symbol wait for one fetch instead of each making their own
+        with self._symbol_lock(symbol):
+            metrics = self._cache.get(symbol)
+            if metrics is None:
+                metrics = self._fetch(symbol)
+                if metrics is not None:
+                    self._cache.set(symbol, metrics)
+        return metrics
+
+    def refresh(self, symbol):
+        """Fetch symbol again and replace the cached blob; the old one is served until then."""
+        with self._symbol_lock(symbol):
+            metrics = self._fetch(symbol)
+            if metrics is not None:
+                self._cache.set(symbol, metrics)
+        return metrics
+
+    def fetch(self, symbol):
+        """Fetch symbol without reading or filling the cache, for bulk readers like the screener."""
+        return self._fetch(symbol)
+
+    def get_beta(self, symbol):
+        return beta_of(self.get_metrics(symbol))
+
+    def get_market_cap(self, symbol):
+        return market_cap_of(self.get_metrics(symbol))
+
+    def get_eps(self, symbol):
+        return eps_of(self.get_metrics(symbol))
+
+    def get_pe(self, symbol):
+        return pe_of(self.get_metrics(symbol))
+
+    def invalidate(self, symbol):
+        self._cache.invalidate(symbol)
+
+    def clear(self):
+        self._cache.clear()
+
+    def get_stats(self):
+        stats = self._cache.get_stats()
+        with self._fetches_lock:
+            stats['fetches'] = self.fetches
+        return stats
+
+metric_store = MetricStore()
+register_stats('stockai_metric_store', metric_store.get_stats, counters=('hits', 'misses', 'expired', 'evicted', 'fetches'),
+               gauges=('size',), help='Finnhub metric cache')
@@ -0,0 +1,143 @@
+import time
+import threading
+from contextlib import contextmanager
+from utils.log import get_logger
+
+logger = get_logger("trace")
+
+# Histogram buckets in seconds, from a cache lookup up to a full analyze run
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_lock = threading.Lock()
+_help = {}
+_types = {}
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+_collectors = []
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _declare(name, kind, help_text):
+    # Caller holds _lock
+    _types.setdefault(name, kind)
+    if help_text:
+        _help.setdefault(name, help_text)
+
+def inc(name, value=1, help=None, **labels):
+    """Add to a counter; name should end in _total."""
+    with _lock:
+        _declare(name, 'counter', help)
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, help=None, **labels):
+    """Record one observation (seconds) in a histogram."""
+    with _lock:
+        _declare(name, 'histogram', help)
+        key = _key(name, labels)
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * len(DURATION_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+@contextmanager
+def span(name, **fields):
+    """Time a phase of work into stockai_span_seconds{span=name}.
+
+    Failures are counted in stockai_span_errors_total. `fields` only go to
+    the DEBUG trace line, so they can carry high-cardinality detail.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc('stockai_span_errors_total', help='Spans that ended with an exception', span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('stockai_span_seconds', elapsed, help='Time spent per instrumented phase', span=name)
+        if fields:
+            detail = ' '.join(f"{key}={value}" for key, value in fields.items())
+            logger.debug(f"⏱️ span={name} seconds={elapsed:.4f} {detail}")
+        else:
+            logger.debug(f"⏱️ span={name} seconds={elapsed:.4f}")
+
+def register_collector(collect):
+    """collect() returns (name, type, help, labels, value) tuples read at scrape time.
+
+    Used for numbers other modules already keep, such as cache and pool stats.
+    """
+    with _lock:
+        _collectors.append(collect)
+
+def register_stats(prefix, get_stats, counters=(), gauges=(), help=''):
+    """Export keys of an existing get_stats() dict: counters as {prefix}_{key}_total, gauges as {prefix}_{key}."""
+    def collect():
+        stats = get_stats()
+        for key in counters:
+            yield f"{prefix}_{key}_total", 'counter', f"{help} {key}".strip(), {}, stats.get(key)
+        for key in gauges:
+            yield f"{prefix}_{key}", 'gauge', f"{help} {key}".strip(), {}, stats.get(key)
+    register_collector(collect)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels, extra=None):
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def get_span_summary():
+    """{span: {'count', 'seconds'}} for JSON consumers such as job results."""
+    with _lock:
+        return {
+            dict(labels)['span']: {'count': entry[2], 'seconds': round(entry[1], 6)}
+            for (name, labels), entry in _histograms.items()
+            if name == 'stockai_span_seconds'
+        }
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    samples = {}
+    with _lock:
+        collectors = list(_collectors)
+        types = dict(_types)
+        helps = dict(_help)
+        for (name, labels), value in _counters.items():
+            samples.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), (buckets, total, count) in _histograms.items():
+            lines = samples.setdefault(name, [])
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_labels(labels, [('le', _number(bound))])} {bucket_count}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    for collect in collectors:
+        try:
+            for name, kind, help_text, labels, value in collect():
+                if value is None:
+                    continue
+                types.setdefault(name, kind)
+                helps.setdefault(name, help_text)
+                samples.setdefault(name, []).append(f"{name}{_labels(sorted(labels.items()))} {_number(value)}")
+        except Exception as e:
+            logger.warning(f"⚠️ Metrics collector failed: {e}")
+    out = []
+    for name in sorted(samples):
+        if name in helps:
+            out.append(f"# HELP {name} {helps[name]}")
+        out.append(f"# TYPE {name} {types.get(name, 'untyped')}")
+        out.extend(samples[name])
+    return '\n'.join(out) + '\n'
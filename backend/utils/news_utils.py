@@ -1,7 +1,18 @@
-import requests
+import os
+import re
+from utils import http_client
 from config import NEWS_API_KEY, NEWS_API_URL
+from utils.log import get_logger
 
-def fetch_news(query, page_size=5):
+logger = get_logger("news")
+
+NEWS_BATCH_SIZE = int(os.getenv("NEWS_BATCH_SIZE", "5"))
+NEWS_MIN_ARTICLES = int(os.getenv("NEWS_MIN_ARTICLES", "2"))
+NEWS_MAX_PAGE_SIZE = 100  # NewsAPI hard limit
+
+
+def fetch_news(query, page_size=5, from_time=None):
+    """Articles NewsAPI returns for the query, or None when the request failed."""
     try:
         params = {
             'q': query,
@@ -10,13 +21,128 @@ def fetch_news(query, page_size=5):
             'pageSize': page_size,
             'apiKey': NEWS_API_KEY
         }
-        response = requests.get(NEWS_API_URL, params=params)
+        if from_time is not None:
+            params['from'] = from_time.strftime('%Y-%m-%dT%H:%M:%S')
+        response = http_client.get(NEWS_API_URL, params=params, provider='newsapi')
         if response.status_code != 200:
-            print(f"❌ News API error: {response.status_code} - {response.text}")
-            raise RuntimeError(f"News fetch failed: {response.status_code} — {response.text}")
+            logger.warning(f"❌ News API error for '{query}': {response.status_code} - {response.text}")
+            return None
         articles = response.json().get('articles', [])
-        print(f"✅ Fetched {len(articles)} articles for '{query}'")
+        logger.debug("✅ Fetched %d articles for '%s'", len(articles), query)
         return articles
     except Exception as e:
-        print(f"❌ Error fetching news for '{query}': {e}")
-        return [] 
\ No newline at end of file
+        logger.warning(f"❌ Error fetching news for '{query}': {e}")
+        return None
+
+
+_NAME_SUFFIXES = {
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited',
+    'plc', 'llc', 'lp', 'holdings', 'group', 'sa', 'nv', 'ag', 'the', 'class', 'a', 'b', 'c'
+}
+
+
+def short_company_name(name):
+    """'Apple Inc.' -> 'Apple', 'Alphabet Inc. Class A' -> 'Alphabet'."""
+    words = re.sub(r'[^\w&\'\- ]', ' ', name or '').split()
+    while words and words[-1].lower() in _NAME_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+def _ticker_patterns(ticker, name):
+    symbol = re.escape(ticker)
+    if len(ticker) >= 3:
+        patterns = [re.compile(rf'(?<![A-Za-z0-9])\$?{symbol}(?![A-Za-z0-9])')]
+    else:
+        # Short symbols like "A" or "IT" are ordinary words; only trust cashtags and "(IT)"/"NYSE: IT"
+        patterns = [re.compile(rf'(\${symbol}|\({symbol}\)|:\s?{symbol})(?![A-Za-z0-9])')]
+    short_name = short_company_name(name)
+    if short_name:
+        patterns.append(re.compile(rf'\b{re.escape(short_name)}\b', re.IGNORECASE))
+    return patterns
+
+
+def _query_term(ticker, name):
+    short_name = short_company_name(name)
+    return f'({ticker} OR "{short_name}")' if short_name else ticker
+
+
+def _is_newer(article, since):
+    # publishedAt is ISO 8601 UTC ('2024-05-01T12:00:00Z'), so string order is time order.
+    # Inclusive, so articles sharing the high-water second are not lost; the
+    # (stock_ticker, url) unique key drops the ones already stored.
+    return since is None or (article.get('publishedAt') or '') >= since.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def fetch_news_batch(tickers, names=None, page_size=5, batch_size=NEWS_BATCH_SIZE, min_articles=NEWS_MIN_ARTICLES, since=None, budget=None):
+    """Fetch news for many tickers with one OR query per group of tickers.
+
+    Returned articles are attributed to every ticker whose symbol or company
+    name (from `names`, e.g. stock.stock_name) appears in the title or
+    description, keeping at most `page_size` per ticker. `since` maps
+    tickers to the publish time of their newest stored article; only newer
+    articles are requested and kept for them. Tickers with no stored
+    history that end up with fewer than `min_articles` fall back to the
+    single-ticker fetch_news query. Returns {ticker: [article, ...]}.
+
+    `budget`, when given, is asked before every NewsAPI request; a request
+    it refuses is not made, and tickers that were never queried because of
+    that are left out of the result. So are tickers whose query failed, so
+    callers never record them as checked.
+    """
+    names = names or {}
+    since = since or {}
+    tickers = list(dict.fromkeys(tickers))
+    articles_by_ticker = {ticker: [] for ticker in tickers}
+    queried = set()
+    failed = set()
+    for start in range(0, len(tickers), batch_size):
+        group = tickers[start:start + batch_size]
+        if len(group) == 1:
+            continue  # Covered by the single-ticker fallback below
+        if budget is not None and not budget():
+            continue
+        query = ' OR '.join(_query_term(ticker, names.get(ticker)) for ticker in group)
+        group_since = [since.get(ticker) for ticker in group]
+        from_time = min(group_since) if all(group_since) else None
+        articles = fetch_news(query, page_size=min(NEWS_MAX_PAGE_SIZE, page_size * len(group) * 2), from_time=from_time)
+        if articles is None:
+            # NewsAPI is failing; don't spend more requests on these tickers this round
+            failed.update(group)
+            continue
+        queried.update(group)
+        patterns = {ticker: _ticker_patterns(ticker, names.get(ticker)) for ticker in group}
+        for article in articles:
+            text = f"{article.get('title') or ''} {article.get('description') or ''}"
+            for ticker in group:
+                if len(articles_by_ticker[ticker]) >= page_size or not _is_newer(article, since.get(ticker)):
+                    continue
+                if any(pattern.search(text) for pattern in patterns[ticker]):
+                    articles_by_ticker[ticker].append(article)
+    for ticker in tickers:
+        if ticker in failed:
+            del articles_by_ticker[ticker]
+            continue
+        found = articles_by_ticker[ticker]
+        if ticker in queried and (since.get(ticker) is not None or len(found) >= min_articles):
+            # Known tickers with nothing new are expected; only cold tickers need the fallback
+            continue
+        if budget is not None and not budget():
+            if ticker not in queried:
+                del articles_by_ticker[ticker]
+            continue
+        logger.debug("🔎 Only %d batched articles for %s, querying it alone", len(found), ticker)
+        articles = fetch_news(ticker + " stock", page_size=page_size, from_time=since.get(ticker))
+        if articles is None:
+            # Keep what the batched query found; a ticker with no successful query at all stays unchecked
+            if ticker not in queried:
+                del articles_by_ticker[ticker]
+            continue
+        seen_urls = {article.get('url') for article in found}
+        for article in articles:
+            if len(found) >= page_size:
+                break
+            if article.get('url') not in seen_urls and _is_newer(article, since.get(ticker)):
+                found.append(article)
+                seen_urls.add(article.get('url'))
+    return articles_by_ticker
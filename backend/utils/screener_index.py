@@ -0,0 +1,241 @@
+import os
+import math
+import time
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from db import db_connection, upsert_sql, to_datetime
+from utils import http_client
+from utils.http_client import TokenBucket
+from utils.metric_store import metric_store, beta_of, market_cap_of, eps_of, pe_of
+from utils.log import get_logger
+
+SCREENER_REFRESH_BATCH = int(os.getenv("SCREENER_REFRESH_BATCH", "50"))
+SCREENER_REFRESH_INTERVAL = float(os.getenv("SCREENER_REFRESH_INTERVAL", "60"))
+SCREENER_MAX_AGE = float(os.getenv("SCREENER_MAX_AGE", "86400"))
+SCREENER_SYMBOLS_MAX_AGE = float(os.getenv("SCREENER_SYMBOLS_MAX_AGE", "86400"))
+SCREENER_MIN_ROWS = int(os.getenv("SCREENER_MIN_ROWS", "500"))
+# The refresher's own share of Finnhub, and the tokens of the shared limit it
+# leaves free so interactive metric fetches never queue behind it
+SCREENER_FINNHUB_PER_HOUR = float(os.getenv("SCREENER_FINNHUB_PER_HOUR", "600"))
+SCREENER_FINNHUB_RESERVE = float(os.getenv("SCREENER_FINNHUB_RESERVE", "5"))
+
+NAN = float('nan')
+
+logger = get_logger("qre")
+
+def _value(value):
+    return NAN if value is None else float(value)
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+class ScreenerIndex:
+    """In-process snapshot of the US stock universe for beta x market-cap screening.
+
+    Each metric lives in its own array('d') column (NaN when unknown), one
+    row per symbol. Two sorted indexes over rows with both beta and market
+    cap answer range queries with bisect. The snapshot is persisted in the
+    screener_universe table, loaded at startup, and refreshed in the
+    background a batch of the stalest symbols at a time, within its own
+    Finnhub budget and only while the shared rate limit has room to spare.
+    Refreshed blobs go straight into the snapshot, not into metric_store.
+    """
+
+    def __init__(self, symbol_source):
+        self.symbol_source = symbol_source
+        self._lock = threading.Lock()
+        self._rows = {}
+        self.symbols = []
+        self.beta = array('d')
+        self.market_cap = array('d')
+        self.eps = array('d')
+        self.pe_ratio = array('d')
+        self.updated_at = array('d')
+        self._beta_sorted = array('d')
+        self._beta_rows = array('l')
+        self._cap_sorted = array('d')
+        self._cap_rows = array('l')
+        self._symbols_loaded_at = 0.0
+        # Last failed fetch per symbol; only orders the retry queue, never persisted
+        self._failed_at = {}
+        self._budget = TokenBucket(SCREENER_FINNHUB_PER_HOUR / 60.0, SCREENER_REFRESH_BATCH)
+        self.budget_deferrals = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Snapshot maintenance ---
+    def _upsert(self, symbol, beta, market_cap, eps, pe_ratio, updated_at):
+        # Caller holds _lock
+        row = self._rows.get(symbol)
+        if row is None:
+            row = len(self.symbols)
+            self._rows[symbol] = row
+            self.symbols.append(symbol)
+            for column in (self.beta, self.market_cap, self.eps, self.pe_ratio, self.updated_at):
+                column.append(NAN)
+            self.updated_at[row] = 0.0
+        self.beta[row] = _value(beta)
+        self.market_cap[row] = _value(market_cap)
+        self.eps[row] = _value(eps)
+        self.pe_ratio[row] = _value(pe_ratio)
+        self.updated_at[row] = updated_at
+
+    def _rebuild_indexes(self):
+        # Caller holds _lock
+        rows = [
+            row for row in range(len(self.symbols))
+            if not math.isnan(self.beta[row]) and not math.isnan(self.market_cap[row])
+        ]
+        by_beta = sorted(rows, key=self.beta.__getitem__)
+        by_cap = sorted(rows, key=self.market_cap.__getitem__)
+        self._beta_rows = array('l', by_beta)
+        self._beta_sorted = array('d', (self.beta[row] for row in by_beta))
+        self._cap_rows = array('l', by_cap)
+        self._cap_sorted = array('d', (self.market_cap[row] for row in by_cap))
+
+    def load(self):
+        """Load the persisted snapshot from the database."""
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT symbol, beta, market_cap, eps, pe_ratio, updated_at FROM screener_universe")
+            rows = cur.fetchall()
+            cur.close()
+        with self._lock:
+            for symbol, beta, market_cap, eps, pe_ratio, updated_at in rows:
+                updated_at = to_datetime(updated_at)
+                self._upsert(symbol, beta, market_cap, eps, pe_ratio, updated_at.timestamp() if updated_at else 0.0)
+            self._rebuild_indexes()
+        logger.info(f"[QRE] screener: loaded {len(rows)} symbols, {len(self._beta_rows)} screenable")
+
+    def _refresh_symbols(self):
+        symbols = [symbol for symbol in self.symbol_source() if symbol and len(symbol) <= 4]
+        with self._lock:
+            for symbol in symbols:
+                if symbol not in self._rows:
+                    self._upsert(symbol, None, None, None, None, 0.0)
+        self._symbols_loaded_at = time.time()
+        logger.info(f"[QRE] screener: universe has {len(symbols)} symbols")
+
+    def _queue_key(self, row):
+        # Caller holds _lock
+        return max(self.updated_at[row], self._failed_at.get(self.symbols[row], 0.0))
+
+    def refresh_batch(self, batch_size=SCREENER_REFRESH_BATCH):
+        """Refresh metrics for the stalest symbols; returns how many were refreshed."""
+        if batch_size <= 0:
+            return 0
+        if time.time() - self._symbols_loaded_at > SCREENER_SYMBOLS_MAX_AGE:
+            self._refresh_symbols()
+        now = time.time()
+        with self._lock:
+            stale = sorted(
+                (row for row in range(len(self.symbols)) if now - self.updated_at[row] > SCREENER_MAX_AGE),
+                key=self._queue_key
+            )[:batch_size]
+            symbols = [self.symbols[row] for row in stale]
+        updates = []
+        for done, symbol in enumerate(symbols):
+            if http_client.headroom('finnhub') < SCREENER_FINNHUB_RESERVE or not self._budget.try_acquire():
+                # Interactive callers need the limit or the budget is spent; the rest stays stalest for next time
+                self.budget_deferrals += len(symbols) - done
+                break
+            metrics = metric_store.fetch(symbol)
+            if metrics is None:
+                # updated_at keeps meaning "last successful fetch"; the symbol just goes to the back of the queue
+                with self._lock:
+                    self._failed_at[symbol] = now
+                continue
+            updates.append((symbol, beta_of(metrics), market_cap_of(metrics), eps_of(metrics), pe_of(metrics)))
+        if not updates:
+            return 0
+        with self._lock:
+            for symbol, beta, market_cap, eps, pe_ratio in updates:
+                self._upsert(symbol, beta, market_cap, eps, pe_ratio, now)
+                self._failed_at.pop(symbol, None)
+            self._rebuild_indexes()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            # updated_at is local time, matching how load() turns it back into a timestamp
+            updated_at = datetime.fromtimestamp(now).replace(microsecond=0)
+            cur.executemany(upsert_sql(
+                'screener_universe',
+                ('symbol', 'beta', 'market_cap', 'eps', 'pe_ratio', 'updated_at'),
+                ('symbol',),
+                ('beta', 'market_cap', 'eps', 'pe_ratio', 'updated_at')
+            ), [update + (updated_at,) for update in updates])
+            cur.close()
+        return len(updates)
+
+    def _refresh_loop(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.warning(f"[QRE] screener: could not load snapshot: {e}")
+        while not self._stop.is_set():
+            try:
+                refreshed = self.refresh_batch()
+            except Exception as e:
+                logger.exception(f"[QRE] screener: refresh failed: {e}")
+                refreshed = 0
+            # Catch up quickly while the snapshot is incomplete and full batches fit the budget, then idle between batches
+            full = refreshed and refreshed >= SCREENER_REFRESH_BATCH
+            self._stop.wait(1.0 if full and not self.is_ready() else SCREENER_REFRESH_INTERVAL)
+
+    def start(self):
+        """Start the background refresher once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="screener-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # --- Queries ---
+    def is_ready(self):
+        return len(self._beta_rows) >= SCREENER_MIN_ROWS
+
+    def query(self, beta_min, beta_max, marketcap_min, marketcap_max, limit=None):
+        """Rows with beta and market cap in range, largest market cap first."""
+        with self._lock:
+            beta_lo = bisect_left(self._beta_sorted, beta_min)
+            beta_hi = bisect_right(self._beta_sorted, beta_max)
+            cap_lo = bisect_left(self._cap_sorted, marketcap_min)
+            cap_hi = bisect_right(self._cap_sorted, marketcap_max)
+            # Scan whichever index gives the narrower slice and filter on the other column
+            if beta_hi - beta_lo <= cap_hi - cap_lo:
+                rows = [
+                    row for row in self._beta_rows[beta_lo:beta_hi]
+                    if marketcap_min <= self.market_cap[row] <= marketcap_max
+                ]
+            else:
+                rows = [
+                    row for row in self._cap_rows[cap_lo:cap_hi]
+                    if beta_min <= self.beta[row] <= beta_max
+                ]
+            rows.sort(key=self.market_cap.__getitem__, reverse=True)
+            if limit is not None:
+                rows = rows[:limit]
+            return [
+                {
+                    'symbol': self.symbols[row],
+                    'beta': self.beta[row],
+                    'market_cap': self.market_cap[row],
+                    'eps': _optional(self.eps[row]),
+                    'pe_ratio': _optional(self.pe_ratio[row]),
+                }
+                for row in rows
+            ]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'symbols': len(self.symbols),
+                'screenable': len(self._beta_rows),
+                'ready': len(self._beta_rows) >= SCREENER_MIN_ROWS,
+                'refresher_running': self._thread is not None and self._thread.is_alive(),
+                'budget_deferrals': self.budget_deferrals,
+            }
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import threading
+from utils.http_client import call_with_retries, upstream_url, UPSTREAM_OVERRIDES
+from utils.log import get_logger
+
+FINBERT_MODEL = "ProsusAI/finbert"
+HF_INFERENCE_URL = f"https://api-inference.huggingface.co/models/{FINBERT_MODEL}"
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "remote").lower()
+LOCAL_BATCH_SIZE = int(os.getenv("SENTIMENT_LOCAL_BATCH_SIZE", "32"))
+LOCAL_QUANTIZE = os.getenv("SENTIMENT_LOCAL_QUANTIZE", "1") == "1"
+
+logger = get_logger("sentiment")
+
+# Every backend returns, per input text, the same list of {'label', 'score'}
+# dicts that the hosted FinBERT endpoint does, so compute_scalar_score works
+# unchanged whichever backend is selected.
+
+class RemoteFinbertBackend:
+    """FinBERT served by the Hugging Face Inference API."""
+    name = "remote"
+
+    def __init__(self):
+        from huggingface_hub import InferenceClient
+        from config import HUGGINGFACE_TOKEN
+        # InferenceClient accepts a full URL in place of a model id
+        model = upstream_url(HF_INFERENCE_URL, 'hf') if 'hf' in UPSTREAM_OVERRIDES else FINBERT_MODEL
+        self.client = InferenceClient(model=model, token=HUGGINGFACE_TOKEN)
+
+    def classify(self, text):
+        return call_with_retries('hf', lambda: self.client.text_classification(text))
+
+    def classify_batch(self, texts):
+        response = call_with_retries(
+            'hf', lambda: self.client.post(json={"inputs": list(texts)}, task="text-classification")
+        )
+        return json.loads(response)
+
+class LocalFinbertBackend:
+    """FinBERT running on the local CPU.
+
+    The model is loaded once per process on first use and, by default,
+    dynamically quantized to int8. torch uses all cores for each batch.
+    """
+    name = "local"
+
+    def __init__(self, batch_size=LOCAL_BATCH_SIZE, quantize=LOCAL_QUANTIZE):
+        self.batch_size = batch_size
+        self.quantize = quantize
+        self._model = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        # One forward pass at a time; torch already parallelizes inside it
+        self._infer_lock = threading.Lock()
+
+    def _load(self):
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is not None:
+                return
+            import torch
+            from transformers import AutoTokenizer, AutoModelForSequenceClassification
+            torch.set_num_threads(os.cpu_count() or 1)
+            tokenizer = AutoTokenizer.from_pretrained(FINBERT_MODEL)
+            model = AutoModelForSequenceClassification.from_pretrained(FINBERT_MODEL)
+            model.eval()
+            if self.quantize:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._tokenizer = tokenizer
+            self._model = model
+            logger.info(f"✅ Local FinBERT loaded (int8={self.quantize}, threads={torch.get_num_threads()})")
+
+    def classify(self, text):
+        return self.classify_batch([text])[0]
+
+    def classify_batch(self, texts):
+        import torch
+        self._load()
+        id2label = self._model.config.id2label
+        results = []
+        for start in range(0, len(texts), self.batch_size):
+            chunk = list(texts[start:start + self.batch_size])
+            inputs = self._tokenizer(chunk, padding=True, truncation=True, max_length=512, return_tensors="pt")
+            with self._infer_lock, torch.inference_mode():
+                probs = torch.softmax(self._model(**inputs).logits, dim=-1).tolist()
+            for row in probs:
+                labels = [{'label': id2label[i], 'score': score} for i, score in enumerate(row)]
+                results.append(sorted(labels, key=lambda item: item['score'], reverse=True))
+        return results
+
+class StubSentimentBackend:
+    """Deterministic offline backend for tests and benchmarks.
+
+    Scores are derived from a hash of the text, so the same text always gets
+    the same label distribution and no model or network is needed.
+    """
+    name = "stub"
+
+    def classify(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        weights = [digest[0] + 1, digest[1] + 1, digest[2] + 1]
+        total = sum(weights)
+        labels = [
+            {'label': label, 'score': round(weight / total, 4)}
+            for label, weight in zip(('positive', 'neutral', 'negative'), weights)
+        ]
+        return sorted(labels, key=lambda item: item['score'], reverse=True)
+
+    def classify_batch(self, texts):
+        return [self.classify(text) for text in texts]
+
+SENTIMENT_BACKENDS = {
+    'remote': RemoteFinbertBackend,
+    'local': LocalFinbertBackend,
+    'stub': StubSentimentBackend,
+}
+
+def create_sentiment_backend(name=SENTIMENT_BACKEND):
+    if name not in SENTIMENT_BACKENDS:
+        raise ValueError(f"Unknown sentiment backend '{name}', expected one of {sorted(SENTIMENT_BACKENDS)}")
+    return SENTIMENT_BACKENDS[name]()
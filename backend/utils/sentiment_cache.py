@@ -0,0 +1,96 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from db import db_connection, insert_ignore_sql
+from utils.metrics import register_stats
+from utils.log import get_logger
+
+logger = get_logger("sentiment")
+
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "10000"))
+
+# Scores keyed by the sha256 of the normalized article text. The in-process
+# LRU sits in front of the sentiment_cache table, which survives restarts.
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+def normalize_text(text):
+    return ' '.join((text or '').lower().split())
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def _remember(key, score):
+    # Caller holds _lru_lock
+    _lru[key] = score
+    _lru.move_to_end(key)
+    while len(_lru) > SENTIMENT_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+def lookup_scores(hashes):
+    """Return {hash: score} for every hash already scored, memory first, then DB."""
+    found = {}
+    missing = []
+    with _lru_lock:
+        for key in dict.fromkeys(hashes):
+            if key in _lru:
+                _lru.move_to_end(key)
+                found[key] = _lru[key]
+            else:
+                missing.append(key)
+        _stats['memory_hits'] += len(found)
+    if missing:
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT text_hash, sent_score FROM sentiment_cache WHERE text_hash IN ({})".format(','.join(['%s'] * len(missing))),
+                    missing
+                )
+                db_rows = {row[0]: float(row[1]) for row in cursor.fetchall()}
+                cursor.close()
+        except Exception as e:
+            logger.exception(f"❌ Error reading sentiment cache: {e}")
+            db_rows = {}
+        with _lru_lock:
+            for key, score in db_rows.items():
+                _remember(key, score)
+            _stats['db_hits'] += len(db_rows)
+            _stats['misses'] += len(missing) - len(db_rows)
+        found.update(db_rows)
+    return found
+
+def store_scores(scores_by_hash):
+    if not scores_by_hash:
+        return
+    with _lru_lock:
+        for key, score in scores_by_hash.items():
+            _remember(key, score)
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                insert_ignore_sql('sentiment_cache', ('text_hash', 'sent_score')),
+                list(scores_by_hash.items())
+            )
+            cursor.close()
+    except Exception as e:
+        logger.exception(f"❌ Error writing sentiment cache: {e}")
+
+def clear_memory():
+    """Drop the in-process LRU; the sentiment_cache table is left as is."""
+    with _lru_lock:
+        _lru.clear()
+
+def get_cache_stats():
+    with _lru_lock:
+        stats = dict(_stats)
+        stats['memory_entries'] = len(_lru)
+    lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 4) if lookups else 0.0
+    return stats
+
+register_stats('stockai_sentiment_cache', get_cache_stats, counters=('memory_hits', 'db_hits', 'misses'),
+               gauges=('memory_entries',), help='Article sentiment cache')
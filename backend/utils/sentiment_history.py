@@ -0,0 +1,233 @@
+import os
+import math
+import threading
+from array import array
+from datetime import datetime
+from utils.metrics import register_stats
+
+SENTIMENT_HISTORY_SIZE = int(os.getenv("SENTIMENT_HISTORY_SIZE", "256"))
+SENTIMENT_WINDOW = int(os.getenv("NEWS_AGGREGATE_WINDOW", "5"))
+SENTIMENT_HALFLIFE = float(os.getenv("SENTIMENT_HALFLIFE", "86400"))
+
+def _timestamp(value):
+    # Unknown publication times count as the oldest possible, live and on rebuild alike
+    if value is None:
+        return 0.0
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp()
+    return float(value)
+
+class SentimentHistory:
+    """Fixed-size ring buffers of (timestamp, score) per ticker, with O(1) aggregates.
+
+    Every ticker owns a slot of `capacity` entries in two preallocated
+    array('d') columns, so memory is capacity * 16 bytes per ticker (plus
+    the URLs of the entries held) however much news arrives. An article
+    whose URL is already in the ticker's ring is ignored, the way the news
+    table's (stock_ticker, url) key ignores it. Each add() updates, in
+    constant time:
+
+    - the mean of the last `window` entries (running sum; the entry leaving
+      the window is still in the ring because window <= capacity), and
+    - a time-decayed EWMA with half-life `halflife` seconds, kept as decayed
+      sums relative to the newest timestamp so late articles weigh exactly
+      what their age says.
+
+    Entries are expected roughly in time order; the window is over arrival
+    order, so when articles arrive out of publication order it can differ
+    from a window over the latest-published articles until a rebuild.
+    rebuild() loads the latest `capacity` scored articles per ticker from
+    the news table, oldest published first.
+    """
+
+    def __init__(self, capacity=SENTIMENT_HISTORY_SIZE, window=SENTIMENT_WINDOW, halflife=SENTIMENT_HALFLIFE):
+        self.capacity = max(1, capacity)
+        self.window = max(1, min(window, self.capacity))
+        self._decay = math.log(2) / halflife
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._free = []
+        self.times = array('d')
+        self.scores = array('d')
+        # Per-slot state
+        self._head = array('l')      # next position to write
+        self._count = array('l')     # entries written, capped at capacity
+        self._window_sum = array('d')
+        self._ewma_sum = array('d')  # sum of score * weight, weights relative to _ewma_ref
+        self._ewma_weight = array('d')
+        self._ewma_ref = array('d')  # newest timestamp seen
+        self._url_at = []            # URL per ring position
+        self._url_set = []           # URLs currently in the ring
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self.rebuilds = 0
+
+    # --- Slots ---
+    def _slot(self, ticker):
+        # Caller holds _lock
+        slot = self._slots.get(ticker)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._head)
+            self.times.extend(array('d', bytes(8 * self.capacity)))
+            self.scores.extend(array('d', bytes(8 * self.capacity)))
+            for column in (self._head, self._count):
+                column.append(0)
+            for column in (self._window_sum, self._ewma_sum, self._ewma_weight, self._ewma_ref):
+                column.append(0.0)
+            self._url_at.append(None)
+            self._url_set.append(None)
+        self._url_at[slot] = [None] * self.capacity
+        self._url_set[slot] = set()
+        self._head[slot] = self._count[slot] = 0
+        self._window_sum[slot] = self._ewma_sum[slot] = self._ewma_weight[slot] = 0.0
+        self._ewma_ref[slot] = -math.inf
+        self._slots[ticker] = slot
+        return slot
+
+    def _add(self, slot, timestamp, score, url=None):
+        # Caller holds _lock; returns False for an article already in the ring
+        urls = self._url_set[slot]
+        if url is not None and url in urls:
+            return False
+        base = slot * self.capacity
+        head = self._head[slot]
+        count = self._count[slot]
+        evicted = self._url_at[slot][head]
+        if evicted is not None:
+            urls.discard(evicted)
+        self._url_at[slot][head] = url
+        if url is not None:
+            urls.add(url)
+        if count >= self.window:
+            self._window_sum[slot] -= self.scores[base + (head - self.window) % self.capacity]
+        self._window_sum[slot] += score
+        self.times[base + head] = timestamp
+        self.scores[base + head] = score
+        self._head[slot] = (head + 1) % self.capacity
+        self._count[slot] = min(count + 1, self.capacity)
+
+        ref = self._ewma_ref[slot]
+        if timestamp > ref:
+            if ref != -math.inf:
+                factor = math.exp(-self._decay * (timestamp - ref))
+                self._ewma_sum[slot] *= factor
+                self._ewma_weight[slot] *= factor
+            self._ewma_ref[slot] = ref = timestamp
+        weight = math.exp(-self._decay * (ref - timestamp))
+        self._ewma_sum[slot] += score * weight
+        self._ewma_weight[slot] += weight
+        return True
+
+    def add(self, ticker, timestamp, score, url=None):
+        """Record one scored article; timestamp is a datetime, 'YYYY-MM-DD HH:MM:SS', epoch seconds or None (unknown)."""
+        timestamp = _timestamp(timestamp)
+        with self._lock:
+            return self._add(self._slot(ticker), timestamp, float(score), url)
+
+    def add_many(self, ticker, entries):
+        """Record (timestamp, score, url) entries, oldest first; returns how many were new."""
+        with self._lock:
+            slot = self._slot(ticker)
+            return sum(self._add(slot, _timestamp(timestamp), float(score), url) for timestamp, score, url in entries)
+
+    def discard(self, tickers):
+        with self._lock:
+            for ticker in tickers:
+                slot = self._slots.pop(ticker, None)
+                if slot is not None:
+                    self._free.append(slot)
+
+    # --- Reads ---
+    def window_mean(self, ticker):
+        """Mean of the last `window` scores, or None when the ticker has none."""
+        with self._lock:
+            slot = self._slots.get(ticker)
+            if slot is None or not self._count[slot]:
+                return None
+            return round(self._window_sum[slot] / min(self._count[slot], self.window), 4)
+
+    def ewma(self, ticker):
+        with self._lock:
+            slot = self._slots.get(ticker)
+            if slot is None or not self._ewma_weight[slot]:
+                return None
+            return round(self._ewma_sum[slot] / self._ewma_weight[slot], 4)
+
+    def summary(self, ticker):
+        """{'window_mean', 'ewma', 'count', 'latest'} for ticker, or None."""
+        with self._lock:
+            slot = self._slots.get(ticker)
+            if slot is None or not self._count[slot]:
+                return None
+            count = self._count[slot]
+            weight = self._ewma_weight[slot]
+            return {
+                'window_mean': round(self._window_sum[slot] / min(count, self.window), 4),
+                'ewma': round(self._ewma_sum[slot] / weight, 4) if weight else None,
+                'count': count,
+                'latest': datetime.fromtimestamp(self._ewma_ref[slot]).isoformat() if self._ewma_ref[slot] > 0 else None,
+            }
+
+    def entries(self, ticker):
+        """[(timestamp, score), ...] oldest first."""
+        with self._lock:
+            slot = self._slots.get(ticker)
+            if slot is None:
+                return []
+            base, head, count = slot * self.capacity, self._head[slot], self._count[slot]
+            positions = [(head - count + i) % self.capacity for i in range(count)]
+            return [(self.times[base + i], self.scores[base + i]) for i in positions]
+
+    # --- Loading ---
+    def rebuild(self):
+        """Replace the buffers with the latest `capacity` scored articles per ticker in the news table."""
+        from db import db_connection
+        from news_store import get_recent_news_scores
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT stock_ticker FROM news")
+            tickers = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        recent = get_recent_news_scores(tickers, self.capacity)
+        with self._lock:
+            self._slots, self._free = {}, []
+            for column in (self.times, self.scores, self._head, self._count, self._url_at, self._url_set,
+                           self._window_sum, self._ewma_sum, self._ewma_weight, self._ewma_ref):
+                del column[:]
+            for ticker, rows in recent.items():
+                slot = self._slot(ticker)
+                # Same order the aggregate always used: published time, unknown dates oldest
+                for published_at, score, url in sorted(rows, key=lambda row: row[0] or datetime.min):
+                    self._add(slot, _timestamp(published_at), score, url)
+            self._loaded = True
+            self.rebuilds += 1
+        return len(recent)
+
+    def ensure_loaded(self):
+        """Rebuild once per process before the first read."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.rebuild()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'tickers': len(self._slots),
+                'entries': sum(self._count[slot] for slot in self._slots.values()),
+                'capacity': self.capacity,
+                'window': self.window,
+                'bytes': (self.times.itemsize * len(self.times)) + (self.scores.itemsize * len(self.scores)),
+                'rebuilds': self.rebuilds,
+            }
+
+sentiment_history = SentimentHistory()
+register_stats('stockai_sentiment_history', sentiment_history.get_stats, counters=('rebuilds',),
+               gauges=('tickers', 'entries', 'bytes'), help='In-memory sentiment history')
@@ -1,26 +1,64 @@
-from huggingface_hub import InferenceClient
-from config import HUGGINGFACE_TOKEN
+import os
+from utils.sentiment_backends import SENTIMENT_BACKEND, create_sentiment_backend
+from utils.log import get_logger
+from utils.metrics import span, inc
+
+logger = get_logger("sentiment")
+
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "16"))
 
 try:
-    finbert_client = InferenceClient(model="ProsusAI/finbert", token=HUGGINGFACE_TOKEN)
+    sentiment_backend = create_sentiment_backend(SENTIMENT_BACKEND)
+    logger.info(f"✅ Sentiment backend: {sentiment_backend.name}")
 except Exception as e:
-    print(f"❌ Error initializing FinBERT client: {e}")
-    finbert_client = None
+    logger.error(f"❌ Error initializing sentiment backend '{SENTIMENT_BACKEND}': {e}")
+    sentiment_backend = None
 
 def analyze_sentiment(text):
     if not text or text.strip() == "":
         return []
-    if finbert_client is None:
-        print("❌ FinBERT client not available")
+    if sentiment_backend is None:
+        logger.error("❌ Sentiment backend not available")
         return []
     try:
-        result = finbert_client.text_classification(text)
-        print(f"✅ Sentiment analysis completed for text: {text[:50]}...")
+        with span('inference'):
+            result = sentiment_backend.classify(text)
+        inc('stockai_inference_texts_total', help='Texts sent to the sentiment backend')
+        logger.debug("✅ Sentiment analysis completed for text: %s...", text[:50])
         return result
     except Exception as e:
-        print(f"❌ Error in sentiment analysis: {e}")
+        inc('stockai_inference_errors_total', help='Failed sentiment backend calls')
+        logger.error(f"❌ Error in sentiment analysis: {e}")
         return []
 
+def analyze_sentiment_batch(texts, batch_size=SENTIMENT_BATCH_SIZE):
+    """Score many texts with one backend call per batch.
+
+    Returns one label/score list per input text, in input order. Empty texts
+    and texts from a failed batch get an empty list, like analyze_sentiment.
+    """
+    results = [[] for _ in texts]
+    pending = [(i, text) for i, text in enumerate(texts) if text and text.strip() != ""]
+    if not pending:
+        return results
+    if sentiment_backend is None:
+        logger.error("❌ Sentiment backend not available")
+        return results
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        try:
+            with span('inference', texts=len(chunk)):
+                batch_result = sentiment_backend.classify_batch([text for _, text in chunk])
+        except Exception as e:
+            inc('stockai_inference_errors_total', help='Failed sentiment backend calls')
+            logger.error(f"❌ Error in batch sentiment analysis: {e}")
+            continue
+        inc('stockai_inference_texts_total', len(chunk), help='Texts sent to the sentiment backend')
+        for (i, _), result in zip(chunk, batch_result):
+            results[i] = result
+        logger.debug("✅ Sentiment analysis completed for batch of %d texts", len(chunk))
+    return results
+
 def compute_scalar_score(result):
     if not result:
         return 0.0
@@ -30,12 +68,16 @@ def compute_scalar_score(result):
         if label in score_map:
             score_map[label] = item['score']
     score = round(score_map['positive'] - score_map['negative'], 4)
-    print(f"📊 Computed score: {score} (pos: {score_map['positive']}, neg: {score_map['negative']})")
+    # Lazy %-formatting: this runs once per article and is silent unless LOG_LEVEL=DEBUG
+    logger.debug("📊 Computed score: %s (pos: %s, neg: %s)", score, score_map['positive'], score_map['negative'])
     return score
 
+def compute_scalar_scores(results):
+    return [compute_scalar_score(result) for result in results]
+
 def compute_average_sentiment(scores):
     if not scores:
         return 0.0
     avg = round(sum(scores) / len(scores), 4)
-    print(f"📈 Average sentiment: {avg} from {len(scores)} scores")
-    return avg 
\ No newline at end of file
+    logger.debug("📈 Average sentiment: %s from %d scores", avg, len(scores))
+    return avg
@@ -72,6 +72,44 @@ class ApiService {
     });
   }
 
+  // Stream analysis results; onStock/onPortfolio fire as each result arrives.
+  // Returns the EventSource so callers can close it early.
+  streamAnalysis(userId = 1, { onStock, onPortfolio, onDone, onError } = {}) {
+    const source = new EventSource(`${this.baseURL}/analyze-portfolios/${userId}/stream`);
+    source.addEventListener('stock', (e) => onStock && onStock(JSON.parse(e.data)));
+    source.addEventListener('portfolio', (e) => onPortfolio && onPortfolio(JSON.parse(e.data)));
+    source.addEventListener('done', () => {
+      source.close();
+      if (onDone) onDone();
+    });
+    source.addEventListener('error', (e) => {
+      source.close();
+      if (onError) onError(e.data ? JSON.parse(e.data) : { success: false, error: 'Stream connection failed' });
+    });
+    return source;
+  }
+
+  // Start a background analysis run and return its job
+  async submitAnalyzeJob(userId = 1) {
+    return this.makeRequest(`/jobs/analyze/${userId}`, {
+      method: 'POST'
+    });
+  }
+
+  // Start a background recommendation run and return its job
+  async submitRecommendationsJob(userId = 1) {
+    return this.makeRequest(`/jobs/recommendations/${userId}`, {
+      method: 'POST'
+    });
+  }
+
+  // Poll a background job for status, progress and result
+  async getJob(jobId) {
+    return this.makeRequest(`/jobs/${jobId}`, {
+      method: 'GET'
+    });
+  }
+
   // Health check endpoint
   async healthCheck() {
     return this.makeRequest('/health', {